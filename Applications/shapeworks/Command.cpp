@@ -20,11 +20,23 @@ std::vector<std::string> Command::parse_args(const std::vector<std::string> &arg
   return std::vector<std::string>(remaining_args.begin(), remaining_args.end());
 }
 
+///////////////////////////////////////////////////////////////////////////////
+std::vector<std::string> Command::parse_args(const std::vector<std::string> &arguments, optparse::Values &options)
+{
+  options = parser.parse_args(arguments);
+  auto remaining_args = parser.args();
+  return std::vector<std::string>(remaining_args.begin(), remaining_args.end());
+}
+
 ///////////////////////////////////////////////////////////////////////////////
 int Command::run(SharedCommandData &sharedData)
 {
-  const optparse::Values &options = parser.get_parsed_options();
+  return run(parser.get_parsed_options(), sharedData);
+}
 
+///////////////////////////////////////////////////////////////////////////////
+int Command::run(const optparse::Values &options, SharedCommandData &sharedData)
+{
   return this->execute(options, sharedData) ? EXIT_SUCCESS : EXIT_FAILURE;
 }
 
@@ -24,6 +24,10 @@ public:
   std::vector<std::string> parse_args(const std::vector<std::string> &arguments);
   int run(SharedCommandData &sharedData);
 
+  // parses arguments into a copy of the options (unaffected by later parses), returning the remaining arguments
+  std::vector<std::string> parse_args(const std::vector<std::string> &arguments, optparse::Values &options);
+  int run(const optparse::Values &options, SharedCommandData &sharedData);
+
 private:
   virtual int execute(const optparse::Values &options, SharedCommandData &sharedData) = 0;
 
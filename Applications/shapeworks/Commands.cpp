@@ -1,6 +1,9 @@
 #include "Commands.h"
 #include "Image.h"
+#include "ImageCache.h"
 #include <limits>
+#include <fstream>
+#include <sstream>
 
 namespace shapeworks {
 
@@ -54,6 +57,8 @@ int ReadImage::execute(const optparse::Values &options, SharedCommandData &share
 {
   std::string filename = options["name"];
 
+  if (sharedData.imageCache)
+    return sharedData.imageCache->read(filename, sharedData.image);
   return sharedData.image.read(filename);
 }
 
@@ -79,7 +84,11 @@ int WriteImage::execute(const optparse::Values &options, SharedCommandData &shar
   std::string filename = options["name"];
   bool compressed = static_cast<bool>(options.get("compressed"));
   
-  return sharedData.image.write(filename, compressed);
+  if (!sharedData.image.write(filename, compressed))
+    return false;
+  if (sharedData.imageCache)
+    sharedData.imageCache->insert(filename, sharedData.image);
+  return true;
 }
 
 
@@ -315,4 +324,358 @@ int Coverage::execute(const optparse::Values &options, SharedCommandData &shared
 }
 
 
+///////////////////////////////////////////////////////////////////////////////
+// ExtractLabel
+///////////////////////////////////////////////////////////////////////////////
+void ExtractLabel::buildParser()
+{
+  const std::string prog = "extractlabel";
+  const std::string desc = "extracts/isolates a specific voxel label from a given multi-label volume and outputs the corresponding binary image";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--label").action("store").type("float").set_default(1.0).help("The label value which has to be extracted [default 1.0].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int ExtractLabel::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  float label = static_cast<float>(options.get("label"));
+
+  return sharedData.image.extractLabel(label);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// CloseHoles
+///////////////////////////////////////////////////////////////////////////////
+void CloseHoles::buildParser()
+{
+  const std::string prog = "closeholes";
+  const std::string desc = "closes holes in a given binary volume";
+  parser.prog(prog).description(desc);
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int CloseHoles::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  return sharedData.image.closeHoles();
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// Threshold
+///////////////////////////////////////////////////////////////////////////////
+void Threshold::buildParser()
+{
+  const std::string prog = "threshold";
+  const std::string desc = "thresholds an image into a binary label based on upper and lower intensity bounds";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--min").action("store").type("float").set_default(std::numeric_limits<float>::lowest()).help("The lower threshold level [default lowest float].");
+  parser.add_option("--max").action("store").type("float").set_default(std::numeric_limits<float>::max()).help("The upper threshold level [default largest float].");
+  parser.add_option("--inside").action("store").type("float").set_default(1.0f).help("Value of pixels within [min, max] [default 1.0].");
+  parser.add_option("--outside").action("store").type("float").set_default(0.0f).help("Value of all other pixels [default 0.0].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int Threshold::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  float min = static_cast<float>(options.get("min"));
+  float max = static_cast<float>(options.get("max"));
+  float inside = static_cast<float>(options.get("inside"));
+  float outside = static_cast<float>(options.get("outside"));
+
+  return sharedData.image.threshold(min, max, inside, outside);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// FastMarching
+///////////////////////////////////////////////////////////////////////////////
+void FastMarching::buildParser()
+{
+  const std::string prog = "fastmarching";
+  const std::string desc = "computes the signed distance transform of a binary (antialiased) image";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--isovalue").action("store").type("float").set_default(0.0).help("The level set value that defines the interface between foreground and background [default 0.0].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int FastMarching::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  float isoValue = static_cast<float>(options.get("isovalue"));
+
+  return sharedData.image.fastMarch(isoValue);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// SignedDistance
+///////////////////////////////////////////////////////////////////////////////
+void SignedDistance::buildParser()
+{
+  const std::string prog = "signeddistance";
+  const std::string desc = "computes the signed distance transform of a binary (antialiased) image with an exact separable Euclidean distance transform, a faster alternative to fastmarching";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--isovalue").action("store").type("float").set_default(0.0).help("The level set value that defines the interface between foreground and background [default 0.0].");
+  parser.add_option("--threads").action("store").type("unsigned").set_default(0).help("Number of threads to use, 0 for all available [default 0].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int SignedDistance::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  float isoValue = static_cast<float>(options.get("isovalue"));
+  unsigned threads = static_cast<unsigned>(options.get("threads"));
+
+  return sharedData.image.signedDistance(isoValue, threads);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// TopologyPreservingSmooth
+///////////////////////////////////////////////////////////////////////////////
+void TopologyPreservingSmooth::buildParser()
+{
+  const std::string prog = "tpsmooth";
+  const std::string desc = "smooths a distance transform as TopologyPreservingSmoothing does for its smoothed distance transform output";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--iterations").action("store").type("int").set_default(10).help("Number of smoothing iterations [default 10].");
+  parser.add_option("--scaling").action("store").type("float").set_default(20.0).help("Propagation scaling of the topology preserving level set [default 20.0].");
+  parser.add_option("--alpha").action("store").type("float").set_default(10.5).help("Sigmoid alpha used for the level set feature image [default 10.5].");
+  parser.add_option("--beta").action("store").type("float").set_default(10.0).help("Sigmoid beta used for the level set feature image [default 10.0].");
+  parser.add_option("--levelset").action("store").type("bool").set_default(false).help("Output the topology preserving level set (the isosurface image) instead of the smoothed distance transform [default false].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int TopologyPreservingSmooth::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  unsigned iterations = static_cast<unsigned>(options.get("iterations"));
+  float scaling = static_cast<float>(options.get("scaling"));
+  float alpha = static_cast<float>(options.get("alpha"));
+  float beta = static_cast<float>(options.get("beta"));
+  bool levelset = static_cast<bool>(options.get("levelset"));
+
+  return sharedData.image.topologyPreservingSmooth(iterations, scaling, alpha, beta, levelset);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// Crop
+///////////////////////////////////////////////////////////////////////////////
+void Crop::buildParser()
+{
+  const std::string prog = "crop";
+  const std::string desc = "crops an image to the region of the given size starting at the given index";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--startx").action("store").type("int").set_default(0).help("Starting index in x-direction [default 0].");
+  parser.add_option("--starty").action("store").type("int").set_default(0).help("Starting index in y-direction [default 0].");
+  parser.add_option("--startz").action("store").type("int").set_default(0).help("Starting index in z-direction [default 0].");
+  parser.add_option("--sizex").action("store").type("unsigned").set_default(0).help("Size of the region in x-direction.");
+  parser.add_option("--sizey").action("store").type("unsigned").set_default(0).help("Size of the region in y-direction.");
+  parser.add_option("--sizez").action("store").type("unsigned").set_default(0).help("Size of the region in z-direction.");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int Crop::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  Image::ImageType::IndexType start;
+  start[0] = static_cast<int>(options.get("startx"));
+  start[1] = static_cast<int>(options.get("starty"));
+  start[2] = static_cast<int>(options.get("startz"));
+  unsigned sizeX = static_cast<unsigned>(options.get("sizex"));
+  unsigned sizeY = static_cast<unsigned>(options.get("sizey"));
+  unsigned sizeZ = static_cast<unsigned>(options.get("sizez"));
+
+  return sharedData.image.crop(start, Dims({sizeX, sizeY, sizeZ}));
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// TranslateCenterOfMass
+///////////////////////////////////////////////////////////////////////////////
+void TranslateCenterOfMass::buildParser()
+{
+  const std::string prog = "translatecom";
+  const std::string desc = "translates a binary image so its center of mass is at the center of the image, keeping the translation for applytranslation";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--parameterfile").action("store").type("string").set_default("").help("Optional filename to store the translation.");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int TranslateCenterOfMass::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  std::string parameterFilename = options["parameterfile"];
+
+  Point3 com = sharedData.image.centerOfMass();
+  Point3 center = sharedData.image.center();
+  sharedData.imageTransform = Image::TransformType::New();
+  sharedData.imageTransform->Translate(com - center);
+
+  if (!parameterFilename.empty())
+  {
+    // same format as the translation written by TranslateShapeToImageOrigin
+    auto translation = sharedData.imageTransform->GetOffset();
+    std::ofstream ofs(parameterFilename.c_str());
+    ofs << "translation:" << translation[0] << " " << translation[1] << " " << translation[2] << "\n";
+    ofs << "object center:" << com[0] << " " << com[1] << " " << com[2] << "\n";
+    ofs << "image center:" << center[0] << " " << center[1] << " " << center[2] << "\n";
+  }
+
+  return sharedData.image.applyTranslation(sharedData.imageTransform, true);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// ApplyTranslation
+///////////////////////////////////////////////////////////////////////////////
+void ApplyTranslation::buildParser()
+{
+  const std::string prog = "applytranslation";
+  const std::string desc = "applies the translation computed by a previous translatecom (for example to the corresponding raw image)";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--isbinary").action("store").type("bool").set_default(false).help("Whether the image is a binary segmentation [default false].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int ApplyTranslation::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  bool isBinary = static_cast<bool>(options.get("isbinary"));
+
+  if (!sharedData.imageTransform)
+  {
+    std::cerr << "No translation has been computed (see translatecom)\n";
+    return false;
+  }
+
+  return sharedData.image.applyTranslation(sharedData.imageTransform, isBinary);
+}
+
+
+///////////////////////////////////////////////////////////////////////////////
+// AlignAndCrop
+///////////////////////////////////////////////////////////////////////////////
+void AlignAndCrop::buildParser()
+{
+  const std::string prog = "aligncrop";
+  const std::string desc = "applies a center of mass translation, a rigid transformation and a crop in a single resampling";
+  parser.prog(prog).description(desc);
+
+  parser.add_option("--comparameterfile").action("store").type("string").set_default("").help("Translation written by translatecom or TranslateShapeToImageOrigin (optional).");
+  parser.add_option("--transformationfile").action("store").type("string").set_default("").help("Transformation matrix written by ICPRigid3DImageRegistration (optional).");
+  parser.add_option("--reference").action("store").type("string").set_default("").help("Image whose grid the output is resampled into (the rigid alignment target).");
+  parser.add_option("--startx").action("store").type("int").set_default(0).help("Starting index of the crop in x-direction [default 0].");
+  parser.add_option("--starty").action("store").type("int").set_default(0).help("Starting index of the crop in y-direction [default 0].");
+  parser.add_option("--startz").action("store").type("int").set_default(0).help("Starting index of the crop in z-direction [default 0].");
+  parser.add_option("--sizex").action("store").type("unsigned").set_default(0).help("Size of the crop in x-direction [default 0, no crop].");
+  parser.add_option("--sizey").action("store").type("unsigned").set_default(0).help("Size of the crop in y-direction [default 0, no crop].");
+  parser.add_option("--sizez").action("store").type("unsigned").set_default(0).help("Size of the crop in z-direction [default 0, no crop].");
+  parser.add_option("--isbinary").action("store").type("bool").set_default(false).help("Whether the image is a binary segmentation [default false].");
+
+  Command::buildParser();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+static bool readTranslation(const std::string &filename, Image::AffineTransformType::OutputVectorType &translation)
+{
+  std::ifstream ifs(filename.c_str());
+  std::string line;
+  while (std::getline(ifs, line))
+  {
+    const std::string key = "translation:";
+    if (line.compare(0, key.size(), key) == 0)
+    {
+      std::istringstream values(line.substr(key.size()));
+      return static_cast<bool>(values >> translation[0] >> translation[1] >> translation[2]);
+    }
+  }
+  return false;
+}
+
+///////////////////////////////////////////////////////////////////////////////
+static bool readTransformationMatrix(const std::string &filename, Image::AffineTransformType::MatrixType &matrix,
+                                     Image::AffineTransformType::OutputVectorType &translation)
+{
+  // three rows of a 3x4 matrix, as written by ICPRigid3DImageRegistration
+  std::ifstream ifs(filename.c_str());
+  for (unsigned r = 0; r < 3; r++)
+  {
+    for (unsigned c = 0; c < 3; c++)
+      ifs >> matrix[r][c];
+    ifs >> translation[r];
+  }
+  return static_cast<bool>(ifs);
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int AlignAndCrop::execute(const optparse::Values &options, SharedCommandData &sharedData)
+{
+  std::string comParameterFilename = options["comparameterfile"];
+  std::string transformationFilename = options["transformationfile"];
+  std::string referenceFilename = options["reference"];
+  Image::ImageType::IndexType start;
+  start[0] = static_cast<int>(options.get("startx"));
+  start[1] = static_cast<int>(options.get("starty"));
+  start[2] = static_cast<int>(options.get("startz"));
+  unsigned sizeX = static_cast<unsigned>(options.get("sizex"));
+  unsigned sizeY = static_cast<unsigned>(options.get("sizey"));
+  unsigned sizeZ = static_cast<unsigned>(options.get("sizez"));
+  bool isBinary = static_cast<bool>(options.get("isbinary"));
+
+  // output points are mapped through the rigid transformation and then the translation
+  Image::AffineTransformType::MatrixType matrix;
+  matrix.SetIdentity();
+  Image::AffineTransformType::OutputVectorType offset;
+  offset.Fill(0.0);
+  if (!transformationFilename.empty() && !readTransformationMatrix(transformationFilename, matrix, offset))
+  {
+    std::cerr << "Unable to read transformation matrix from " << transformationFilename << std::endl;
+    return false;
+  }
+  if (!comParameterFilename.empty())
+  {
+    Image::AffineTransformType::OutputVectorType translation;
+    if (!readTranslation(comParameterFilename, translation))
+    {
+      std::cerr << "Unable to read translation from " << comParameterFilename << std::endl;
+      return false;
+    }
+    offset += translation;
+  }
+
+  Image::AffineTransformType::Pointer transform = Image::AffineTransformType::New();
+  transform->SetMatrix(matrix);
+  transform->SetOffset(offset);
+
+  Image reference;
+  if (!reference.read(referenceFilename))
+    return false;
+
+  return sharedData.image.resampleToRegion(transform, reference, start, Dims({sizeX, sizeY, sizeZ}), isBinary);
+}
+
+
 } // shapeworks
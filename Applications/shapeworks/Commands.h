@@ -150,4 +150,124 @@ private:
   void buildParser() override;
   int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
 };
+
+///////////////////////////////////////////////////////////////////////////////
+class ExtractLabel : public ImageCommand
+{
+public:
+  static ExtractLabel& getCommand() { static ExtractLabel instance; return instance; }
+
+private:
+  ExtractLabel() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class CloseHoles : public ImageCommand
+{
+public:
+  static CloseHoles& getCommand() { static CloseHoles instance; return instance; }
+
+private:
+  CloseHoles() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class Threshold : public ImageCommand
+{
+public:
+  static Threshold& getCommand() { static Threshold instance; return instance; }
+
+private:
+  Threshold() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class FastMarching : public ImageCommand
+{
+public:
+  static FastMarching& getCommand() { static FastMarching instance; return instance; }
+
+private:
+  FastMarching() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class SignedDistance : public ImageCommand
+{
+public:
+  static SignedDistance& getCommand() { static SignedDistance instance; return instance; }
+
+private:
+  SignedDistance() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class TopologyPreservingSmooth : public ImageCommand
+{
+public:
+  static TopologyPreservingSmooth& getCommand() { static TopologyPreservingSmooth instance; return instance; }
+
+private:
+  TopologyPreservingSmooth() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class Crop : public ImageCommand
+{
+public:
+  static Crop& getCommand() { static Crop instance; return instance; }
+
+private:
+  Crop() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class TranslateCenterOfMass : public ImageCommand
+{
+public:
+  static TranslateCenterOfMass& getCommand() { static TranslateCenterOfMass instance; return instance; }
+
+private:
+  TranslateCenterOfMass() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class ApplyTranslation : public ImageCommand
+{
+public:
+  static ApplyTranslation& getCommand() { static ApplyTranslation instance; return instance; }
+
+private:
+  ApplyTranslation() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
+
+///////////////////////////////////////////////////////////////////////////////
+class AlignAndCrop : public ImageCommand
+{
+public:
+  static AlignAndCrop& getCommand() { static AlignAndCrop instance; return instance; }
+
+private:
+  AlignAndCrop() { buildParser(); }
+  void buildParser() override;
+  int execute(const optparse::Values &options, SharedCommandData &sharedData) override;
+};
 } // shapeworks
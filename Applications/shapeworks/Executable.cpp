@@ -1,4 +1,16 @@
 #include "Executable.h"
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <fstream>
+#include <thread>
+#ifndef _WIN32
+#include <csignal>
+#include <cstring>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+#endif
 
 namespace shapeworks {
 
@@ -7,7 +19,7 @@ void Executable::buildParser()
 {
   parser.description("Unified Shapeworks executable for all commands.");
 
-  parser.usage("Usage: %prog <command> [args]...");
+  parser.usage("Usage: %prog <command> [args]...\n       %prog serve --socket <path> [--cachesize <MB>]");
   parser.version("%prog 1.0\nMIT license (todo: verify)");
   parser.description("Command line utilities for understanding groups of related shapes.");
   parser.epilog("Available commands:");
@@ -15,6 +27,9 @@ void Executable::buildParser()
   
   // global options
   parser.add_option("-q", "--quiet").action("store_false").dest("verbose").set_default("1").help("don't print status messages");
+  parser.add_option("--manifest").action("store").type("string").set_default("").help("csv file whose header names the {placeholders} of the command chain, which is run once for each of its rows");
+  parser.add_option("--threads").action("store").type("int").set_default(0).help("number of manifest rows run at the same time [default: number of cores]");
+  parser.add_option("--status").action("store").type("string").set_default("").help("csv file to which the status and time of each manifest row is written");
 }
 
 ///////////////////////////////////////////////////////////////////////////////
@@ -65,8 +80,12 @@ int Executable::run(std::vector<std::string> arguments, SharedCommandData &share
       std::cout << "Executing " << cmd->first << "...\n";
 #endif
       auto args = std::vector<std::string>(arguments.begin() + 1, arguments.end());
-      arguments = cmd->second.parse_args(args);
-      retval = cmd->second.run(sharedData);
+      optparse::Values options;
+      {
+        std::lock_guard<std::mutex> lock(parse_mutex);
+        arguments = cmd->second.parse_args(args, options);
+      }
+      retval = cmd->second.run(options, sharedData);
     }
     else {
       std::stringstream ss;
@@ -80,6 +99,284 @@ int Executable::run(std::vector<std::string> arguments, SharedCommandData &share
   return retval;
 }
 
+///////////////////////////////////////////////////////////////////////////////
+static std::string trimField(const std::string &field)
+{
+  auto begin = field.find_first_not_of(" \t\r");
+  auto end = field.find_last_not_of(" \t\r");
+  return begin == std::string::npos ? "" : field.substr(begin, end - begin + 1);
+}
+
+///////////////////////////////////////////////////////////////////////////////
+// splits a CSV row, where a field may be quoted ("a,b" with "" for a quote) to hold commas
+static std::vector<std::string> splitRow(const std::string &line)
+{
+  std::vector<std::string> fields;
+  std::string field;
+  bool quoted = false;
+  bool inQuotes = false;
+  for (size_t i = 0; i < line.size(); i++)
+  {
+    char c = line[i];
+    if (inQuotes)
+    {
+      if (c != '"')
+        field += c;
+      else if (i + 1 < line.size() && line[i + 1] == '"')
+        field += line[++i];
+      else
+        inQuotes = false;
+    }
+    else if (c == ',')
+    {
+      fields.push_back(quoted ? field : trimField(field));
+      field.clear();
+      quoted = false;
+    }
+    else if (c == '"' && !quoted && trimField(field).empty())
+    {
+      field.clear();
+      quoted = inQuotes = true;
+    }
+    else if (!quoted)
+      field += c;
+  }
+  if (inQuotes)
+    throw std::runtime_error("Manifest row '" + line + "' has an unterminated quote.");
+  fields.push_back(quoted ? field : trimField(field));
+  return fields;
+}
+
+///////////////////////////////////////////////////////////////////////////////
+// quotes a CSV field when it holds a comma, a quote or a line break
+static std::string quoteField(const std::string &field)
+{
+  if (field.find_first_of(",\"\r\n") == std::string::npos)
+    return field;
+  std::string quoted = "\"";
+  for (char c : field)
+  {
+    if (c == '"')
+      quoted += '"';
+    quoted += c;
+  }
+  return quoted + "\"";
+}
+
+///////////////////////////////////////////////////////////////////////////////
+static std::string substitute(std::string arg, const std::vector<std::string> &header, const std::vector<std::string> &row)
+{
+  for (size_t i = 0; i < header.size(); i++)
+  {
+    const std::string placeholder = "{" + header[i] + "}";
+    for (auto pos = arg.find(placeholder); pos != std::string::npos; pos = arg.find(placeholder, pos + row[i].size()))
+      arg.replace(pos, placeholder.size(), row[i]);
+  }
+  return arg;
+}
+
+///////////////////////////////////////////////////////////////////////////////
+int Executable::runManifest(const std::string &manifest, const std::vector<std::string> &chain, unsigned threads, const std::string &statusFile)
+{
+  std::ifstream ifs(manifest);
+  if (!ifs)
+    throw std::runtime_error("Unable to read manifest " + manifest);
+
+  // the first row is the header naming the columns
+  std::vector<std::string> header;
+  std::vector<std::vector<std::string>> rows;
+  std::string line;
+  while (std::getline(ifs, line))
+  {
+    if (line.find_first_not_of(" \t\r") == std::string::npos || line[0] == '#')
+      continue;
+    auto fields = splitRow(line);
+    if (header.empty())
+      header = fields;
+    else if (fields.size() != header.size())
+      throw std::runtime_error("Manifest row '" + line + "' does not have " + std::to_string(header.size()) + " columns.");
+    else
+      rows.push_back(fields);
+  }
+
+  struct RowStatus
+  {
+    bool succeeded = false;
+    double seconds = 0.0;
+    std::string message;
+  };
+  std::vector<RowStatus> status(rows.size());
+
+  // each thread takes the next row until there are none left, running the chain on its own data
+  std::atomic<size_t> next(0);
+  auto worker = [&]() {
+    for (size_t i = next++; i < rows.size(); i = next++)
+    {
+      std::vector<std::string> arguments;
+      for (auto &arg : chain)
+        arguments.push_back(substitute(arg, header, rows[i]));
+
+      auto start = std::chrono::steady_clock::now();
+      try {
+        SharedCommandData sharedData;
+        status[i].succeeded = run(arguments, sharedData) == EXIT_SUCCESS;
+        if (!status[i].succeeded)
+          status[i].message = "command failed";
+      } catch (const std::exception &e) {
+        status[i].message = e.what();
+      }
+      status[i].seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+    }
+  };
+
+  if (threads == 0)
+    threads = std::max(1u, std::thread::hardware_concurrency());
+  threads = std::min(threads, static_cast<unsigned>(std::max<size_t>(1, rows.size())));
+  std::vector<std::thread> pool;
+  for (unsigned t = 1; t < threads; t++)
+    pool.emplace_back(worker);
+  worker();
+  for (auto &thread : pool)
+    thread.join();
+
+  std::stringstream table;
+  table << "row,status,seconds," << (header.empty() ? "" : quoteField(header[0])) << ",message\n";
+  unsigned failures = 0;
+  for (size_t i = 0; i < rows.size(); i++)
+  {
+    std::string message = status[i].message;
+    std::replace(message.begin(), message.end(), '\n', ' ');
+    table << i << "," << (status[i].succeeded ? "ok" : "failed") << "," << status[i].seconds << ","
+          << quoteField(rows[i][0]) << "," << quoteField(message) << "\n";
+    failures += !status[i].succeeded;
+  }
+  std::cout << table.str();
+  if (!statusFile.empty())
+  {
+    std::ofstream ofs(statusFile);
+    ofs << table.str();
+  }
+
+  return failures ? EXIT_FAILURE : EXIT_SUCCESS;
+}
+
+///////////////////////////////////////////////////////////////////////////////
+std::string Executable::serveRequest(const std::vector<std::string> &arguments, ImageCache &cache)
+{
+  auto start = std::chrono::steady_clock::now();
+  std::string status = "ok";
+  std::string message;
+  try {
+    SharedCommandData sharedData;
+    sharedData.imageCache = &cache;
+    if (run(arguments, sharedData) != EXIT_SUCCESS)
+    {
+      status = "failed";
+      message = "command failed";
+    }
+  } catch (const std::exception &e) {
+    status = "failed";
+    message = e.what();
+  }
+  double seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+
+  std::replace(message.begin(), message.end(), '\n', ' ');
+  std::stringstream reply;
+  reply << status << " " << seconds << (message.empty() ? "" : " ") << message << "\n";
+  return reply.str();
+}
+
+///////////////////////////////////////////////////////////////////////////////
+// Serves command chains on a unix socket, so that a client running many small
+// chains doesn't pay for starting a process each time, and the images read or
+// written by one chain stay in memory for the next ones.
+//
+// Each request is a chain's arguments separated by '\0' and terminated by
+// '\n'. The reply is "ok <seconds>" or "failed <seconds> <message>" on a line.
+// The request "quit" stops the server.
+int Executable::serve(const std::vector<std::string> &arguments)
+{
+#ifdef _WIN32
+  throw std::runtime_error("serve is not supported on Windows.");
+#else
+  optparse::OptionParser serveParser;
+  serveParser.prog("serve").description("serves command chains on a unix socket");
+  serveParser.add_option("--socket").action("store").type("string").set_default("").help("path of the unix socket to listen on");
+  serveParser.add_option("--cachesize").action("store").type("int").set_default(1024).help("memory (in MB) used to keep recently read and written images");
+  const optparse::Values &options = serveParser.parse_args(arguments);
+  const std::string path = options["socket"];
+  const size_t cacheSize = static_cast<size_t>(static_cast<int>(options.get("cachesize"))) * 1024 * 1024;
+
+  sockaddr_un address;
+  memset(&address, 0, sizeof(address));
+  address.sun_family = AF_UNIX;
+  if (path.empty() || path.size() >= sizeof(address.sun_path))
+    throw std::runtime_error("serve needs a --socket path shorter than " + std::to_string(sizeof(address.sun_path)) + " characters.");
+  strncpy(address.sun_path, path.c_str(), sizeof(address.sun_path) - 1);
+
+  int server = socket(AF_UNIX, SOCK_STREAM, 0);
+  unlink(path.c_str());
+  if (server < 0 || bind(server, reinterpret_cast<sockaddr *>(&address), sizeof(address)) < 0 || listen(server, 16) < 0)
+    throw std::runtime_error("Unable to listen on " + path + ": " + strerror(errno));
+
+  // a client that goes away shouldn't stop the server
+  signal(SIGPIPE, SIG_IGN);
+
+  ImageCache cache(cacheSize);
+  bool serving = true;
+  while (serving)
+  {
+    int connection = accept(server, nullptr, nullptr);
+    if (connection < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      break;
+    }
+
+    std::string buffer;
+    char chunk[4096];
+    ssize_t received;
+    while (serving && (received = recv(connection, chunk, sizeof(chunk), 0)) > 0)
+    {
+      buffer.append(chunk, received);
+      size_t end;
+      while (serving && (end = buffer.find('\n')) != std::string::npos)
+      {
+        std::vector<std::string> request;
+        std::stringstream ss(buffer.substr(0, end));
+        std::string arg;
+        while (std::getline(ss, arg, '\0'))
+          request.push_back(arg);
+        buffer.erase(0, end + 1);
+
+        std::string reply;
+        if (request.size() == 1 && request[0] == "quit")
+        {
+          serving = false;
+          reply = "ok 0\n";
+        }
+        else
+          reply = serveRequest(request, cache);
+
+        for (size_t sent = 0; sent < reply.size();)
+        {
+          ssize_t count = send(connection, reply.data() + sent, reply.size() - sent, 0);
+          if (count <= 0)
+            break;
+          sent += count;
+        }
+      }
+    }
+    close(connection);
+  }
+
+  close(server);
+  unlink(path.c_str());
+  return EXIT_SUCCESS;
+#endif
+}
+
 ///////////////////////////////////////////////////////////////////////////////
 int Executable::run(int argc, char const *const *argv)
 {
@@ -95,6 +392,14 @@ int Executable::run(int argc, char const *const *argv)
     return 1;
   }
 
+  // keep running, serving the command chains sent to a socket
+  if (parser.args()[0] == "serve")
+    return serve(std::vector<std::string>(parser.args().begin() + 1, parser.args().end()));
+
+  // run the command chain once for each row of the manifest
+  if (!options["manifest"].empty())
+    return runManifest(options["manifest"], parser.args(), static_cast<unsigned>(options.get("threads")), options["status"]);
+
   // items used for successive operations by commands
   SharedCommandData sharedData;
   return run(parser.args(), sharedData);
@@ -5,7 +5,9 @@
  */
 
 #include "Command.h"
+#include "ImageCache.h"
 #include <optparse.h>
+#include <mutex>
 
 namespace shapeworks {
 
@@ -24,6 +26,11 @@ private:
   std::map<std::string, std::map<std::string, std::string> > parser_epilog; // <command_type, <command_name, desc> >
 
   int run(std::vector<std::string> arguments, SharedCommandData &sharedData);
+  int runManifest(const std::string &manifest, const std::vector<std::string> &chain, unsigned threads, const std::string &statusFile);
+  int serve(const std::vector<std::string> &arguments);
+  std::string serveRequest(const std::vector<std::string> &arguments, ImageCache &cache);
+
+  std::mutex parse_mutex; // commands store the options they parse, so chains run concurrently parse one at a time
 };
 
 
@@ -0,0 +1,89 @@
+#include "ImageCache.h"
+#include <itkImageDuplicator.h>
+#include <sys/stat.h>
+
+namespace shapeworks {
+
+// modification time of filename in nanoseconds (seconds on platforms without finer times)
+static bool modificationTime(const std::string &filename, long long &mtime)
+{
+  struct stat info;
+  if (stat(filename.c_str(), &info) != 0)
+    return false;
+#if defined(__APPLE__)
+  mtime = info.st_mtimespec.tv_sec * 1000000000LL + info.st_mtimespec.tv_nsec;
+#elif defined(_WIN32)
+  mtime = info.st_mtime * 1000000000LL;
+#else
+  mtime = info.st_mtim.tv_sec * 1000000000LL + info.st_mtim.tv_nsec;
+#endif
+  return true;
+}
+
+// commands may modify their image in place, so the cache never shares its images
+static Image duplicate(const Image &image)
+{
+  using DuplicatorType = itk::ImageDuplicator<Image::ImageType>;
+  DuplicatorType::Pointer duplicator = DuplicatorType::New();
+  duplicator->SetInputImage(image.getITKImage());
+  duplicator->Update();
+  return Image(duplicator->GetOutput());
+}
+
+///////////////////////////////////////////////////////////////////////////////
+bool ImageCache::read(const std::string &filename, Image &image)
+{
+  long long mtime;
+  if (!modificationTime(filename, mtime))
+    return image.read(filename); // reports the error
+
+  auto it = index.find(filename);
+  if (it != index.end() && it->second->mtime == mtime)
+  {
+    entries.splice(entries.begin(), entries, it->second);
+#if DEBUG_CONSOLIDATION
+    std::cout << "Reusing cached image " << filename << std::endl;
+#endif
+    image = duplicate(it->second->image);
+    return true;
+  }
+
+  if (!image.read(filename))
+    return false;
+  insert(filename, image);
+  return true;
+}
+
+///////////////////////////////////////////////////////////////////////////////
+void ImageCache::insert(const std::string &filename, const Image &image)
+{
+  remove(filename);
+
+  long long mtime;
+  if (!image.getITKImage() || !modificationTime(filename, mtime))
+    return;
+  size_t size = image.getITKImage()->GetBufferedRegion().GetNumberOfPixels() * sizeof(Image::PixelType);
+  if (size > maxBytes)
+    return;
+
+  entries.push_front(Entry{filename, mtime, duplicate(image), size});
+  index[filename] = entries.begin();
+  bytes += size;
+
+  // evict the least recently used images
+  while (bytes > maxBytes)
+    remove(entries.back().filename);
+}
+
+///////////////////////////////////////////////////////////////////////////////
+void ImageCache::remove(const std::string &filename)
+{
+  auto it = index.find(filename);
+  if (it == index.end())
+    return;
+  bytes -= it->second->bytes;
+  entries.erase(it->second);
+  index.erase(it);
+}
+
+} // shapeworks
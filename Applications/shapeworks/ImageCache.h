@@ -0,0 +1,41 @@
+#pragma once
+
+#include "Image.h"
+#include <list>
+#include <map>
+#include <string>
+
+namespace shapeworks {
+
+// The images most recently read or written by `shapeworks serve`, kept in memory up to a total size.
+// Entries are keyed by path and modification time, so a file changed on disk is read again.
+class ImageCache
+{
+public:
+  ImageCache(size_t maxBytes) : maxBytes(maxBytes) {}
+
+  /// reads filename into image, from memory when it is cached
+  bool read(const std::string &filename, Image &image);
+
+  /// caches the image just written to filename
+  void insert(const std::string &filename, const Image &image);
+
+private:
+  struct Entry
+  {
+    std::string filename;
+    long long mtime;
+    Image image;
+    size_t bytes;
+  };
+  using EntryList = std::list<Entry>;
+
+  void remove(const std::string &filename);
+
+  EntryList entries; // most recently used first
+  std::map<std::string, EntryList::iterator> index;
+  size_t maxBytes;
+  size_t bytes = 0;
+};
+
+} // shapeworks
@@ -6,6 +6,8 @@
 
 namespace shapeworks {
 
+class ImageCache;
+
 // Most commands can be executed one file at a time, so this class stores the shared data to enable successive operations on the results of these commands.
 // TODO: commands like Clip should use this method rather than independently modifying each element of a group of files.
 
@@ -24,6 +26,9 @@ struct SharedCommandData
   Mesh mesh;
 
   itk::TranslationTransform<double, 3/*dimension*/>::Pointer imageTransform;
+
+  // images kept in memory by `shapeworks serve` (not used otherwise)
+  ImageCache *imageCache = nullptr;
 };
 
 } // shapeworks
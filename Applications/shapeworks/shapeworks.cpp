@@ -23,15 +23,23 @@ int main(int argc, char *argv[])
   shapeworks.addCommand(RecenterImage::getCommand());
   shapeworks.addCommand(PadImage::getCommand());
   shapeworks.addCommand(Coverage::getCommand());
+  shapeworks.addCommand(ExtractLabel::getCommand());
+  shapeworks.addCommand(CloseHoles::getCommand());
+  shapeworks.addCommand(Threshold::getCommand());
+  shapeworks.addCommand(FastMarching::getCommand());
+  shapeworks.addCommand(SignedDistance::getCommand());
+  shapeworks.addCommand(TopologyPreservingSmooth::getCommand());
+  shapeworks.addCommand(Crop::getCommand());
+  shapeworks.addCommand(TranslateCenterOfMass::getCommand());
+  shapeworks.addCommand(ApplyTranslation::getCommand());
+  shapeworks.addCommand(AlignAndCrop::getCommand());
 
   //...
   
   try {
-    shapeworks.run(argc, argv);
+    return shapeworks.run(argc, argv);
   } catch (const std::exception &e) {
     std::cout << e.what() << std::endl;
     return -1;
   }
-
-  return 0;
 }
@@ -1,11 +1,9 @@
-import numpy as np
 import io
 import glob
 import os
 import subprocess
 import shutil
 import xml.etree.ElementTree as ET
-from termcolor import colored, cprint
 
 from CommonUtils import *
 
@@ -171,7 +169,7 @@ def runReconstructMeanSurface(dtFiles, localPointFiles, worldPointFiles, paramet
     create_cpp_xml(parameterFile, parameterFile)
    
     execCommand = ["ReconstructMeanSurface" , parameterFile]
-    subprocess.check_call(execCommand )
+    runTool(execCommand, inputs=[parameterFile] + dtFiles + localPointFiles + (worldPointFiles or []))
    
   
 def runReconstructSurface(pointFiles, parameterDictionary):
@@ -183,7 +181,7 @@ def runReconstructSurface(pointFiles, parameterDictionary):
     create_cpp_xml(parameterFile, parameterFile)
     
     execCommand = ["ReconstructSurface" , parameterFile]
-    subprocess.check_call(execCommand )
+    runTool(execCommand, inputs=[parameterFile] + pointFiles)
 
     densePointFiles = glob.glob(outDir + '/*_dense.particles')
    
@@ -199,5 +197,5 @@ def runReconstructSamplesAlongPCAModes(worldPointFiles, parameterDictionary):
     create_cpp_xml(parameterFile, parameterFile)
    
     execCommand = ["ReconstructSamplesAlongPCAModes" , parameterFile]
-    subprocess.check_call(execCommand )
+    runTool(execCommand, inputs=[parameterFile] + worldPointFiles)
 
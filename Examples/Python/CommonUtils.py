@@ -6,13 +6,73 @@ Created on Tue Sep 10 14:32:27 2019
 @author: shireen
 """
 
-import numpy as np
+import atexit
 import io
+import csv
 import glob
+import hashlib
+import importlib
+import importlib.util
+import json
 import os
+import queue
 import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
-from termcolor import colored, cprint
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class LazyModule:
+    '''
+        Stands in for a module that is only imported when one of its
+        attributes is first used, so that importing these utilities doesn't
+        load dependencies (such as itk) that a given run may never use
+    '''
+    lock = threading.RLock()
+
+    def __init__(self, name):
+        self.__dict__['_LazyModule__name'] = name
+        self.__dict__['_LazyModule__module'] = None
+
+    def __load(self):
+        with LazyModule.lock:
+            if self.__module is None:
+                self.__dict__['_LazyModule__module'] = importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, attr):
+        return getattr(self.__load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.__load(), attr, value)
+
+
+def lazyImport(name, optional=False):
+    '''
+        Returns the module name, imported on first use. An optional module
+        that isn't installed is None.
+    '''
+    if optional and importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
+
+
+np = lazyImport('numpy')
+termcolor = lazyImport('termcolor')
+
+
+def cprint(*args, **kwargs):
+    termcolor.cprint(*args, **kwargs)
+
+
+def colored(*args, **kwargs):
+    return termcolor.colored(*args, **kwargs)
 
 
 def create_cpp_xml(filename, outputfilename):
@@ -35,4 +95,1149 @@ def create_cpp_xml(filename, outputfilename):
     file = open(outputfilename,"w")
     file.write(xml_text)
     file.close()
-    
+
+
+class SubjectProcessError(subprocess.CalledProcessError):
+    '''
+        Raised when one of the commands run for a subject fails, so the
+        offending file can be reported along with the failing command
+    '''
+    def __init__(self, subject, error):
+        super().__init__(error.returncode, error.cmd, error.output, error.stderr)
+        self.subject = subject
+
+    def __str__(self):
+        return "Processing " + self.subject + " failed: " + super().__str__()
+
+
+class GroomCache:
+    '''
+        Content-addressed store for the results of groom steps.
+        A step is keyed by the contents of its input files and its command
+        lines, which carry the tool names and their parameters (isoSpacing,
+        padSize, antialiasIterations, icpIterations, ...), with the file
+        paths in them replaced by placeholders, so the same data under
+        another directory finds the same entry. When a key is found, the
+        stored output files are copied in place instead of running the step
+        again. Entries are evicted least recently used first once the cache
+        grows beyond maxSize bytes. Files are copied outside of the lock, so
+        concurrent subjects don't wait on each other's copies.
+    '''
+    def __init__(self, cacheDir, maxSize=20 * 1024**3):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        # size and last use of each entry, and how many fetches are copying it
+        self.entries = {}
+        self.inUse = {}
+        self.totalSize = 0
+        for name in os.listdir(cacheDir):
+            entryDir = os.path.join(cacheDir, name)
+            if not os.path.isdir(entryDir):
+                continue
+            if name.endswith('.tmp') or name.endswith('.old'):
+                # left by an interrupted store or eviction
+                shutil.rmtree(entryDir, ignore_errors=True)
+                continue
+            size = sum(os.path.getsize(os.path.join(entryDir, f)) for f in os.listdir(entryDir))
+            self.entries[name] = [size, os.path.getmtime(entryDir)]
+            self.totalSize += size
+
+    def getKey(self, inputs, commandList, outputs=()):
+        '''
+            Hashes the contents of the inputs and the command lines, where
+            the inputs and outputs are replaced by their position, other
+            existing files by their contents and other paths (intermediate
+            files of the commands) by their order of appearance
+        '''
+        sha = hashlib.sha256()
+        placeholders = {}
+        for i, inname in enumerate(inputs):
+            placeholders.setdefault(os.path.abspath(inname), '{input' + str(i) + '}')
+        for i, outname in enumerate(outputs):
+            placeholders.setdefault(os.path.abspath(outname), '{output' + str(i) + '}')
+        files = list(inputs)
+        structure = []
+        for cmd in commandList:
+            args = []
+            for arg in cmd:
+                if os.sep not in arg and '/' not in arg:
+                    args.append(arg)
+                    continue
+                path = os.path.abspath(arg)
+                if path not in placeholders:
+                    if os.path.isfile(path):
+                        placeholders[path] = '{file' + str(len(files)) + '}'
+                        files.append(path)
+                    else:
+                        placeholders[path] = '{path' + str(len(placeholders)) + '}'
+                args.append(placeholders[path])
+            structure.append(args)
+        sha.update(json.dumps(structure).encode('utf-8'))
+        for filename in files:
+            sha.update(b'\0file\0')
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(chunk)
+        return sha.hexdigest()
+
+    def fetch(self, key, outputs):
+        '''
+            Copies the outputs stored under key to the given paths, returns
+            False if there is no complete entry for key
+        '''
+        entryDir = os.path.join(self.cacheDir, key)
+        stored = [os.path.join(entryDir, str(i)) for i in range(len(outputs))]
+        with self.lock:
+            if key not in self.entries or not all(os.path.exists(f) for f in stored):
+                return False
+            # the entry can't be evicted while it is copied
+            self.inUse[key] = self.inUse.get(key, 0) + 1
+            self.entries[key][1] = time.time()
+        try:
+            for src, dst in zip(stored, outputs):
+                outDir = os.path.dirname(dst)
+                if outDir and not os.path.exists(outDir):
+                    os.makedirs(outDir, exist_ok=True)
+                tmpFile = dst + '.' + str(threading.get_ident()) + '.tmp'
+                shutil.copyfile(src, tmpFile)
+                os.replace(tmpFile, dst)
+            # the entry directory mtime keeps the LRU clock across runs
+            os.utime(entryDir)
+        finally:
+            with self.lock:
+                self.inUse[key] -= 1
+                if not self.inUse[key]:
+                    del self.inUse[key]
+        return True
+
+    def store(self, key, outputs):
+        entryDir = os.path.join(self.cacheDir, key)
+        tmpDir = tempfile.mkdtemp(prefix=key + '.', suffix='.tmp', dir=self.cacheDir)
+        try:
+            for i, outname in enumerate(outputs):
+                shutil.copyfile(outname, os.path.join(tmpDir, str(i)))
+            size = sum(os.path.getsize(outname) for outname in outputs)
+            with self.lock:
+                if key in self.entries:
+                    # stored meanwhile by another subject with the same inputs
+                    self.entries[key][1] = time.time()
+                    return
+                os.rename(tmpDir, entryDir)
+                self.entries[key] = [size, time.time()]
+                self.totalSize += size
+                evicted = self.evict()
+        finally:
+            if os.path.exists(tmpDir):
+                shutil.rmtree(tmpDir, ignore_errors=True)
+        for oldDir in evicted:
+            shutil.rmtree(oldDir, ignore_errors=True)
+
+    def evict(self):
+        '''
+            Drops the least recently used entries (not being fetched) while
+            the cache is over maxSize, called with the lock held. The entries
+            are renamed aside and returned, for the caller to delete outside
+            of the lock.
+        '''
+        evicted = []
+        for key in sorted(self.entries, key=lambda k: self.entries[k][1]):
+            if self.totalSize <= self.maxSize:
+                break
+            if key in self.inUse:
+                continue
+            oldDir = tempfile.mkdtemp(prefix=key + '.', suffix='.old', dir=self.cacheDir)
+            os.rmdir(oldDir)
+            os.rename(os.path.join(self.cacheDir, key), oldDir)
+            self.totalSize -= self.entries.pop(key)[0]
+            evicted.append(oldDir)
+        return evicted
+
+
+class ArtifactStore:
+    '''
+        Records the products computed for a file by one groom stage (such as
+        the smoothed distance transform of a segmentation) so that later
+        stages can carry them along instead of computing them again.
+        Products are registered as (kind, source file) -> product file.
+        With a stateFile the registrations are saved to it, and with
+        resume=True those of a previous run are loaded back, so the stages
+        run after resuming a Pipeline still find the products of the stages
+        it skipped. A loaded product is dropped if its file is missing.
+    '''
+    def __init__(self, stateFile=None, resume=False):
+        self.artifacts = {}
+        self.stateFile = stateFile
+        self.lock = threading.Lock()
+        if stateFile is not None and resume and os.path.exists(stateFile):
+            with open(stateFile) as f:
+                for kind, source, product in json.load(f):
+                    if os.path.exists(product):
+                        self.artifacts[(kind, source)] = product
+
+    def add(self, kind, source, product):
+        with self.lock:
+            self.artifacts[(kind, os.path.normpath(source))] = product
+            if self.stateFile is not None:
+                tmpFile = self.stateFile + '.tmp'
+                with open(tmpFile, 'w') as f:
+                    json.dump([[kind, name, product] for (kind, name), product in self.artifacts.items()], f, indent=1)
+                os.replace(tmpFile, self.stateFile)
+
+    def get(self, kind, source):
+        '''
+            Returns the registered product, or None if there is none
+        '''
+        return self.artifacts.get((kind, os.path.normpath(source)))
+
+    def getAll(self, source):
+        '''
+            Returns the (kind, product) pairs registered for source
+        '''
+        source = os.path.normpath(source)
+        with self.lock:
+            return [(kind, product) for (kind, name), product in self.artifacts.items() if name == source]
+
+
+def readNrrdHeader(filename, withOffset=False):
+    '''
+        Reads the fields of a NRRD header (such as sizes and type) without
+        reading the voxels. withOffset also returns where the header ends.
+    '''
+    header = {}
+    with open(filename, 'rb') as f:
+        if not f.readline().startswith(b'NRRD'):
+            raise ValueError(filename + " is not a NRRD file")
+        while True:
+            line = f.readline().decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            if line.startswith('#') or ':' not in line:
+                continue
+            key, value = line.split(':', 1)
+            header[key.strip()] = value.lstrip('=').strip()
+        offset = f.tell()
+    if withOffset:
+        return header, offset
+    return header
+
+
+# numpy types of the NRRD types
+nrrdTypes = {name: dtype for names, dtype in (
+    (('signed char', 'int8', 'int8_t'), 'i1'),
+    (('uchar', 'unsigned char', 'uint8', 'uint8_t'), 'u1'),
+    (('short', 'short int', 'signed short', 'signed short int', 'int16', 'int16_t'), 'i2'),
+    (('ushort', 'unsigned short', 'unsigned short int', 'uint16', 'uint16_t'), 'u2'),
+    (('int', 'signed int', 'int32', 'int32_t'), 'i4'),
+    (('uint', 'unsigned int', 'uint32', 'uint32_t'), 'u4'),
+    (('longlong', 'long long', 'long long int', 'signed long long', 'signed long long int', 'int64', 'int64_t'), 'i8'),
+    (('ulonglong', 'unsigned long long', 'unsigned long long int', 'uint64', 'uint64_t'), 'u8'),
+    (('float',), 'f4'),
+    (('double',), 'f8')) for name in names}
+
+
+def readNrrdArray(filename):
+    '''
+        Reads the voxels of a NRRD file as a (z, y, x) array. Uncompressed
+        data (such as the intermediate groom images) is mapped read-only with
+        numpy.memmap rather than copied, so only the voxels used are read.
+        Compressed data is read with itk.
+    '''
+    header, offset = readNrrdHeader(filename, withOffset=True)
+    if header.get('encoding') != 'raw':
+        itk = lazyImport('itk')
+        return itk.GetArrayFromImage(itk.imread(filename))
+
+    dtype = np.dtype(nrrdTypes[header['type']]).newbyteorder('>' if header.get('endian') == 'big' else '<')
+    shape = tuple(int(size) for size in reversed(header['sizes'].split()))
+    dataFile = header.get('data file', header.get('datafile'))
+    if dataFile is not None:
+        # detached header
+        filename = os.path.join(os.path.dirname(filename), dataFile)
+        offset = 0
+    byteSkip = int(header.get('byte skip', header.get('byteskip', 0)))
+    if byteSkip == -1:
+        offset = os.path.getsize(filename) - dtype.itemsize * int(np.prod(shape))
+    else:
+        offset += byteSkip
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+particleMagic = b'SWPARTS\0'
+
+
+def readParticleArray(filename):
+    '''
+        Reads a particle file as an (N, 3) array. Binary particle files
+        (particle_format float32 or float64 of ShapeWorksRun) are mapped
+        read-only with numpy.memmap, without copying; text files are parsed
+        with numpy.loadtxt.
+    '''
+    with open(filename, 'rb') as f:
+        header = f.read(32)
+    if header[:8] != particleMagic:
+        return np.loadtxt(filename, ndmin=2)
+    version, dimension, valueBytes, _ = np.frombuffer(header, dtype='<u4', count=4, offset=8)
+    count = int(np.frombuffer(header, dtype='<u8', count=1, offset=24)[0])
+    if version != 1 or valueBytes not in (4, 8):
+        raise ValueError("Unsupported binary particle file " + filename)
+    if count == 0:
+        return np.zeros((0, int(dimension)), dtype='<f' + str(valueBytes))
+    return np.memmap(filename, dtype='<f' + str(valueBytes), mode='r', offset=32, shape=(count, int(dimension)))
+
+
+def writeParticleArray(filename, particles, dtype='float32'):
+    '''
+        Writes an (N, 3) array as a binary particle file
+    '''
+    particles = np.ascontiguousarray(particles, dtype=np.dtype(dtype).newbyteorder('<'))
+    with open(filename, 'wb') as f:
+        f.write(particleMagic)
+        f.write(np.array([1, particles.shape[1], particles.itemsize, 0], dtype='<u4').tobytes())
+        f.write(np.array([particles.shape[0]], dtype='<u8').tobytes())
+        f.write(particles.tobytes())
+
+
+def readNrrdVectors(value):
+    '''
+        Parses NRRD vectors such as "(1,0,0) (0,1,0) none" into lists of
+        floats, None for "none"
+    '''
+    vectors = []
+    for vector in value.split():
+        if vector == 'none':
+            vectors.append(None)
+        else:
+            vectors.append([float(x) for x in vector.strip('()').split(',')])
+    return vectors
+
+
+class ShapeIndex:
+    '''
+        SQLite index of per subject facts recorded by the groom steps, so
+        that later steps and QC query them instead of reading the volumes
+        again. For each segmentation it holds the dimensions, spacing and
+        origin, the number of foreground voxels (those equal to 1, as for
+        the tools), the center of mass in physical coordinates, the bounding
+        box of the foreground in voxels, and a thumbnail of the mask: the
+        fraction of foreground in each block of thumbnailFactor^3 voxels,
+        scaled to 0-255. An entry is ignored once its file is modified.
+    '''
+    def __init__(self, filename, thumbnailFactor=4):
+        self.filename = filename
+        self.thumbnailFactor = thumbnailFactor
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS subjects (file TEXT PRIMARY KEY, stage TEXT, mtime REAL, '
+                'dims TEXT, spacing TEXT, origin TEXT, foreground INTEGER, com TEXT, '
+                'smallestIndex TEXT, largestIndex TEXT, thumbnailFactor INTEGER, thumbnailShape TEXT, thumbnail BLOB)')
+
+    def computeEntry(self, filename):
+        '''
+            Reads a segmentation and returns the values of its row
+        '''
+        header = readNrrdHeader(filename)
+        dims = [int(size) for size in header['sizes'].split()]
+        if 'space directions' in header:
+            directions = [v for v in readNrrdVectors(header['space directions']) if v is not None]
+        else:
+            spacings = [float(x) for x in header.get('spacings', '1 1 1').split()]
+            directions = [[spacings[i] if j == i else 0.0 for j in range(3)] for i in range(3)]
+        spacing = [float(np.linalg.norm(v)) for v in directions]
+        origin = readNrrdVectors(header['space origin'])[0] if 'space origin' in header else [0.0, 0.0, 0.0]
+
+        # (z, y, x) like the array
+        mask = np.asarray(readNrrdArray(filename)) == 1
+        foreground = int(np.count_nonzero(mask))
+        com, smallestIndex, largestIndex = None, [1000000] * 3, [0] * 3
+        if foreground:
+            meanIndex = []
+            for axis in range(3):
+                # the count of foreground voxels at each index along axis (x, y, z)
+                counts = mask.sum(axis=tuple(a for a in range(3) if a != 2 - axis))
+                present = np.nonzero(counts)[0]
+                smallestIndex[axis], largestIndex[axis] = int(present[0]), int(present[-1])
+                meanIndex.append(float(np.dot(np.arange(len(counts)), counts)) / foreground)
+            com = [origin[j] + sum(meanIndex[i] * directions[i][j] for i in range(3)) for j in range(3)]
+
+        f = self.thumbnailFactor
+        padded = np.zeros([-(-d // f) * f for d in mask.shape], dtype=np.uint8)
+        padded[tuple(slice(0, d) for d in mask.shape)] = mask
+        shape = [d // f for d in padded.shape]
+        blocks = padded.reshape(shape[0], f, shape[1], f, shape[2], f).sum(axis=(1, 3, 5))
+        thumbnail = np.round(blocks * (255.0 / f ** 3)).astype(np.uint8)
+
+        return (os.path.normpath(filename), os.path.getmtime(filename), json.dumps(dims), json.dumps(spacing),
+                json.dumps(origin), foreground, json.dumps(com), json.dumps(smallestIndex), json.dumps(largestIndex),
+                f, json.dumps(shape), thumbnail.tobytes())
+
+    def update(self, inDataList, stage, workers=1):
+        '''
+            Records the segmentations that have no current entry, reading
+            workers of them at a time
+        '''
+        missing = [inname for inname in inDataList if self.get(inname) is None]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            entries = list(executor.map(self.computeEntry, missing))
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(entry[0], stage) + entry[1:] for entry in entries])
+
+    def decode(self, row):
+        entry = dict(row)
+        for key in ('dims', 'spacing', 'origin', 'com', 'smallestIndex', 'largestIndex', 'thumbnailShape'):
+            entry[key] = json.loads(entry[key])
+        entry['thumbnail'] = np.frombuffer(entry['thumbnail'], dtype=np.uint8).reshape(entry['thumbnailShape'])
+        return entry
+
+    def get(self, filename):
+        '''
+            Returns the entry of a file as a dict, or None if there is no
+            entry or the file changed since
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM subjects WHERE file = ?', (os.path.normpath(filename),)).fetchone()
+        if row is None or not os.path.exists(filename) or row['mtime'] != os.path.getmtime(filename):
+            return None
+        return self.decode(row)
+
+    def query(self, stage=None):
+        '''
+            Returns the entries recorded by a groom step (all of them if
+            stage is None), for QC
+        '''
+        with self.lock:
+            if stage is None:
+                rows = self.connection.execute('SELECT * FROM subjects ORDER BY file').fetchall()
+            else:
+                rows = self.connection.execute('SELECT * FROM subjects WHERE stage = ? ORDER BY file', (stage,)).fetchall()
+        return [self.decode(row) for row in rows]
+
+
+# Peak memory of each tool, in bytes per voxel of its largest input. The
+# tools work on float images, so this counts the float copies they hold
+# (the input, outputs and internal buffers). A `shapeworks` chain is costed
+# by its most expensive subcommand.
+memoryCostModel = {
+    'default': 16,
+    'ExtractGivenLabelImage': 8,
+    'CloseHoles': 12,
+    'ThresholdImages': 8,
+    'CropImages': 12,
+    'FindLargestBoundingBox': 8,
+    'TranslateShapeToImageOrigin': 16,
+    'FastMarching': 20,
+    'TopologyPreservingSmoothing': 40,
+    'ICPRigid3DImageRegistration': 32,
+    'shapeworks': 8,
+    'shapeworks:antialias': 24,
+    'shapeworks:isoresample': 24,
+    'shapeworks:fastmarching': 20,
+    'shapeworks:signeddistance': 16,
+    'shapeworks:tpsmooth': 40,
+    'shapeworks:translatecom': 24,
+    'shapeworks:aligncrop': 24,
+}
+# memory used by a tool regardless of the size of its input
+memoryBaseCost = 64 * 1024**2
+
+
+def getToolKey(cmd):
+    '''
+        Names the tool run by a command, including the subcommands of a
+        `shapeworks` chain (e.g. "shapeworks:readimage+antialias+writeimage")
+    '''
+    tool = os.path.basename(cmd[0])
+    if tool != 'shapeworks':
+        return tool
+    subcommands = []
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg.startswith('--'):
+            next(args, None)
+        else:
+            subcommands.append(arg)
+    return tool + ':' + '+'.join(subcommands)
+
+
+def startProcess(cmd, cpus=None, **popenArgs):
+    '''
+        subprocess.Popen, pinning the process to cpus (where the platform
+        supports affinity) as soon as it has started. This isn't done in a
+        preexec_fn, which isn't safe when processes are started from threads.
+    '''
+    process = subprocess.Popen(cmd, **popenArgs)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(process.pid, cpus)
+        except OSError:
+            # the process already exited
+            pass
+    return process
+
+
+def runMeasured(cmd, **popenArgs):
+    '''
+        Runs a command and returns its exit code and resource usage: wall,
+        user and sys time in seconds and peakRSS in bytes (the last three
+        are None where they can't be measured). popenArgs (such as env, or
+        the cpus of startProcess) are passed to startProcess.
+    '''
+    start = time.time()
+    if not hasattr(os, 'wait4'):
+        returncode = startProcess(cmd, **popenArgs).wait()
+        return returncode, {'wall': time.time() - start, 'user': None, 'sys': None, 'peakRSS': None}
+    process = startProcess(cmd, **popenArgs)
+    # wait4 gives the resource usage of this child alone, where
+    # getrusage(RUSAGE_CHILDREN) mixes all the children run concurrently
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # ru_maxrss is in kilobytes, except on macOS
+    peak = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return process.returncode, {'wall': time.time() - start, 'user': usage.ru_utime, 'sys': usage.ru_stime,
+                                'peakRSS': peak}
+
+
+class MemoryScheduler:
+    '''
+        Only starts a command when its estimated peak memory fits under
+        limit bytes along with the commands already running (a command
+        larger than the limit runs alone). Estimates come from the size of
+        the largest NRRD input, read from its header, and memoryCostModel.
+        The measured peak memory of every command is recorded in modelFile
+        and used instead of the model for that tool on later runs.
+    '''
+    def __init__(self, limit, modelFile=None):
+        self.limit = limit
+        self.modelFile = modelFile
+        self.used = 0
+        self.running = 0
+        self.condition = threading.Condition()
+        self.measured = {}
+        if modelFile is not None and os.path.exists(modelFile):
+            with open(modelFile) as f:
+                self.measured = json.load(f)
+
+    def getVoxels(self, cmd, inputs):
+        voxels = 0
+        for filename in list(cmd) + list(inputs or []):
+            if filename.endswith(('.nrrd', '.nhdr')) and os.path.exists(filename):
+                try:
+                    sizes = readNrrdHeader(filename)['sizes'].split()
+                except (ValueError, KeyError):
+                    continue
+                count = 1
+                for size in sizes:
+                    count *= int(size)
+                voxels = max(voxels, count)
+        return voxels
+
+    def getCost(self, key):
+        if key in self.measured:
+            return self.measured[key]
+        if key in memoryCostModel:
+            return memoryCostModel[key]
+        if key.startswith('shapeworks:'):
+            return max([memoryCostModel['shapeworks']] + [memoryCostModel.get('shapeworks:' + subcommand, 0)
+                                                          for subcommand in key.split(':', 1)[1].split('+')])
+        return memoryCostModel['default']
+
+    def estimate(self, cmd, inputs=None):
+        return memoryBaseCost + self.getVoxels(cmd, inputs) * self.getCost(getToolKey(cmd))
+
+    def record(self, key, voxels, peak):
+        if peak is None or voxels == 0:
+            return
+        cost = max(0.0, (peak - memoryBaseCost) / float(voxels))
+        with self.condition:
+            # keep the worst case seen, with some headroom
+            self.measured[key] = max(self.measured.get(key, 0.0), 1.1 * cost)
+            if self.modelFile is not None:
+                with open(self.modelFile, 'w') as f:
+                    json.dump(self.measured, f, indent=1, sort_keys=True)
+
+    def run(self, cmd, inputs=None, **popenArgs):
+        '''
+            Runs cmd once it fits and returns the result of runMeasured
+        '''
+        voxels = self.getVoxels(cmd, inputs)
+        estimate = memoryBaseCost + voxels * self.getCost(getToolKey(cmd))
+        with self.condition:
+            while self.running > 0 and self.used + estimate > self.limit:
+                self.condition.wait()
+            self.used += estimate
+            self.running += 1
+        try:
+            returncode, usage = runMeasured(cmd, **popenArgs)
+        finally:
+            with self.condition:
+                self.used -= estimate
+                self.running -= 1
+                self.condition.notify_all()
+        if returncode == 0:
+            self.record(getToolKey(cmd), voxels, usage['peakRSS'])
+        return returncode, usage
+
+
+# MemoryScheduler shared by everything run through runTool, see setMemoryLimit
+memoryScheduler = None
+
+
+def setMemoryLimit(limit, modelFile=None):
+    '''
+        Limits the memory used by the tools run concurrently through
+        runTool (and so by the GroomUtils steps and Pipeline nodes) to
+        about limit bytes. None removes the limit.
+    '''
+    global memoryScheduler
+    memoryScheduler = None if limit is None else MemoryScheduler(limit, modelFile)
+
+
+class ToolTrace:
+    '''
+        Writes one JSON line per tool run to filename, with the tool, subject,
+        argv, wall/user/sys time, peak RSS and input/output bytes.
+        summarizeTrace ranks the slowest tools and subjects of a trace.
+    '''
+    def __init__(self, filename, append=False):
+        self.filename = filename
+        self.lock = threading.Lock()
+        # created right away, so that a run without any tool still has a trace to summarize
+        open(filename, 'a' if append else 'w').close()
+
+    def record(self, entry):
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+
+# ToolTrace shared by everything run through runTool, see setTraceFile
+toolTrace = None
+
+
+def setTraceFile(filename, append=False):
+    '''
+        Traces the tools run through runTool to filename (JSON Lines),
+        appending to an earlier trace if append. None stops tracing.
+    '''
+    global toolTrace
+    toolTrace = None if filename is None else ToolTrace(filename, append)
+
+
+def getFileBytes(files):
+    return sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+
+
+class ShapeworksWorkers:
+    '''
+        A pool of `shapeworks serve` processes, which run shapeworks command
+        chains without starting a new process for each of them. Every worker
+        keeps the images it recently read or wrote in memory (up to cacheSize
+        MB), so the next chains on the same files skip reading them. A worker
+        that doesn't start or answer a command within timeout seconds is
+        stopped, and started again by the next command given to it.
+    '''
+    def __init__(self, count=1, cacheSize=1024, timeout=600):
+        self.cacheSize = cacheSize
+        self.timeout = timeout
+        self.socketDir = tempfile.mkdtemp(prefix='shapeworks_')
+        self.processes = {}
+        self.idle = queue.Queue()
+        atexit.register(self.close)
+        try:
+            for index in range(count):
+                self.idle.put(self.start(index))
+        except:
+            self.close()
+            raise
+
+    def start(self, index):
+        '''
+            Starts worker index, returning its (index, socket, reader)
+        '''
+        path = os.path.join(self.socketDir, str(index))
+        process = subprocess.Popen(["shapeworks", "serve", "--socket", path, "--cachesize", str(self.cacheSize)])
+        self.processes[index] = process
+        deadline = time.time() + self.timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("shapeworks serve exited with " + str(process.returncode))
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                connection.connect(path)
+                connection.settimeout(self.timeout)
+                return index, connection, connection.makefile('rb')
+            except OSError:
+                connection.close()
+                if time.time() > deadline:
+                    raise RuntimeError("Timed out waiting for shapeworks serve on " + path)
+                time.sleep(0.05)
+
+    def stop(self, index):
+        process = self.processes.pop(index, None)
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        path = os.path.join(self.socketDir, str(index))
+        if os.path.exists(path):
+            os.remove(path)
+
+    def run(self, cmd):
+        '''
+            Runs a shapeworks command line on the next idle worker and returns
+            its exit code and resource usage (only the wall time, along with
+            the message of a failure). A worker that stopped or timed out is
+            left idle without a connection, and started again by the next
+            command given to it.
+        '''
+        if any('\n' in arg or '\0' in arg for arg in cmd):
+            raise ValueError("Command arguments can't contain newlines: " + str(cmd))
+        index, connection, reader = self.idle.get()
+        start = time.time()
+        reply = ''
+        try:
+            if connection is None:
+                index, connection, reader = self.start(index)
+            connection.sendall(b'\0'.join(os.fsencode(arg) for arg in cmd[1:]) + b'\n')
+            reply = reader.readline().decode().rstrip('\n')
+        except (OSError, RuntimeError):
+            reply = ''
+        finally:
+            if not reply:
+                if connection is not None:
+                    connection.close()
+                connection = reader = None
+                self.stop(index)
+            self.idle.put((index, connection, reader))
+        usage = {'wall': time.time() - start, 'user': None, 'sys': None, 'peakRSS': None}
+        if not reply:
+            usage['message'] = "shapeworks worker stopped"
+        if reply.startswith('ok'):
+            return 0, usage
+        if reply:
+            usage['message'] = reply.split(' ', 2)[2] if reply.count(' ') >= 2 else ''
+        return 1, usage
+
+    def close(self):
+        while not self.idle.empty():
+            index, connection, reader = self.idle.get()
+            if connection is not None:
+                connection.close()
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+        self.processes = {}
+        shutil.rmtree(self.socketDir, ignore_errors=True)
+
+
+# ShapeworksWorkers used by runTool, see setShapeworksWorkers
+shapeworksWorkers = None
+
+
+def setShapeworksWorkers(count, cacheSize=1024):
+    '''
+        Runs the shapeworks commands of runTool on a pool of count
+        `shapeworks serve` workers, rather than a new process each time.
+        A count of 0 goes back to new processes.
+    '''
+    global shapeworksWorkers
+    if shapeworksWorkers is not None:
+        shapeworksWorkers.close()
+    shapeworksWorkers = ShapeworksWorkers(count, cacheSize) if count else None
+
+
+def getPinningArgs(cpus=None, threads=None):
+    '''
+        runTool arguments running a tool on the given CPUs (where the
+        platform supports affinity) with at most threads ITK and OpenMP
+        threads
+    '''
+    popenArgs = {}
+    if threads is not None:
+        popenArgs['env'] = dict(os.environ, ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS=str(threads),
+                                OMP_NUM_THREADS=str(threads))
+    if cpus:
+        popenArgs['cpus'] = set(cpus)
+    return popenArgs
+
+
+def runTool(cmd, subject=None, inputs=None, outputs=None, **popenArgs):
+    '''
+        Runs an external tool, raising CalledProcessError if it fails.
+        Every tool of the Groom, Optimize and Analyze utils is run through
+        here, so that it is admitted under the memory limit (setMemoryLimit),
+        traced (setTraceFile) and sent to the shapeworks workers
+        (setShapeworksWorkers). Without inputs and outputs, the files of cmd
+        that exist before it runs count as inputs and the ones it writes as
+        outputs. popenArgs (such as the env and cpus of getPinningArgs) are
+        passed to startProcess, the command then runs in its own process
+        rather than on a shapeworks worker.
+    '''
+    useWorkers = shapeworksWorkers is not None and os.path.basename(cmd[0]) == 'shapeworks' and not popenArgs
+    if not useWorkers and memoryScheduler is None and toolTrace is None:
+        returncode = startProcess(cmd, **popenArgs).wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        return
+    argFiles = [arg for arg in cmd[1:] if os.path.isfile(arg)]
+    start = time.time()
+    if useWorkers:
+        returncode, usage = shapeworksWorkers.run(cmd)
+    elif memoryScheduler is None:
+        returncode, usage = runMeasured(cmd, **popenArgs)
+    else:
+        returncode, usage = memoryScheduler.run(cmd, inputs, **popenArgs)
+    if toolTrace is not None:
+        if outputs is None:
+            outputs = [arg for arg in cmd[1:] if os.path.isfile(arg) and os.path.getmtime(arg) >= start]
+        if inputs is None:
+            inputs = [arg for arg in argFiles if arg not in outputs]
+        entry = {'tool': getToolKey(cmd), 'subject': subject, 'argv': list(cmd), 'start': start,
+                 'returncode': returncode, 'inputBytes': getFileBytes(inputs), 'outputBytes': getFileBytes(outputs)}
+        entry.update(usage)
+        toolTrace.record(entry)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, usage.get('message'))
+
+
+def summarizeTrace(traceFile, top=10):
+    '''
+        Prints the tools and subjects of a trace that took the most wall time
+
+        Input Parameters:
+            traceFile: a trace written by ToolTrace
+            top: the number of tools and subjects listed
+        Output Parameters:
+            (tools, subjects): for each, a list of (name, runs, wall time,
+            peak RSS) sorted by decreasing wall time
+    '''
+    tools = {}
+    subjects = {}
+    with open(traceFile) as f:
+        for line in f:
+            entry = json.loads(line)
+            for totals, name in ((tools, entry['tool']), (subjects, entry['subject'] or '(all subjects)')):
+                runs, wall, peak = totals.get(name, (0, 0.0, 0))
+                totals[name] = (runs + 1, wall + entry['wall'], max(peak, entry['peakRSS'] or 0))
+    total = sum(wall for runs, wall, peak in tools.values())
+    ranked = []
+    for title, totals in (("tools", tools), ("subjects", subjects)):
+        rows = sorted(((name,) + value for name, value in totals.items()), key=lambda row: -row[2])
+        ranked.append(rows)
+        cprint(("Slowest " + title + " of", traceFile), 'cyan')
+        for name, runs, wall, peak in rows[:top]:
+            print("  {:>9.1f}s {:>5.1f}% {:>4d} runs {:>8.0f} MB  {}".format(
+                wall, 100.0 * wall / total if total else 0.0, runs, peak / 1024.0**2, name))
+    return tuple(ranked)
+
+
+def runCommands(subject, commandList, inputs=None, outputs=None, cache=None):
+    '''
+        Runs the commands for a single subject one after the other.
+        If a cache is given along with the input and output files of the
+        commands, a stored result is reused instead of running them.
+    '''
+    useCache = cache is not None and inputs is not None and outputs
+    if useCache:
+        key = cache.getKey(inputs, commandList, outputs)
+        if cache.fetch(key, outputs):
+            cprint(("Reusing cached result for : ", subject), 'green')
+            return
+
+    for cmd in commandList:
+        try:
+            runTool(cmd, subject, inputs)
+        except subprocess.CalledProcessError as e:
+            raise SubjectProcessError(subject, e) from e
+        except OSError as e:
+            # the tool could not be started at all (e.g. it is not on the path)
+            raise SubjectProcessError(subject, subprocess.CalledProcessError(127, cmd, str(e))) from e
+
+    if useCache:
+        cache.store(key, outputs)
+        # some steps rewrite their inputs in place, so also file the result
+        # under the inputs as a rerun will find them
+        postKey = cache.getKey(inputs, commandList, outputs)
+        if postKey != key:
+            cache.store(postKey, outputs)
+
+
+def runSubjectCommands(jobs, workers=1, cache=None):
+    '''
+        Runs a list of (subject, commandList) jobs, using up to `workers`
+        subjects at a time. The commands of a single subject always run in
+        order. The work happens in the spawned processes, so a thread pool is
+        enough to keep that many of them running concurrently.
+        A job may also list its input and output files, as
+        (subject, commandList, inputs, outputs), so that it can be skipped
+        when `cache` (a GroomCache) already holds its result.
+        The first failure (in input order) is raised as a SubjectProcessError.
+    '''
+    if workers is None or workers <= 1:
+        for job in jobs:
+            runCommands(*job, cache=cache)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(runCommands, *job, cache=cache) for job in jobs]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # jobs not started yet are dropped, whatever the failure (or an interrupt)
+            for future in futures:
+                future.cancel()
+            raise
+
+
+# whether the shapeworks executable supports --manifest, see hasShapeworksManifest
+shapeworksManifestSupport = None
+
+
+def hasShapeworksManifest():
+    '''
+        Whether the shapeworks executable on the path can run a manifest
+    '''
+    global shapeworksManifestSupport
+    if shapeworksManifestSupport is None:
+        try:
+            result = subprocess.run(["shapeworks", "--help"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            shapeworksManifestSupport = b'--manifest' in result.stdout
+        except OSError:
+            shapeworksManifestSupport = False
+    return shapeworksManifestSupport
+
+
+def runShapeworksManifest(manifestDir, chain, jobs, workers=1, cache=None):
+    '''
+        Runs the same shapeworks command chain for a list of
+        (subject, input, output) jobs, where {input} and {output} in the
+        arguments of chain are replaced by the files of each job. When the
+        shapeworks executable supports it, all the jobs run in a single
+        `shapeworks --manifest` process with `workers` threads, rather than
+        starting a process for each file. The manifest is a temporary file in
+        manifestDir, a CSV file with fields quoted as needed. Otherwise (or
+        when the commands go to the shapeworks workers) the jobs are run by
+        runSubjectCommands.
+        The first failed job is raised as a SubjectProcessError.
+    '''
+    def getCommand(job):
+        subject, inname, outname = job
+        return ["shapeworks"] + [arg.replace('{input}', inname).replace('{output}', outname) for arg in chain]
+
+    if shapeworksWorkers is not None or not hasShapeworksManifest():
+        runSubjectCommands([(job[0], [getCommand(job)], [job[1]], [job[2]]) for job in jobs], workers, cache)
+        return
+
+    pending = []
+    keys = {}
+    for job in jobs:
+        if cache is not None:
+            keys[job] = cache.getKey([job[1]], [getCommand(job)], [job[2]])
+            if cache.fetch(keys[job], [job[2]]):
+                cprint(("Reusing cached result for : ", job[0]), 'green')
+                continue
+        pending.append(job)
+    if not pending:
+        return
+
+    for subject, inname, outname in pending:
+        # the manifest is read one line per row
+        if any(c in inname + outname for c in '\r\n'):
+            raise ValueError("Filenames with line breaks cannot be listed in a manifest : " + repr(inname))
+
+    fd, manifestFile = tempfile.mkstemp(prefix='manifest_', suffix='.csv', dir=manifestDir)
+    statusFile = os.path.splitext(manifestFile)[0] + ".status.csv"
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(["input", "output"])
+            for subject, inname, outname in pending:
+                writer.writerow([inname, outname])
+        cmd = ["shapeworks", "--manifest", manifestFile, "--threads", str(max(1, workers or 1)),
+               "--status", statusFile] + chain
+        try:
+            runTool(cmd, inputs=[job[1] for job in pending], outputs=[job[2] for job in pending])
+        except subprocess.CalledProcessError:
+            # the failed rows are reported below, unless it failed before writing them
+            if not os.path.exists(statusFile):
+                raise
+        with open(statusFile) as f:
+            status = list(csv.DictReader(f))
+    finally:
+        for filename in (manifestFile, statusFile):
+            if os.path.exists(filename):
+                os.remove(filename)
+    failed = None
+    for row, job in zip(status, pending):
+        if row['status'] == 'ok':
+            if cache is not None:
+                cache.store(keys[job], [job[2]])
+        elif failed is None:
+            failed = (job, row)
+    if failed is not None:
+        job, row = failed
+        raise SubjectProcessError(job[0], subprocess.CalledProcessError(1, getCommand(job), row['message']))
+
+
+def getResultStamps(value):
+    '''
+        Returns a JSON serializable copy of value where every string naming an
+        existing file is replaced by [name, modification time, size]. Values
+        JSON cannot hold (such as functions or caches) are replaced by their
+        type name.
+    '''
+    if isinstance(value, str):
+        if os.path.isfile(value):
+            info = os.stat(value)
+            return [value, info.st_mtime_ns, info.st_size]
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [getResultStamps(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): getResultStamps(item) for key, item in value.items()}
+    return getattr(value, '__qualname__', type(value).__name__)
+
+
+class Pipeline:
+    '''
+        Runs the steps of a pipeline as the nodes of a graph: a node runs as
+        soon as the nodes it depends on are done, with up to `workers` nodes
+        running at a time. This lets each subject move through its own steps
+        independently, only waiting at the nodes that need all the subjects
+        (such as the choice of the reference for rigid alignment).
+        The result of every completed node is saved to stateFile. With
+        resume=True the completed nodes of a previous run are not run again
+        and their saved results are used, so node results must be JSON
+        serializable (typically lists of filenames).
+        Along with its result, every node saves a stamp of the files named in
+        its inputs and its result. A completed node is only skipped if the
+        nodes it depends on were skipped and its stamp still matches, so a
+        node whose input files were regenerated, or whose output files were
+        removed, is run again.
+    '''
+    def __init__(self, stateFile, workers=1, resume=False):
+        self.stateFile = stateFile
+        self.workers = max(1, workers or 1)
+        self.nodes = {}
+        self.order = []
+        self.results = {}
+        self.stamps = {}
+        self.reported = set()
+        self.lock = threading.Lock()
+        if resume and os.path.exists(stateFile):
+            with open(stateFile) as f:
+                state = json.load(f)
+            # a state file without stamps cannot be checked, so nothing in it is reused
+            if 'results' in state and 'stamps' in state:
+                self.results = state['results']
+                self.stamps = state['stamps']
+        else:
+            self.saveState()
+
+    def addNode(self, name, func, deps=(), inputs=None):
+        '''
+            Adds a node that calls func with the results of deps, in order.
+            inputs holds any other values func reads (such as filenames), which
+            are stamped along with the results of deps
+        '''
+        if name in self.nodes:
+            raise ValueError("Pipeline node " + name + " already exists")
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError("Pipeline node " + name + " depends on unknown node " + dep)
+        self.nodes[name] = (func, list(deps), inputs)
+        self.order.append(name)
+        return name
+
+    def saveState(self):
+        with self.lock:
+            tmpFile = self.stateFile + '.tmp'
+            with open(tmpFile, 'w') as f:
+                json.dump({'results': self.results, 'stamps': self.stamps}, f, indent=1)
+            os.replace(tmpFile, self.stateFile)
+
+    def getStamp(self, name, result):
+        '''
+            Hashes the inputs and the result of a node, along with the
+            modification time and size of every existing file they name
+        '''
+        func, deps, inputs = self.nodes[name]
+        stamp = [getResultStamps([self.results[dep] for dep in deps]), getResultStamps(inputs), getResultStamps(result)]
+        return hashlib.sha256(json.dumps(stamp, sort_keys=True).encode()).hexdigest()
+
+    def isCurrent(self, name):
+        '''
+            Returns whether the saved result of a node can be used as is
+        '''
+        deps = self.nodes[name][1]
+        if not all(dep in self.results and dep in self.reported for dep in deps):
+            return False
+        return self.stamps.get(name) == self.getStamp(name, self.results[name])
+
+    def runNode(self, name):
+        func, deps, inputs = self.nodes[name]
+        result = func(*[self.results[dep] for dep in deps])
+        # results go through JSON, so a run and a resumed run see the same values
+        result = json.loads(json.dumps(result))
+        stamp = self.getStamp(name, result)
+        with self.lock:
+            self.results[name] = result
+            self.stamps[name] = stamp
+            self.reported.add(name)
+        self.saveState()
+        return result
+
+    def run(self):
+        '''
+            Runs all the nodes that are not done yet, raising the first failure
+            after the nodes already running have finished
+        '''
+        for name in self.order:
+            if name in self.results and name not in self.reported:
+                if self.isCurrent(name):
+                    cprint(("Skipping completed pipeline node : ", name), 'green')
+                    self.reported.add(name)
+                else:
+                    cprint(("Rerunning pipeline node, its inputs or outputs changed : ", name), 'yellow')
+                    del self.results[name]
+                    self.stamps.pop(name, None)
+        pending = [name for name in self.order if name not in self.results]
+        running = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                if failure is None:
+                    for name in list(pending):
+                        if len(running) >= self.workers:
+                            break
+                        if all(dep in self.results for dep in self.nodes[name][1]):
+                            pending.remove(name)
+                            running[executor.submit(self.runNode, name)] = name
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    if future.exception() is not None and failure is None:
+                        failure = future.exception()
+        if failure is not None:
+            raise failure
+
+    def step(self, name, func, *args, **kwargs):
+        '''
+            Runs a single step right away (after everything added before),
+            unless it was completed by a previous run and resuming
+        '''
+        self.addNode(name, lambda *deps: func(*args, **kwargs), [n for n in self.order], inputs=[list(args), kwargs])
+        self.run()
+        return self.results[name]
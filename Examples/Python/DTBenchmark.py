@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the two ways grooming can compute signed distance transforms:
+`shapeworks fastmarching` and the exact separable Euclidean distance
+transform of `shapeworks signeddistance` (--distance_transform maurer).
+
+Each segmentation is first prepared as the groom steps do (label extraction,
+hole filling, isotropic resampling and antialiasing), then both distance
+transforms are computed from the same antialiased image. The reported times
+are the wall times of the two commands, which read and write the same files,
+and the accuracy is measured against fast marching in a band around the
+surface, the part of the distance transform the optimization samples.
+
+Run the Ellipsoid and left atrium examples first so that their data is
+extracted, e.g.
+
+`python DTBenchmark.py <path to ShapeWorks binaries>`
+"""
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+
+from CommonUtils import *
+
+parser = argparse.ArgumentParser(description='Compare fast marching with the exact separable distance transform')
+parser.add_argument("--datasets", help="Glob of the segmentations of each dataset", nargs='+',
+                    default=["TestEllipsoids/Ellipsoids_UnPrepped/*.nrrd", "TestLeftAtrium/segmentation_LGE/*.nrrd"])
+parser.add_argument("--count", help="Number of segmentations used from each dataset", type=int, default=5)
+parser.add_argument("--antialias_iterations", help="Antialias iterations before the distance transforms", type=int, default=30)
+parser.add_argument("--iso_spacing", help="Spacing the segmentations are resampled to", type=float, default=1.0)
+parser.add_argument("--band", help="Half width (in mm) of the band around the surface the distances are compared in", type=float, default=5.0)
+parser.add_argument("shapeworks_path", help="Path to ShapeWorks executables", nargs='?', type=str, default=None)
+args = parser.parse_args()
+
+if args.shapeworks_path is not None:
+    os.environ["PATH"] = args.shapeworks_path + os.pathsep + os.environ["PATH"]
+
+
+def runTimed(cmd):
+    returncode, usage = runMeasured(cmd)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return usage['wall']
+
+
+def benchmark(segFile, workDir):
+    """
+    Returns the fast marching and exact distance transform times and the
+    mean and max absolute difference of their distances near the surface,
+    along with the fraction of voxels with the same sign
+    """
+    aaFile = os.path.join(workDir, 'antialiased.nrrd')
+    fmFile = os.path.join(workDir, 'fastmarching.nrrd')
+    edtFile = os.path.join(workDir, 'signeddistance.nrrd')
+    runTimed(["shapeworks", "readimage", "--name", segFile, "extractlabel", "--label", "1", "closeholes",
+              "isoresample", "--isospacing", str(args.iso_spacing), "binarize",
+              "antialias", "--numiterations", str(args.antialias_iterations),
+              "writeimage", "--name", aaFile, "--compressed", "0"])
+    fmTime = runTimed(["shapeworks", "readimage", "--name", aaFile, "fastmarching",
+                       "writeimage", "--name", fmFile, "--compressed", "0"])
+    edtTime = runTimed(["shapeworks", "readimage", "--name", aaFile, "signeddistance",
+                        "writeimage", "--name", edtFile, "--compressed", "0"])
+
+    fm = np.asarray(readNrrdArray(fmFile))
+    edt = np.asarray(readNrrdArray(edtFile))
+    band = np.abs(fm) <= args.band
+    difference = np.abs(fm[band] - edt[band])
+    sameSign = np.mean(np.sign(fm[band]) == np.sign(edt[band]))
+    return fmTime, edtTime, float(difference.mean()), float(difference.max()), float(sameSign)
+
+
+print("{:<40} {:>10} {:>10} {:>8} {:>10} {:>10} {:>9}".format(
+    "segmentation", "fm (s)", "edt (s)", "speedup", "mean |d|", "max |d|", "sign ok"))
+for pattern in args.datasets:
+    segFiles = sorted(glob.glob(pattern))[:args.count]
+    if not segFiles:
+        cprint(("No segmentations match", pattern), 'red')
+        continue
+    results = []
+    for segFile in segFiles:
+        workDir = tempfile.mkdtemp(prefix='dtbenchmark')
+        try:
+            result = benchmark(segFile, workDir)
+        finally:
+            shutil.rmtree(workDir)
+        results.append(result)
+        fmTime, edtTime, meanDiff, maxDiff, sameSign = result
+        print("{:<40} {:>10.2f} {:>10.2f} {:>8.1f} {:>10.3f} {:>10.3f} {:>9.4f}".format(
+            os.path.basename(segFile)[-40:], fmTime, edtTime, fmTime / edtTime, meanDiff, maxDiff, sameSign))
+    fmTotal = sum(r[0] for r in results)
+    edtTotal = sum(r[1] for r in results)
+    cprint(("{}: fast marching {:.2f} s, exact distance transform {:.2f} s ({:.1f}x), "
+            "mean |d| {:.3f} mm, max |d| {:.3f} mm").format(
+        pattern, fmTotal, edtTotal, fmTotal / edtTotal,
+        sum(r[2] for r in results) / len(results), max(r[3] for r in results)), 'cyan')
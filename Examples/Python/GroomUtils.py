@@ -1,17 +1,167 @@
 import sys
-import numpy as np
 import io
-from termcolor import colored, cprint
 import glob
 import os
 import subprocess
 import shutil
 import xml.etree.ElementTree as ET
-import itk
+from concurrent.futures import ProcessPoolExecutor
 
 from CommonUtils import *
 
-def applyIsotropicResampling(outDir, inDataList, isoSpacing=1.0, recenter=True, isBinary=True):
+itk = lazyImport('itk')
+# in-process shapeworks bindings (built with -DBuild_Python=ON)
+sw = lazyImport('shapeworks', optional=True)
+
+# whether intermediate images are gzip compressed, see setIntermediateCompression
+compressIntermediates = False
+
+def setIntermediateCompression(compress):
+    """
+    Chooses whether the intermediate images of the grooming steps are gzip
+    compressed. By default they are written uncompressed, which is much faster
+    for cheap steps such as padding and lets readNrrdArray map them without
+    copying. The final distance transforms are always compressed.
+    """
+    global compressIntermediates
+    compressIntermediates = compress
+
+def writeImageArgs(filename, final=False):
+    """
+    The shapeworks arguments writing an intermediate (or final) image
+    """
+    return ["writeimage", "--name", filename, "--compressed", "1" if final or compressIntermediates else "0"]
+
+def copyFinalImages(inDataList, outDataList, workers=1):
+    """
+    Copies intermediate images to final ones, compressing them when the
+    intermediates are uncompressed
+    """
+    if compressIntermediates:
+        for inname, outname in zip(inDataList, outDataList):
+            shutil.copyfile(inname, outname)
+        return
+    jobs = [(outname, [["shapeworks", "readimage", "--name", inname] + writeImageArgs(outname, final=True)])
+            for inname, outname in zip(inDataList, outDataList)]
+    runSubjectCommands(jobs, workers)
+
+# how signed distance transforms are computed, see setDistanceTransformMethod
+distanceTransformMethod = 'fastmarching'
+
+def setDistanceTransformMethod(method):
+    """
+    Chooses how the grooming steps compute the signed distance transforms of
+    the antialiased segmentations: 'fastmarching' (the FastMarching tool) or
+    'maurer', the exact separable Euclidean distance transform of
+    `shapeworks signeddistance`, which is linear in the number of voxels and
+    multithreaded. DTBenchmark.py compares the two.
+    """
+    global distanceTransformMethod
+    if method not in ('fastmarching', 'maurer'):
+        raise ValueError("Unknown distance transform method " + str(method))
+    distanceTransformMethod = method
+
+def getDTArgs(isoValue=0):
+    """
+    The shapeworks arguments computing the signed distance transform of an
+    antialiased image with the chosen method
+    """
+    if distanceTransformMethod == 'maurer':
+        return ["signeddistance", "--isovalue", str(isoValue)]
+    return ["fastmarching", "--isovalue", str(isoValue)]
+
+def getDTCommand(dtnrrdfilename, isoValue=0):
+    """
+    The command replacing an antialiased image by its signed distance
+    transform, for the steps run with separate tools
+    """
+    if distanceTransformMethod == 'maurer':
+        return ["shapeworks", "readimage", "--name", dtnrrdfilename, *getDTArgs(isoValue), *writeImageArgs(dtnrrdfilename)]
+    return ["FastMarching", "--inFilename", dtnrrdfilename, "--outFilename", dtnrrdfilename, "--isoValue", str(isoValue)]
+
+# how rigid alignment runs ICP, see setICPMethod
+icpMethod = 'vtk'
+
+def setICPMethod(method):
+    """
+    Chooses how applyRigidAlignment runs ICP: 'vtk' (vtkIterativeClosestPointTransform
+    on the full resolution surfaces) or 'multiresolution', which runs ICP
+    coarse to fine on surfaces extracted from subsampled distance
+    transforms, matches a subsample of the source points with kd-tree
+    queries and stops each level once the mean distance between matched
+    points settles, so most iterations run on small surfaces.
+    """
+    global icpMethod
+    if method not in ('vtk', 'multiresolution'):
+        raise ValueError("Unknown ICP method " + str(method))
+    icpMethod = method
+
+def getICPArgs(icpIterations, method=None, levels=3, landmarks=1000, tolerance=0.001):
+    """
+    The ICPRigid3DImageRegistration arguments running ICP with the given
+    method (the chosen one by default). For the multiresolution method
+    icpIterations bounds the iterations of each level.
+    """
+    args = ["--icpIterations", str(icpIterations)]
+    if (method or icpMethod) == 'multiresolution':
+        args.extend(["--multiResolution", "1", "--levels", str(levels), "--landmarks", str(landmarks),
+                     "--tolerance", str(tolerance)])
+    return args
+
+# per subject facts recorded by the groom steps, see setShapeIndex
+shapeIndex = None
+
+def setShapeIndex(filename, thumbnailFactor=4):
+    """
+    Makes each groom step record the facts of the segmentations it produces
+    (dimensions, spacing, origin, foreground voxel count, center of mass,
+    bounding box and a mask thumbnail) in the SQLite file filename, see
+    ShapeIndex. The steps that follow then query it instead of reading the
+    volumes: center of mass alignment takes the center from it,
+    findLargestBoundingBox the extents, and FindReferenceImage ranks the
+    subjects on the thumbnails. None stops the recording.
+    """
+    global shapeIndex
+    shapeIndex = ShapeIndex(filename, thumbnailFactor) if filename else None
+
+def indexSegmentations(stage, inDataList, workers=1):
+    """
+    Records the segmentations produced by a groom step in the shape index,
+    if one is set
+    """
+    if shapeIndex is not None:
+        shapeIndex.update(inDataList, stage, workers)
+
+def getDTChainCommand(inname, tpdtnrrdfilename, antialiasIterations=20, smoothingIterations=1, isoValue=0):
+    """
+    Builds one `shapeworks` command that goes from a segmentation to its
+    smoothed distance transform without leaving memory: extract label, close
+    holes, antialias, signed distance (see setDistanceTransformMethod) and
+    topology preserving smoothing.
+    As with the separate tools, the label extracted and hole filled
+    segmentation is written back over the input. The intermediate .DT and
+    .ISO files of the separate tools are not produced.
+    """
+    return ["shapeworks", "readimage", "--name", inname,
+            "extractlabel", "--label", "1",
+            "closeholes",
+            *writeImageArgs(inname),
+            "antialias", "--numiterations", str(antialiasIterations),
+            *getDTArgs(isoValue),
+            "tpsmooth", "--iterations", str(smoothingIterations),
+            *writeImageArgs(tpdtnrrdfilename)]
+
+def getDTArtifactKind(antialiasIterations=20, smoothingIterations=1, isoValue=0):
+    """
+    Name under which smoothed distance transforms computed with these
+    parameters are registered in an ArtifactStore
+    """
+    kind = "tpSmoothDT_aa" + str(antialiasIterations) + "_s" + str(smoothingIterations) + "_iso" + str(isoValue)
+    if distanceTransformMethod != 'fastmarching':
+        kind += "_" + distanceTransformMethod
+    return kind
+
+def applyIsotropicResampling(outDir, inDataList, isoSpacing=1.0, recenter=True, isBinary=True, workers=1, cache=None):
     """
     Authors: Riddhish Bhalodia and Atefeh Ghanaatikashani
     Date: 8th August 2019
@@ -20,12 +170,25 @@ def applyIsotropicResampling(outDir, inDataList, isoSpacing=1.0, recenter=True,
     This function takes in a filelist and produces the resampled files in the
     appropriate directory.
     Input Parameters:
+        workers: number of subjects processed concurrently
+        cache: GroomCache used to skip subjects whose result is stored
     Output Parameters:
     """
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
+    os.makedirs(outDir, exist_ok=True)
+
+    chain = ["readimage", "--name", "{input}"]
+    if isBinary:
+        chain.extend(["antialias"])
+    chain.extend(["isoresample", "--isospacing", str(isoSpacing)])
+    if isBinary:
+        chain.extend(["binarize"])
+    if recenter:
+        chain.extend(["recenterimage"])
+    chain.extend(writeImageArgs("{output}"))
+    print("Calling cmd:\n"+" ".join(["shapeworks"] + chain))
 
     outDataList = []
+    jobs = []
     for i in range(len(inDataList)):
         inname = inDataList[i]
         spt = inname.rsplit(os.sep, 1)
@@ -40,28 +203,15 @@ def applyIsotropicResampling(outDir, inDataList, isoSpacing=1.0, recenter=True,
         cprint(("Output Filename : ", outname), 'yellow')
         print("######################################")
         print(" ")
+        jobs.append((inname, inname, outname))
 
-        cmd = ["shapeworks", "readimage", "--name", inname]
-
-        if isBinary:
-            cmd.extend(["antialias"])
-
-        cmd.extend(["isoresample", "--isospacing", str(isoSpacing)])  
-        
-        if isBinary:
-            cmd.extend(["binarize"])
-        if recenter:
-            cmd.extend(["recenterimage"])
-
-        cmd.extend(["writeimage", "--name", outname])
-        print(cmd)
-        print("Calling cmd:\n"+" ".join(cmd))
-        subprocess.check_call(cmd)
-
+    runShapeworksManifest(outDir, chain, jobs, workers, cache)
+    if isBinary:
+        indexSegmentations('resampled', outDataList, workers)
     return outDataList
 
 
-def applyPadding(parentDir, inDataListSeg, inDataListImg, padSize, padValue=0, processRaw=False):
+def applyPadding(parentDir, inDataListSeg, inDataListImg, padSize, padValue=0, processRaw=False, workers=1, cache=None):
     """
     Authors: Riddhish Bhalodia and Atefeh Ghanaatikashani
     Date: 8th August 2019
@@ -70,18 +220,23 @@ def applyPadding(parentDir, inDataListSeg, inDataListImg, padSize, padValue=0, p
     This function takes in a filelist and produces the padded files in the
     appropriate directory.
     Input Parameters:
+        workers: number of subjects processed concurrently
+        cache: GroomCache used to skip subjects whose result is stored
     Output Parameters:
     """
     outDir = parentDir + '/padded'
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
+    os.makedirs(outDir, exist_ok=True)
+
+    chain = ["readimage", "--name", "{input}", "pad", "--padding", str(padSize), "--value", str(padValue),
+             *writeImageArgs("{output}")]
+    print("Calling cmd:\n"+" ".join(["shapeworks"] + chain))
+    jobs = []
 
     if processRaw:
         # process segmentations
         binaryoutDir = outDir + '/segmentations'
 
-        if not os.path.exists(binaryoutDir):
-            os.makedirs(binaryoutDir)
+        os.makedirs(binaryoutDir, exist_ok=True)
         outDataListSeg = []
         for i in range(len(inDataListSeg)):
             inname = inDataListSeg[i]
@@ -97,20 +252,12 @@ def applyPadding(parentDir, inDataListSeg, inDataListImg, padSize, padValue=0, p
             cprint(("Output Filename : ", outname), 'yellow')
             print("######################################")
             print(" ")
-            
-            cmd = ["shapeworks", "readimage", "--name", inname]
-            cmd.extend(["pad" , "--padding" , str(
-                padSize) , "--value" , str(padValue)])
-            cmd.extend(["writeimage", "--name", outname])
-            print(cmd)
-            print("Calling cmd:\n"+" ".join(cmd))
-            subprocess.check_call(cmd)
+            jobs.append((inname, inname, outname))
 
         #process images
         rawoutDir = outDir + '/images'
 
-        if not os.path.exists(rawoutDir):
-            os.makedirs(rawoutDir)
+        os.makedirs(rawoutDir, exist_ok=True)
 
         outDataListImg = []
         for i in range(len(inDataListImg)):
@@ -127,15 +274,10 @@ def applyPadding(parentDir, inDataListSeg, inDataListImg, padSize, padValue=0, p
             cprint(("Output Filename : ", outname), 'yellow')
             print("######################################")
             print(" ")
+            jobs.append((inname, inname, outname))
 
-            cmd = ["shapeworks", "readimage", "--name", inname]
-            cmd.extend(["pad" , "--padding" , str(
-                padSize) , "--value" , str(padValue)])
-            cmd.extend(["writeimage", "--name", outname])
-            print(cmd)
-            print("Calling cmd:\n"+" ".join(cmd))
-            subprocess.check_call(cmd)
-
+        runShapeworksManifest(outDir, chain, jobs, workers, cache)
+        indexSegmentations('padded', outDataListSeg, workers)
         return [outDataListSeg, outDataListImg]
 
     else:
@@ -154,18 +296,25 @@ def applyPadding(parentDir, inDataListSeg, inDataListImg, padSize, padValue=0, p
             cprint(("Output Filename : ", outname), 'yellow')
             print("######################################")
             print(" ")
-            
-            cmd = ["shapeworks", "readimage", "--name", inname]
-            cmd.extend(["pad" , "--padding" , str(
-                padSize) , "--value" , str(padValue)])
-            cmd.extend(["writeimage", "--name", outname])
-            print(cmd)
-            print("Calling cmd:\n"+" ".join(cmd))
-            subprocess.check_call(cmd)
+            jobs.append((inname, inname, outname))
 
+        runShapeworksManifest(outDir, chain, jobs, workers, cache)
+        indexSegmentations('padded', outDataList, workers)
         return outDataList
 
-def applyCOMAlignment(parentDir, inDataListSeg, inDataListImg, processRaw=False):
+def getCenterArgs(inname):
+    """
+    The TranslateShapeToImageOrigin arguments centering a segmentation: the
+    center of mass from the shape index when it is there, or else computed
+    by the tool
+    """
+    entry = shapeIndex.get(inname) if shapeIndex is not None else None
+    if entry is None or entry['com'] is None:
+        return ["--useCenterOfMass", "1"]
+    return ["--useCenterOfMass", "0", "--centerX", repr(entry['com'][0]), "--centerY", repr(entry['com'][1]),
+            "--centerZ", repr(entry['com'][2])]
+
+def applyCOMAlignment(parentDir, inDataListSeg, inDataListImg, processRaw=False, workers=1, fused=False, cache=None):
     """
     Authors: Riddhish Bhalodia and Atefeh Ghanaatikashani
     Date: 8th August 2019
@@ -177,24 +326,24 @@ def applyCOMAlignment(parentDir, inDataListSeg, inDataListImg, processRaw=False)
     raw files (MRI/CT ...)
 
     Input Parameters:
+        workers: number of subjects processed concurrently
+        fused: use a single chained `shapeworks` command per subject
+        cache: GroomCache used to skip subjects whose result is stored
     Output Parameters:
     """
     outDir = parentDir + '/com_aligned'
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
-
+    os.makedirs(outDir, exist_ok=True)
 
+    jobs = []
 
 
     if processRaw:
         rawoutDir = outDir + '/images'
         binaryoutDir = outDir + '/segmentations'
 
-        if not os.path.exists(rawoutDir):
-            os.makedirs(rawoutDir)
+        os.makedirs(rawoutDir, exist_ok=True)
 
-        if not os.path.exists(binaryoutDir):
-            os.makedirs(binaryoutDir)
+        os.makedirs(binaryoutDir, exist_ok=True)
 
         outDataListSeg = []
         outDataListImg = []
@@ -223,9 +372,15 @@ def applyCOMAlignment(parentDir, inDataListSeg, inDataListImg, processRaw=False)
             cprint(("Output Parameter Filename : ", paramname), 'yellow')
             print("###########################################")
             print(" ")
-            execCommand = ["TranslateShapeToImageOrigin" , "--inFilename" , innameSeg , "--outFilename" , outnameSeg , "--useCenterOfMass",  "1" , "--parameterFilename " , paramname , "--MRIinFilename" , innameImg , "--MRIoutFilename" , outnameImg]
-            subprocess.check_call(execCommand)
-
+            if fused:
+                execCommand = ["shapeworks", "readimage", "--name", innameSeg, "translatecom", "--parameterfile", paramname, *writeImageArgs(outnameSeg),
+                               "readimage", "--name", innameImg, "applytranslation", *writeImageArgs(outnameImg)]
+            else:
+                execCommand = ["TranslateShapeToImageOrigin" , "--inFilename" , innameSeg , "--outFilename" , outnameSeg , *getCenterArgs(innameSeg) , "--parameterFilename " , paramname , "--MRIinFilename" , innameImg , "--MRIoutFilename" , outnameImg]
+            jobs.append((innameSeg, [execCommand], [innameSeg, innameImg], [outnameSeg, outnameImg, paramname]))
+
+        runSubjectCommands(jobs, workers, cache)
+        indexSegmentations('com_aligned', outDataListSeg, workers)
         return [outDataListSeg, outDataListImg]
     else:
         outDataListSeg = []
@@ -245,9 +400,14 @@ def applyCOMAlignment(parentDir, inDataListSeg, inDataListImg, processRaw=False)
             cprint(("Output Parameter Filename : ", paramname), 'yellow')
             print("###########################################")
             print(" ")
-            execCommand = ["TranslateShapeToImageOrigin" , "--inFilename" , inname , "--outFilename" , outname , "--useCenterOfMass" , "1" , "--parameterFilename" , paramname]
-            subprocess.check_call(execCommand)
-
+            if fused:
+                execCommand = ["shapeworks", "readimage", "--name", inname, "translatecom", "--parameterfile", paramname, *writeImageArgs(outname)]
+            else:
+                execCommand = ["TranslateShapeToImageOrigin" , "--inFilename" , inname , "--outFilename" , outname , *getCenterArgs(inname) , "--parameterFilename" , paramname]
+            jobs.append((inname, [execCommand], [inname], [outname, paramname]))
+
+        runSubjectCommands(jobs, workers, cache)
+        indexSegmentations('com_aligned', outDataListSeg, workers)
         return outDataListSeg
 
 
@@ -278,25 +438,101 @@ def create_tpSmooth_xml(xmlfilename, smoothingIterations, ref_dtnrrdfilename, re
 
 
 
-def FindReferenceImage(inDataList):
+def readSegmentation(filename):
     """
-        This find the median file between all the input files
+        Reads a segmentation as an array of its own voxel type, viewing the
+        voxels read by the shapeworks bindings when they are available, or
+        else mapping uncompressed files. Callers needing a mask compare the
+        values (e.g. == 1) rather than converting the whole array.
     """
-    IMG = []
-    DIM = []
-    for i in range(len(inDataList)):
-        tmp = itk.GetArrayFromImage(itk.imread(inDataList[i]))
-        IMG.append(tmp)
-        DIM.append(tmp.shape)
+    if sw is not None:
+        return np.asarray(sw.Image(filename).toArray())
+    return np.asarray(readNrrdArray(filename))
 
-    ref_dim = np.max(DIM, axis =0)
+def addPadded(total, array):
+    """
+        Adds array into the corner of total, zero padding total first when
+        array is larger along some axis (or promoting it when it cannot hold
+        the values of array), and returns the sum
+    """
+    if total is None:
+        return array.astype(np.result_type(array.dtype, np.uint32))
+    shape = np.maximum(total.shape, array.shape)
+    dtype = np.result_type(total.dtype, array.dtype)
+    if tuple(shape) != total.shape or dtype != total.dtype:
+        grown = np.zeros(shape, dtype=dtype)
+        grown[tuple(slice(0, d) for d in total.shape)] = total
+        total = grown
+    total[tuple(slice(0, d) for d in array.shape)] += array
+    return total
+
+def sumSegmentations(inDataList):
+    """
+        First pass of FindReferenceImage: sum of the zero padded segmentations,
+        reading one of them at a time
+    """
+    total = None
+    for inname in inDataList:
+        total = addPadded(total, readSegmentation(inname))
+    return total
 
-    for i in range(len(inDataList)):
-        IMG[i] = np.pad(IMG[i], ((0,ref_dim[0]-DIM[i][0]),(0,ref_dim[1]-DIM[i][1]), (0,ref_dim[2]-DIM[i][2])), mode ='constant' , constant_values = 0)
+def distancesToMean(inDataList, mean):
+    """
+        Second pass of FindReferenceImage: distance of each zero padded
+        segmentation (a file, or an array) to the mean. The padding only
+        contributes the mean there, so it is accounted for without padding
+        the segmentation.
+    """
+    meanSquaredSum = np.sum(mean ** 2)
+    distances = []
+    for inname in inDataList:
+        img = readSegmentation(inname) if isinstance(inname, str) else inname
+        region = mean[tuple(slice(0, d) for d in img.shape)]
+        distances.append(np.sqrt(np.sum((img - region) ** 2) + meanSquaredSum - np.sum(region ** 2)))
+    return distances
+
+def upsampleThumbnail(thumbnail, factor):
+    """
+        Full resolution array of a ShapeIndex thumbnail, as foreground
+        fractions
+    """
+    for axis in range(3):
+        thumbnail = np.repeat(thumbnail, factor, axis=axis)
+    return thumbnail / 255.0
 
-    COM = np.sum(np.asarray(IMG), axis=0) / len(inDataList)
+def findReferenceCandidates(entries, candidates):
+    """
+        Ranks the subjects by the distance of their ShapeIndex thumbnail to
+        the mean thumbnail and returns the indices of the closest ones, along
+        with the full resolution mean
+    """
+    total = None
+    for entry in entries:
+        total = addPadded(total, entry['thumbnail'])
+    mean = total / len(entries)
+    distances = distancesToMean([entry['thumbnail'] for entry in entries], mean)
+    return np.argsort(distances)[:candidates], upsampleThumbnail(mean, entries[0]['thumbnailFactor'])
+
+def FindReferenceImage(inDataList, workers=1, candidates=5):
+    """
+        This find the median file between all the input files
+        Both passes over the files (the mean, then the distances to it) keep
+        only one segmentation in memory at a time per worker process.
+        When the shape index holds all the files, the subjects are ranked on
+        their thumbnails instead, and only the closest candidates are read
+        to compare them to the mean at full resolution.
+        Input Parameters:
+            workers: number of processes reading the segmentations
+            candidates: number of subjects checked at full resolution
+    """
+    entries = [shapeIndex.get(inname) for inname in inDataList] if shapeIndex is not None else [None]
+    if all(entry is not None for entry in entries) and len(set(entry['thumbnailFactor'] for entry in entries)) == 1:
+        indices, mean = findReferenceCandidates(entries, candidates)
+        distances = distancesToMean([inDataList[i] for i in indices], mean)
+        idx = indices[np.argmin(distances)]
+    else:
+        idx = findMedianImage(inDataList, workers)
 
-    idx = np.argmin(np.sqrt(np.sum((np.asarray(IMG) - COM) ** 2, axis=(1, 2, 3))))
     print(" ")
     print("############# Reference File #############")
     cprint(("The reference file for rigid alignment is found"), 'green')
@@ -305,10 +541,112 @@ def FindReferenceImage(inDataList):
     print(" ")
     return inDataList[idx]
 
+def findMedianImage(inDataList, workers=1):
+    """
+        Index of the file closest to the mean of all of them, for
+        FindReferenceImage
+    """
+    if workers is None or workers <= 1:
+        mean = sumSegmentations(inDataList) / len(inDataList)
+        distances = distancesToMean(inDataList, mean)
+    else:
+        chunks = [inDataList[i::workers] for i in range(workers) if inDataList[i::workers]]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            total = None
+            for partial in executor.map(sumSegmentations, chunks):
+                total = addPadded(total, partial)
+            mean = total / len(inDataList)
+            del total
+            chunkDistances = list(executor.map(distancesToMean, chunks, [mean] * len(chunks)))
+        # undo the interleaving of the chunks
+        distances = [None] * len(inDataList)
+        for i, chunk in enumerate(chunkDistances):
+            distances[i::workers] = chunk
+    return np.argmin(distances)
+
+
+
+def getTransformationFilename(parentDir, inname):
+    """
+        Name of the transformation matrix written by applyRigidAlignment for
+        the segmentation inname
+    """
+    transoutDir = parentDir + '/aligned/transformations'
+    initPath = inname.rsplit(os.sep, 1)[0]
+    return inname.replace(initPath, transoutDir).replace('.nrrd', '.transformationMatrix.txt')
 
+def getStoredDT(artifacts, dtKind, segFile, refFile, ref_tpdtnrrdfilename):
+    """
+        Returns an already computed distance transform for segFile (the
+        reference one if segFile is the reference), None if there is none
+    """
+    if os.path.normpath(segFile) == os.path.normpath(refFile):
+        return ref_tpdtnrrdfilename
+    if artifacts is not None:
+        return artifacts.get(dtKind, segFile)
+    return None
+
+def prepareRigidReference(parentDir, refFile, antialiasIterations=20, smoothingIterations=1, isoValue=0, fused=False, cache=None, artifacts=None):
+    """
+    Computes the distance transform of the reference used by
+    applyRigidAlignment and returns its filename. It is run by
+    applyRigidAlignment unless that is given the result as refDTFile.
+    """
+    # identify the reference scan
+    refDir = parentDir + '/aligned/reference'
+    os.makedirs(refDir, exist_ok=True)
+    spt = refFile.rsplit(os.sep, 1)
+    initPath = spt[0]
+    newRefFile = refFile.replace(initPath, refDir)
+
+    ref_dtnrrdfilename = newRefFile.replace('.nrrd', '.DT.nrrd')
+    ref_tpdtnrrdfilename = newRefFile.replace('.nrrd', '.tpSmoothDT.nrrd')
+    ref_isonrrdfilename = newRefFile.replace('.nrrd', '.ISO.nrrd')
+    ref_binnrrdfilename = newRefFile.replace('.nrrd', '.BIN.nrrd')
+
+    # reference image processing
+    dtKind = getDTArtifactKind(antialiasIterations, smoothingIterations, isoValue)
+    storedRefDT = artifacts.get(dtKind, refFile) if artifacts is not None else None
+    refCommandList = []
+    refInputs = [refFile]
+    refOutputs = [refFile, ref_tpdtnrrdfilename, ref_binnrrdfilename]
+    if storedRefDT is not None:
+        ref_tpdtnrrdfilename = storedRefDT
+        execCommand = ["shapeworks", "readimage", "--name", ref_tpdtnrrdfilename, "threshold", "--min", "-0.000001", *writeImageArgs(ref_binnrrdfilename)]
+        refCommandList.append(execCommand)
+        refInputs = [ref_tpdtnrrdfilename]
+        refOutputs = [ref_binnrrdfilename]
+    elif fused:
+        execCommand = getDTChainCommand(refFile, ref_tpdtnrrdfilename, antialiasIterations, smoothingIterations, isoValue)
+        execCommand.extend(["threshold", "--min", "-0.000001", *writeImageArgs(ref_binnrrdfilename)])
+        refCommandList.append(execCommand)
+    else:
+        execCommand = ["ExtractGivenLabelImage" , "--inFilename" , refFile , "--outFilename" , refFile , "--labelVal" , " 1"]
+        refCommandList.append(execCommand)
+        execCommand = ["CloseHoles",  "--inFilename" , refFile , "--outFilename" , refFile]
+        refCommandList.append(execCommand)
+        execCommand = ["shapeworks", "readimage", "--name", refFile, "antialias", "--numiterations", str(antialiasIterations), *writeImageArgs(ref_dtnrrdfilename)]
+        refCommandList.append(execCommand)
+
+        execCommand = getDTCommand(ref_dtnrrdfilename, isoValue)
+        refCommandList.append(execCommand)
+
+        xmlfilename = newRefFile.replace('.nrrd', '.tpSmoothDT.xml')
+        create_tpSmooth_xml(xmlfilename, smoothingIterations, ref_dtnrrdfilename, ref_isonrrdfilename, ref_tpdtnrrdfilename)
+        create_cpp_xml(xmlfilename, xmlfilename)
+        refInputs.append(xmlfilename)
+        execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
+        refCommandList.append(execCommand)
+        execCommand = ["ThresholdImages" , "--inFilename" , ref_tpdtnrrdfilename , "--outFilename" , ref_binnrrdfilename , "--lowerThresholdLevel" , "-0.000001"]
+        refCommandList.append(execCommand)
+    runSubjectCommands([(refFile, refCommandList, refInputs, refOutputs)], cache=cache)
+    if artifacts is not None:
+        artifacts.add(dtKind, refFile, ref_tpdtnrrdfilename)
+    return ref_tpdtnrrdfilename
 
 def applyRigidAlignment(parentDir, inDataListSeg, inDataListImg, refFile, antialiasIterations=20,
-                        smoothingIterations=1, isoValue=0, icpIterations=10, processRaw = False):
+                        smoothingIterations=1, isoValue=0, icpIterations=10, processRaw = False, workers=1, fused=False, cache=None, artifacts=None, refDTFile=None,
+                        icpMethod=None):
     """
     Authors: Riddhish Bhalodia and Atefeh Ghanaatikashani
     Date: 8th August 2019
@@ -320,72 +658,52 @@ def applyRigidAlignment(parentDir, inDataListSeg, inDataListImg, refFile, antial
     raw files (MRI/CT ...)
 
     Input Parameters:
+        workers: number of subjects processed concurrently
+        fused: compute each distance transform used for ICP with a single
+               chained `shapeworks` command
+        cache: GroomCache used to skip subjects whose result is stored
+        artifacts: ArtifactStore holding the distance transforms computed so
+                   far. Those found are used for ICP instead of being
+                   recomputed, and the aligned distance transforms are
+                   registered for the aligned segmentations.
+        refDTFile: distance transform of refFile from prepareRigidReference,
+                   computed here if not given
+        icpMethod: 'vtk' or 'multiresolution', the method chosen with
+                   setICPMethod if not given
     Output Parameters:
     """
     outDir = parentDir + '/aligned'
     transoutDir = outDir + '/transformations'
 
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
-    if not os.path.exists(transoutDir):
-        os.makedirs(transoutDir)
-
-
-    # identify the reference scan
-    refDir = outDir + '/reference'
-    if not os.path.exists(refDir):
-        os.makedirs(refDir)
-    spt = refFile.rsplit(os.sep, 1)
-    initPath = spt[0]
-    newRefFile = refFile.replace(initPath, refDir)
-
-    ref_dtnrrdfilename = newRefFile.replace('.nrrd', '.DT.nrrd')
-    ref_tpdtnrrdfilename = newRefFile.replace('.nrrd', '.tpSmoothDT.nrrd')
-    ref_isonrrdfilename = newRefFile.replace('.nrrd', '.ISO.nrrd')
-    ref_binnrrdfilename = newRefFile.replace('.nrrd', '.BIN.nrrd')
+    os.makedirs(outDir, exist_ok=True)
+    os.makedirs(transoutDir, exist_ok=True)
 
-    # reference image processing
-    execCommand = ["ExtractGivenLabelImage" , "--inFilename" , refFile , "--outFilename" , refFile , "--labelVal" , " 1"]
-    subprocess.check_call(execCommand)
-    execCommand = ["CloseHoles",  "--inFilename" , refFile , "--outFilename" , refFile]
-    subprocess.check_call(execCommand)
-    execCommand = ["shapeworks", "readimage", "--name", refFile, "antialias", "--numiterations", str(antialiasIterations), "writeimage", "--name", ref_dtnrrdfilename]
-    subprocess.check_call(execCommand)
-
-    execCommand = ["FastMarching" ,  "--inFilename" , ref_dtnrrdfilename , "--outFilename" , ref_dtnrrdfilename , "--isoValue" , str(
-        isoValue)]
-    subprocess.check_call(execCommand)
-
-    xmlfilename = newRefFile.replace('.nrrd', '.tpSmoothDT.xml')
-    create_tpSmooth_xml(xmlfilename, smoothingIterations, ref_dtnrrdfilename, ref_isonrrdfilename, ref_tpdtnrrdfilename)
-    create_cpp_xml(xmlfilename, xmlfilename)
-    execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
-    subprocess.check_call(execCommand)
-    execCommand = ["ThresholdImages" , "--inFilename" , ref_tpdtnrrdfilename , "--outFilename" , ref_binnrrdfilename , "--lowerThresholdLevel" , "-0.000001"]
-    subprocess.check_call(execCommand)
 
+    dtKind = getDTArtifactKind(antialiasIterations, smoothingIterations, isoValue)
+    if refDTFile is None:
+        refDTFile = prepareRigidReference(parentDir, refFile, antialiasIterations, smoothingIterations, isoValue, fused, cache, artifacts)
+    ref_tpdtnrrdfilename = refDTFile
 
+    jobs = []
     if processRaw:
         rawoutDir = outDir + '/images'
         binaryoutDir = outDir + '/segmentations'
 
-        if not os.path.exists(rawoutDir):
-            os.makedirs(rawoutDir)
+        os.makedirs(rawoutDir, exist_ok=True)
 
-        if not os.path.exists(binaryoutDir):
-            os.makedirs(binaryoutDir)
+        os.makedirs(binaryoutDir, exist_ok=True)
 
         outRawDataList=[]
         outSegDataList=[]
         for i in range(len(inDataListSeg)):
+            commandList = []
             seginname = inDataListSeg[i]
             spt = seginname.rsplit(os.sep, 1)
             initPath = spt[0]
             filename = spt[1]
             segoutname = seginname.replace(initPath, binaryoutDir)
             segoutname = segoutname.replace('.nrrd', '.aligned.nrrd')
-            transoutname = seginname.replace(initPath, transoutDir)
-            transformation = transoutname.replace('.nrrd', '.transformationMatrix.txt')
+            transformation = getTransformationFilename(parentDir, seginname)
             outSegDataList.append(segoutname)
 
             rawinname = inDataListImg[i]
@@ -410,39 +728,59 @@ def applyRigidAlignment(parentDir, inDataListSeg, inDataListImg, refFile, antial
             cprint(("Output Transformation Matrix : ", transformation), 'yellow')
             print("###########################################")
             print(" ")
-            execCommand = ["ExtractGivenLabelImage", "--inFilename" , seginname , "--outFilename" , seginname , "--labelVal" , "1"]
-            subprocess.check_call(execCommand)
-            execCommand = ["CloseHoles" , "--inFilename" , seginname , "--outFilename" , seginname]
-            subprocess.check_call(execCommand)
-            execCommand = ["shapeworks", "readimage", "--name", seginname, "antialias", "--numiterations", str(antialiasIterations), "writeimage", "--name", dtnrrdfilename]
-            subprocess.check_call(execCommand)
-            execCommand = ["FastMarching" , "--inFilename" , dtnrrdfilename , "--outFilename" , dtnrrdfilename , "--isoValue" , str(
-                isoValue)]
-            subprocess.check_call(execCommand)
-
-            xmlfilename = segoutname.replace('.aligned.nrrd', '.aligned.tpSmoothDT.xml')
-            create_tpSmooth_xml(xmlfilename, smoothingIterations, dtnrrdfilename, isonrrdfilename, tpdtnrrdfilename)
-            create_cpp_xml(xmlfilename, xmlfilename)
-            execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
-            subprocess.check_call(execCommand )
-            execCommand = ["ICPRigid3DImageRegistration" , "--targetDistanceMap" , ref_tpdtnrrdfilename , "--sourceDistanceMap" , tpdtnrrdfilename , "--sourceSegmentation" , seginname , "--sourceRaw" , rawinname , "--icpIterations" , str(
-                icpIterations) , "--visualizeResult",  "0" ,  "--solutionSegmentation" , segoutname , "--solutionRaw" , rawoutname , "--solutionTransformation" , transformation]
-            subprocess.check_call(execCommand )
-
+            inputs = [seginname, rawinname, ref_tpdtnrrdfilename]
+            storedDT = getStoredDT(artifacts, dtKind, seginname, refFile, ref_tpdtnrrdfilename)
+            if storedDT is not None:
+                tpdtnrrdfilename = storedDT
+                inputs.append(storedDT)
+            elif fused:
+                execCommand = getDTChainCommand(seginname, tpdtnrrdfilename, antialiasIterations, smoothingIterations, isoValue)
+                commandList.append(execCommand)
+            else:
+                execCommand = ["ExtractGivenLabelImage", "--inFilename" , seginname , "--outFilename" , seginname , "--labelVal" , "1"]
+                commandList.append(execCommand)
+                execCommand = ["CloseHoles" , "--inFilename" , seginname , "--outFilename" , seginname]
+                commandList.append(execCommand)
+                execCommand = ["shapeworks", "readimage", "--name", seginname, "antialias", "--numiterations", str(antialiasIterations), *writeImageArgs(dtnrrdfilename)]
+                commandList.append(execCommand)
+                execCommand = getDTCommand(dtnrrdfilename, isoValue)
+                commandList.append(execCommand)
+
+                xmlfilename = segoutname.replace('.aligned.nrrd', '.aligned.tpSmoothDT.xml')
+                create_tpSmooth_xml(xmlfilename, smoothingIterations, dtnrrdfilename, isonrrdfilename, tpdtnrrdfilename)
+                create_cpp_xml(xmlfilename, xmlfilename)
+                inputs.append(xmlfilename)
+                execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
+                commandList.append(execCommand)
+
+            execCommand = ["ICPRigid3DImageRegistration" , "--targetDistanceMap" , ref_tpdtnrrdfilename , "--sourceDistanceMap" , tpdtnrrdfilename , "--sourceSegmentation" , seginname , "--sourceRaw" , rawinname , *getICPArgs(icpIterations, icpMethod) ,
+                "--visualizeResult",  "0" ,  "--solutionSegmentation" , segoutname , "--solutionRaw" , rawoutname , "--solutionTransformation" , transformation]
+            outputs = [seginname, tpdtnrrdfilename, segoutname, rawoutname, transformation]
+            if artifacts is not None:
+                aligneddtfilename = segoutname.replace('.nrrd', '.' + dtKind + '.nrrd')
+                execCommand.extend(["--solutionDistanceMap", aligneddtfilename])
+                outputs.append(aligneddtfilename)
+                artifacts.add(dtKind, seginname, tpdtnrrdfilename)
+                artifacts.add(dtKind, segoutname, aligneddtfilename)
+            commandList.append(execCommand)
+            jobs.append((seginname, commandList, inputs, outputs))
+
+        runSubjectCommands(jobs, workers, cache)
+        indexSegmentations('aligned', outSegDataList, workers)
         return  [outSegDataList, outRawDataList]
 
     else:
 
         outDataList = []
         for i in range(len(inDataListSeg)):
+            commandList = []
             inname = inDataListSeg[i]
             spt = inname.rsplit(os.sep, 1)
             initPath = spt[0]
             #filename = spt[1]
             outname = inname.replace(initPath, outDir)
             outname = outname.replace('.nrrd', '.aligned.nrrd')
-            transoutname = inname.replace(initPath, transoutDir)
-            transformation = transoutname.replace('.nrrd', '.tarnsormationMatrix.txt')
+            transformation = getTransformationFilename(parentDir, inname)
             outDataList.append(outname)
 
             dtnrrdfilename = outname.replace('.aligned.nrrd', '.aligned.DT.nrrd')
@@ -457,46 +795,79 @@ def applyRigidAlignment(parentDir, inDataListSeg, inDataListImg, refFile, antial
             cprint(("Output Transformation Matrix : ", transformation), 'yellow')
             print("###########################################")
             print(" ")
-            execCommand = ["ExtractGivenLabelImage" , "--inFilename" , inname , "--outFilename" , inname , "--labelVal",  "1"]
-            subprocess.check_call(execCommand )
-            execCommand = ["CloseHoles" , "--inFilename" , inname , "--outFilename" , inname]
-            subprocess.check_call(execCommand )
-            execCommand = ["shapeworks", "readimage", "--name", inname, "antialias", "--numiterations", str(antialiasIterations), "writeimage", "--name", dtnrrdfilename]
-            subprocess.check_call(execCommand )
-            execCommand = ["FastMarching" , "--inFilename" , dtnrrdfilename , "--outFilename" , dtnrrdfilename , "--isoValue" , str(
-                isoValue)]
-            subprocess.check_call(execCommand )
-
-            xmlfilename = outname.replace('.aligned.nrrd', '.aligned.tpSmoothDT.xml')
-            create_tpSmooth_xml(xmlfilename, smoothingIterations, dtnrrdfilename, isonrrdfilename, tpdtnrrdfilename)
-            create_cpp_xml(xmlfilename, xmlfilename)
-            execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
-            subprocess.check_call(execCommand )
-            execCommand = ["ICPRigid3DImageRegistration" , "--targetDistanceMap" , ref_tpdtnrrdfilename , "--sourceDistanceMap" , tpdtnrrdfilename , "--sourceSegmentation" , inname , "--icpIterations" , str(
-                icpIterations) , "--visualizeResult",  "0" ,  "--solutionSegmentation" , outname , "--solutionTransformation" , transformation]
-            subprocess.check_call(execCommand )
-
+            inputs = [inname, ref_tpdtnrrdfilename]
+            storedDT = getStoredDT(artifacts, dtKind, inname, refFile, ref_tpdtnrrdfilename)
+            if storedDT is not None:
+                tpdtnrrdfilename = storedDT
+                inputs.append(storedDT)
+            elif fused:
+                execCommand = getDTChainCommand(inname, tpdtnrrdfilename, antialiasIterations, smoothingIterations, isoValue)
+                commandList.append(execCommand)
+            else:
+                execCommand = ["ExtractGivenLabelImage" , "--inFilename" , inname , "--outFilename" , inname , "--labelVal",  "1"]
+                commandList.append(execCommand)
+                execCommand = ["CloseHoles" , "--inFilename" , inname , "--outFilename" , inname]
+                commandList.append(execCommand)
+                execCommand = ["shapeworks", "readimage", "--name", inname, "antialias", "--numiterations", str(antialiasIterations), *writeImageArgs(dtnrrdfilename)]
+                commandList.append(execCommand)
+                execCommand = getDTCommand(dtnrrdfilename, isoValue)
+                commandList.append(execCommand)
+
+                xmlfilename = outname.replace('.aligned.nrrd', '.aligned.tpSmoothDT.xml')
+                create_tpSmooth_xml(xmlfilename, smoothingIterations, dtnrrdfilename, isonrrdfilename, tpdtnrrdfilename)
+                create_cpp_xml(xmlfilename, xmlfilename)
+                inputs.append(xmlfilename)
+                execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
+                commandList.append(execCommand)
+
+            execCommand = ["ICPRigid3DImageRegistration" , "--targetDistanceMap" , ref_tpdtnrrdfilename , "--sourceDistanceMap" , tpdtnrrdfilename , "--sourceSegmentation" , inname , *getICPArgs(icpIterations, icpMethod) ,
+                "--visualizeResult",  "0" ,  "--solutionSegmentation" , outname , "--solutionTransformation" , transformation]
+            outputs = [inname, tpdtnrrdfilename, outname, transformation]
+            if artifacts is not None:
+                aligneddtfilename = outname.replace('.nrrd', '.' + dtKind + '.nrrd')
+                execCommand.extend(["--solutionDistanceMap", aligneddtfilename])
+                outputs.append(aligneddtfilename)
+                artifacts.add(dtKind, inname, tpdtnrrdfilename)
+                artifacts.add(dtKind, outname, aligneddtfilename)
+            commandList.append(execCommand)
+            jobs.append((inname, commandList, inputs, outputs))
+
+        runSubjectCommands(jobs, workers, cache)
+        indexSegmentations('aligned', outDataList, workers)
         return outDataList
 
-def applyCropping(parentDir, inDataListSeg, inDataListImg, paddingSize=10, processRaw=False):
+def computeExtents(inDataListSeg, workers=1, cache=None):
     """
-    Author: Riddhish Bhalodia
-    Date: 8th August 2019
-
-    This function takes in a filelist and crops them according to the largest
-    bounding box which it discovers
-    Input Parameters:
-    Output Parameters:
+    Computes the extent of each segmentation with FindLargestBoundingBox,
+    workers at a time, into an extent file next to it (the segmentation
+    filename followed by .extent.txt). Extent files newer than their
+    segmentation are kept, and those of the segmentations in the shape index
+    are written from it. Returns the extent files.
     """
-    outDir = parentDir + '/cropped'
-
-
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
+    extentFiles = [inname + '.extent.txt' for inname in inDataListSeg]
+    jobs = []
+    for inname, extentFile in zip(inDataListSeg, extentFiles):
+        if os.path.exists(extentFile) and os.path.getmtime(extentFile) > os.path.getmtime(inname):
+            continue
+        entry = shapeIndex.get(inname) if shapeIndex is not None else None
+        if entry is not None:
+            with open(extentFile, 'w') as f:
+                for values in (entry['dims'], entry['smallestIndex'], entry['largestIndex'], [entry['foreground']]):
+                    f.write(' '.join(str(v) for v in values) + '\n')
+            continue
+        jobs.append((inname, [["FindLargestBoundingBox", "--image", inname]], [inname], [extentFile]))
+    runSubjectCommands(jobs, workers, cache)
+    return extentFiles
+
+def findLargestBoundingBox(cropinfoDir, inDataListSeg, paddingSize=10, cache=None, workers=1):
+    """
+    Runs FindLargestBoundingBox over the segmentations and returns the size
+    and the starting index of the box, as [bb0, bb1, bb2, smI0, smI1, smI2]
 
-    cropinfoDir = outDir + '/crop_info'
-    if not os.path.exists(cropinfoDir):
-        os.makedirs(cropinfoDir)
+    The extents of the segmentations are computed in parallel first (see
+    computeExtents), so that combining them reads no image.
+    """
+    extentFiles = computeExtents(inDataListSeg, workers, cache)
 
     # first create a txtfile with all the scan names in it.
     txtfile = cropinfoDir + "_dataList.txt"
@@ -508,24 +879,57 @@ def applyCropping(parentDir, inDataListSeg, inDataListImg, paddingSize=10, proce
 
     outPrefix = cropinfoDir + "largest_bounding_box"
     execCommand = ["FindLargestBoundingBox" , "--paddingSize" , str(
-        paddingSize) , "--inFilename" , txtfile , "--outPrefix" , outPrefix]
-    subprocess.check_call(execCommand )
+        paddingSize) , "--inFilename" , txtfile , "--outPrefix" , outPrefix, "--useExtentFiles", "1"]
+    bbFiles = [outPrefix + suffix for suffix in ["_bb0.txt", "_bb1.txt", "_bb2.txt",
+               "_smallestIndex0.txt", "_smallestIndex1.txt", "_smallestIndex2.txt"]]
+    runSubjectCommands([(txtfile, [execCommand], [txtfile] + extentFiles, bbFiles)], cache=cache)
     # read all the bounding box files for cropping
-    bb0 = np.loadtxt(outPrefix + "_bb0.txt")
-    bb1 = np.loadtxt(outPrefix + "_bb1.txt")
-    bb2 = np.loadtxt(outPrefix + "_bb2.txt")
-    smI0 = np.loadtxt(outPrefix + "_smallestIndex0.txt")
-    smI1 = np.loadtxt(outPrefix + "_smallestIndex1.txt")
-    smI2 = np.loadtxt(outPrefix + "_smallestIndex2.txt")
+    return [float(np.loadtxt(bbFile)) for bbFile in bbFiles]
+
+def getRegionArgs(bb0, bb1, bb2, smI0, smI1, smI2):
+    """
+    Options of the `shapeworks` crop and aligncrop commands for the given box
+    """
+    return ["--startx", str(int(smI0)), "--starty", str(int(smI1)), "--startz", str(int(smI2)),
+            "--sizex", str(int(bb0)), "--sizey", str(int(bb1)), "--sizez", str(int(bb2))]
 
+def applyCropping(parentDir, inDataListSeg, inDataListImg, paddingSize=10, processRaw=False, workers=1, fused=False, cache=None, artifacts=None, boundingBox=None):
+    """
+    Author: Riddhish Bhalodia
+    Date: 8th August 2019
+
+    This function takes in a filelist and crops them according to the largest
+    bounding box which it discovers
+    Input Parameters:
+        workers: number of subjects processed concurrently
+        fused: crop with a single chained `shapeworks` command per subject
+        cache: GroomCache used to skip subjects whose result is stored
+        artifacts: ArtifactStore, the products registered for a segmentation
+                   are cropped along with it and registered for the output
+        boundingBox: result of findLargestBoundingBox, computed from
+                     inDataListSeg if not given
+    Output Parameters:
+    """
+    outDir = parentDir + '/cropped'
+
+
+    os.makedirs(outDir, exist_ok=True)
+
+    cropinfoDir = outDir + '/crop_info'
+    os.makedirs(cropinfoDir, exist_ok=True)
+
+    if boundingBox is None:
+        boundingBox = findLargestBoundingBox(cropinfoDir, inDataListSeg, paddingSize, cache, workers)
+    bb0, bb1, bb2, smI0, smI1, smI2 = boundingBox
+    cropArgs = ["crop"] + getRegionArgs(bb0, bb1, bb2, smI0, smI1, smI2)
+
+    jobs = []
     if processRaw:
         rawoutDir = outDir + '/images'
         binaryoutDir = outDir + '/segmentations'
 
-        if not os.path.exists(rawoutDir):
-            os.makedirs(rawoutDir)
-        if not os.path.exists(binaryoutDir):
-            os.makedirs(binaryoutDir)
+        os.makedirs(rawoutDir, exist_ok=True)
+        os.makedirs(binaryoutDir, exist_ok=True)
         outDataListSeg = []
         outDataListImg = []
         for i in range(len(inDataListSeg)):
@@ -551,12 +955,28 @@ def applyCropping(parentDir, inDataListSeg, inDataListImg, paddingSize=10, proce
             cprint(("Output Image Filename : ", outnameImg), 'yellow')
             print("######################################")
             print(" ")
-            execCommand = ["CropImages" , "--inFilename" , innameSeg , "--outFilename" , outnameSeg , "--bbX" , str(
-                bb0) , "--bbY" , str(bb1) , "--bbZ" , str(bb2) , "--startingIndexX" , str(
-                smI0) , "--startingIndexY" , str(smI1) , "--startingIndexZ" , str(
-                smI2) , "--MRIinFilename" , innameImg , "--MRIoutFilename" , outnameImg]
-            subprocess.check_call(execCommand )
-
+            if fused:
+                execCommand = ["shapeworks", "readimage", "--name", innameSeg] + cropArgs + [*writeImageArgs(outnameSeg),
+                               "readimage", "--name", innameImg] + cropArgs + writeImageArgs(outnameImg)
+            else:
+                execCommand = ["CropImages" , "--inFilename" , innameSeg , "--outFilename" , outnameSeg , "--bbX" , str(
+                    bb0) , "--bbY" , str(bb1) , "--bbZ" , str(bb2) , "--startingIndexX" , str(
+                    smI0) , "--startingIndexY" , str(smI1) , "--startingIndexZ" , str(
+                    smI2) , "--MRIinFilename" , innameImg , "--MRIoutFilename" , outnameImg]
+            commandList = [execCommand]
+            inputs = [innameSeg, innameImg]
+            outputs = [outnameSeg, outnameImg]
+            if artifacts is not None:
+                for kind, product in artifacts.getAll(innameSeg):
+                    croppedProduct = outnameSeg.replace('.nrrd', '.' + kind + '.nrrd')
+                    commandList.append(["shapeworks", "readimage", "--name", product] + cropArgs + writeImageArgs(croppedProduct))
+                    inputs.append(product)
+                    outputs.append(croppedProduct)
+                    artifacts.add(kind, outnameSeg, croppedProduct)
+            jobs.append((innameSeg, commandList, inputs, outputs))
+
+        runSubjectCommands(jobs, workers, cache)
+        indexSegmentations('cropped', outDataListSeg, workers)
         return [outDataListSeg, outDataListImg]
     else:
         outDataList = []
@@ -574,13 +994,130 @@ def applyCropping(parentDir, inDataListSeg, inDataListImg, paddingSize=10, proce
             cprint(("Output Filename : ", outname), 'yellow')
             print("######################################")
             print(" ")
-            execCommand = ["CropImages" , "--inFilename" , inname , "--outFilename" , outname , "--bbX" , str(
-                bb0) , "--bbY" , str(bb1) , "--bbZ" , str(bb2) , "--startingIndexX" , str(
-                smI0) , "--startingIndexY" , str(smI1) , "--startingIndexZ" , str(smI2)]
-            subprocess.check_call(execCommand )
-
+            if fused:
+                execCommand = ["shapeworks", "readimage", "--name", inname] + cropArgs + writeImageArgs(outname)
+            else:
+                execCommand = ["CropImages" , "--inFilename" , inname , "--outFilename" , outname , "--bbX" , str(
+                    bb0) , "--bbY" , str(bb1) , "--bbZ" , str(bb2) , "--startingIndexX" , str(
+                    smI0) , "--startingIndexY" , str(smI1) , "--startingIndexZ" , str(smI2)]
+            commandList = [execCommand]
+            inputs = [inname]
+            outputs = [outname]
+            if artifacts is not None:
+                for kind, product in artifacts.getAll(inname):
+                    croppedProduct = outname.replace('.nrrd', '.' + kind + '.nrrd')
+                    commandList.append(["shapeworks", "readimage", "--name", product] + cropArgs + writeImageArgs(croppedProduct))
+                    inputs.append(product)
+                    outputs.append(croppedProduct)
+                    artifacts.add(kind, outname, croppedProduct)
+            jobs.append((inname, commandList, inputs, outputs))
+
+        runSubjectCommands(jobs, workers, cache)
+        indexSegmentations('cropped', outDataList, workers)
         return outDataList
 
+def applyAlignmentAndCropping(parentDir, inDataListSeg, inDataListImg, comDataListSeg, refFile,
+                              paddingSize=10, processRaw=False, workers=1, cache=None):
+    """
+    This function produces the cropped files of applyCropping from the files
+    before center of mass alignment, resampling each of them only once. The
+    center of mass translation and the rigid transformation are combined
+    into one transform. The segmentations are resampled through it into the
+    whole reference grid, the largest bounding box is measured on them, and
+    they are cropped to it without resampling again. The images are
+    resampled straight into the box. applyCOMAlignment and
+    applyRigidAlignment only need to have been run on the segmentations, to
+    compute the transformations.
+    Unlike the outputs of ICPRigid3DImageRegistration, which are only
+    regridded, the results are rotated by the rigid transformation.
+    Input Parameters:
+        inDataListSeg, inDataListImg: files before center of mass alignment
+        comDataListSeg: output of applyCOMAlignment for inDataListSeg
+        refFile: reference file given to applyRigidAlignment
+        workers: number of subjects processed concurrently
+        cache: GroomCache used to skip subjects whose result is stored
+    Output Parameters:
+    """
+    outDir = parentDir + '/cropped'
+    os.makedirs(outDir, exist_ok=True)
+
+    cropinfoDir = outDir + '/crop_info'
+    os.makedirs(cropinfoDir, exist_ok=True)
+
+    alignedDir = outDir + '/aligned'
+    os.makedirs(alignedDir, exist_ok=True)
+
+    if processRaw:
+        binaryoutDir = outDir + '/segmentations'
+        rawoutDir = outDir + '/images'
+    else:
+        binaryoutDir = outDir
+        rawoutDir = outDir
+    os.makedirs(rawoutDir, exist_ok=True)
+    os.makedirs(binaryoutDir, exist_ok=True)
+
+    def getAlignArgs(i):
+        paramname = comDataListSeg[i].replace('.nrrd', '.txt')
+        transformation = getTransformationFilename(parentDir, comDataListSeg[i])
+        return ["aligncrop", "--comparameterfile", paramname, "--transformationfile", transformation,
+                "--reference", refFile], [paramname, transformation, refFile]
+
+    # the segmentations aligned into the whole reference grid, to measure the box on
+    jobs = []
+    alignedDataListSeg = []
+    for i in range(len(inDataListSeg)):
+        innameSeg = inDataListSeg[i]
+        alignArgs, alignInputs = getAlignArgs(i)
+        alignedSeg = os.path.join(alignedDir, os.path.basename(innameSeg)).replace('.nrrd', '.aligned.nrrd')
+        alignedDataListSeg.append(alignedSeg)
+        execCommand = ["shapeworks", "readimage", "--name", innameSeg] + alignArgs + ["--isbinary", "1", *writeImageArgs(alignedSeg)]
+        print(" ")
+        print("############### Alignment ###############")
+        cprint(("Input Segmentation Filename : ", innameSeg), 'cyan')
+        cprint(("Input Parameter Filename : ", alignInputs[0]), 'cyan')
+        cprint(("Input Transformation Matrix : ", alignInputs[1]), 'cyan')
+        cprint(("Output Segmentation Filename : ", alignedSeg), 'yellow')
+        print("#########################################")
+        print(" ")
+        jobs.append((innameSeg, [execCommand], [innameSeg] + alignInputs, [alignedSeg]))
+    runSubjectCommands(jobs, workers, cache)
+
+    regionArgs = getRegionArgs(*findLargestBoundingBox(cropinfoDir, alignedDataListSeg, paddingSize, cache, workers))
+
+    jobs = []
+    outDataListSeg = []
+    outDataListImg = []
+    for i in range(len(inDataListSeg)):
+        alignedSeg = alignedDataListSeg[i]
+        outnameSeg = os.path.join(binaryoutDir, os.path.basename(inDataListSeg[i])).replace('.nrrd', '.cropped.nrrd')
+        outDataListSeg.append(outnameSeg)
+        # the aligned segmentation is on the reference grid already, so it is only cropped
+        execCommand = ["shapeworks", "readimage", "--name", alignedSeg, "crop"] + regionArgs + writeImageArgs(outnameSeg)
+        inputs = [alignedSeg]
+        outputs = [outnameSeg]
+        print(" ")
+        print("######### Alignment and Cropping #########")
+        cprint(("Input Segmentation Filename : ", alignedSeg), 'cyan')
+        cprint(("Output Segmentation Filename : ", outnameSeg), 'yellow')
+        if processRaw:
+            innameImg = inDataListImg[i]
+            alignArgs, alignInputs = getAlignArgs(i)
+            outnameImg = os.path.join(rawoutDir, os.path.basename(innameImg)).replace('.nrrd', '.cropped.nrrd')
+            outDataListImg.append(outnameImg)
+            execCommand.extend(["readimage", "--name", innameImg] + alignArgs + regionArgs + writeImageArgs(outnameImg))
+            inputs.extend([innameImg] + alignInputs)
+            outputs.append(outnameImg)
+            cprint(("Input Image Filename : ", innameImg), 'cyan')
+            cprint(("Output Image Filename : ", outnameImg), 'yellow')
+        print("##########################################")
+        print(" ")
+        jobs.append((inDataListSeg[i], [execCommand], inputs, outputs))
+
+    runSubjectCommands(jobs, workers, cache)
+    if processRaw:
+        return [outDataListSeg, outDataListImg]
+    return outDataListSeg
+
 def create_meshfromDT_xml(xmlfilename, tpdtnrrdfilename, vtkfilename):
     root = ET.Element('sample')
     lsSmootherIterations = ET.SubElement(root, 'lsSmootherIterations')
@@ -600,17 +1137,30 @@ def create_meshfromDT_xml(xmlfilename, tpdtnrrdfilename, vtkfilename):
     file = open(xmlfilename, "w+")
     file.write(data)
 
-def applyDistanceTransforms(parentDir, inDataList,antialiasIterations=20, smoothingIterations=1, isoValue=0, percentage=50):
+def applyDistanceTransforms(parentDir, inDataList,antialiasIterations=20, smoothingIterations=1, isoValue=0, percentage=50, workers=1, fused=False, cache=None, artifacts=None):
+    """
+    This function takes in a filelist and produces the smoothed distance
+    transforms used by the optimization in parentDir/distance_transforms.
+    Input Parameters:
+        workers: number of subjects processed concurrently
+        fused: use a single chained `shapeworks` command per subject
+        cache: GroomCache used to skip subjects whose result is stored
+        artifacts: ArtifactStore, a distance transform already registered
+                   for an input with the same parameters (e.g. the one from
+                   rigid alignment carried through cropping) is used as is
+    Output Parameters:
+    """
     outDir = parentDir + '/groom_and_meshes'
-    if not os.path.exists(outDir):
-        os.makedirs(outDir)
+    os.makedirs(outDir, exist_ok=True)
 
     finalDTDir = parentDir + '/distance_transforms'
-    if not os.path.exists(finalDTDir):
-        os.makedirs(finalDTDir)
+    os.makedirs(finalDTDir, exist_ok=True)
 
     outDataList = []
+    tpdtFiles = []
+    jobs = []
     for i in range(len(inDataList)):
+        commandList = []
         inname = inDataList[i]
         initPath = os.path.dirname(inDataList[i])
         outname = inname.replace(initPath, outDir)
@@ -623,21 +1173,35 @@ def applyDistanceTransforms(parentDir, inDataList,antialiasIterations=20, smooth
         finalnm = tpdtnrrdfilename.replace(outDir, finalDTDir)
         outDataList.append(finalnm)
 
-
-        execCommand = ["ExtractGivenLabelImage" , "--inFilename" , inname , "--outFilename" , inname , "--labelVal" , "1"]
-        subprocess.check_call(execCommand )
-        execCommand = ["CloseHoles" ,  "--inFilename" , inname , "--outFilename" , inname ]
-        subprocess.check_call(execCommand )
-        execCommand = ["shapeworks", "readimage", "--name", inname, "antialias", "--numiterations", str(antialiasIterations), "writeimage", "--name", dtnrrdfilename]
-        subprocess.check_call(execCommand )
-        execCommand = ["FastMarching" , "--inFilename" , dtnrrdfilename , "--outFilename" , dtnrrdfilename , "--isoValue" , str(isoValue) ]
-        subprocess.check_call(execCommand )
+        storedDT = None
+        if artifacts is not None:
+            storedDT = artifacts.get(getDTArtifactKind(antialiasIterations, smoothingIterations, isoValue), inname)
+        if storedDT is not None:
+            tpdtFiles.append(storedDT)
+            continue
+        tpdtFiles.append(tpdtnrrdfilename)
+
+
+        inputs = [inname]
+        if fused:
+            execCommand = getDTChainCommand(inname, tpdtnrrdfilename, antialiasIterations, smoothingIterations, isoValue)
+            commandList.append(execCommand)
+        else:
+            execCommand = ["ExtractGivenLabelImage" , "--inFilename" , inname , "--outFilename" , inname , "--labelVal" , "1"]
+            commandList.append(execCommand)
+            execCommand = ["CloseHoles" ,  "--inFilename" , inname , "--outFilename" , inname ]
+            commandList.append(execCommand)
+            execCommand = ["shapeworks", "readimage", "--name", inname, "antialias", "--numiterations", str(antialiasIterations), *writeImageArgs(dtnrrdfilename)]
+            commandList.append(execCommand)
+            execCommand = getDTCommand(dtnrrdfilename, isoValue)
+            commandList.append(execCommand)
         
-        xmlfilename=outname.replace('.nrrd', '.tpSmoothDT.xml')
-        create_tpSmooth_xml(xmlfilename, smoothingIterations, dtnrrdfilename, isonrrdfilename, tpdtnrrdfilename)
-        create_cpp_xml(xmlfilename, xmlfilename)
-        execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
-        subprocess.check_call(execCommand )
+            xmlfilename=outname.replace('.nrrd', '.tpSmoothDT.xml')
+            create_tpSmooth_xml(xmlfilename, smoothingIterations, dtnrrdfilename, isonrrdfilename, tpdtnrrdfilename)
+            create_cpp_xml(xmlfilename, xmlfilename)
+            inputs.append(xmlfilename)
+            execCommand = ["TopologyPreservingSmoothing" , xmlfilename]
+            commandList.append(execCommand)
 
         # xmlfilename=outname.replace('.nrrd', '.MeshFromDT.xml')
         # create_meshfromDT_xml(xmlfilename, tpdtnrrdfilename, vtkfilename)
@@ -649,5 +1213,142 @@ def applyDistanceTransforms(parentDir, inDataList,antialiasIterations=20, smooth
         # subprocess.check_call(execCommand )
         # this at the end
 
-        shutil.copy(tpdtnrrdfilename, finalDTDir)
+        jobs.append((inname, commandList, inputs, [inname, tpdtnrrdfilename]))
+
+    runSubjectCommands(jobs, workers, cache)
+    copyFinalImages(tpdtFiles, outDataList, workers)
     return outDataList
+
+def applyLabelExtraction(parentDir, inDataList, labels, workers=1, cache=None):
+    """
+    This function reads each multi-label segmentation once and writes the
+    binary segmentation of every requested label to parentDir/labels, the
+    labels of a file being extracted in parallel. Unlike the label
+    extraction of the other steps, the input files are not modified.
+    Input Parameters:
+        labels: values of the labels to extract, one domain of the shape each
+        workers: number of subjects processed concurrently
+        cache: GroomCache used to skip subjects whose result is stored
+    Output Parameters:
+        dictionary of the list of binary segmentations of each label
+    """
+    outDir = parentDir + '/labels'
+    os.makedirs(outDir, exist_ok=True)
+
+    labelList = ",".join(str(int(label)) for label in labels)
+    outDataLists = {label: [] for label in labels}
+    jobs = []
+    for inname in inDataList:
+        outPrefix = os.path.join(outDir, os.path.basename(inname).replace('.nrrd', '.'))
+        outputs = []
+        for label in labels:
+            outname = outPrefix + 'label' + str(int(label)) + '.nrrd'
+            outDataLists[label].append(outname)
+            outputs.append(outname)
+        print(" ")
+        print("########## Label Extraction ##########")
+        cprint(("Input Filename : ", inname), 'cyan')
+        cprint(("Output Filenames : ", outPrefix + "label{" + labelList + "}.nrrd"), 'yellow')
+        print("######################################")
+        print(" ")
+        execCommand = ["ExtractGivenLabelImage", "--inFilename", inname, "--labels", labelList, "--outPrefix", outPrefix]
+        jobs.append((inname, [execCommand], [inname], outputs))
+
+    runSubjectCommands(jobs, workers, cache)
+    return outDataLists
+
+def applyDistanceTransformsPerLabel(parentDir, labelDataLists, workers=1, **kwargs):
+    """
+    Runs applyDistanceTransforms on the segmentations of each label from
+    applyLabelExtraction, in parentDir/label<value>, and returns the
+    distance transforms of all the domains of the first shape, then of the
+    second and so on, the order expected with domains_per_shape set to the
+    number of labels. The other arguments are those of
+    applyDistanceTransforms.
+    """
+    dtLists = [applyDistanceTransforms(parentDir + '/label' + str(int(label)), inDataList, workers=workers, **kwargs)
+               for label, inDataList in labelDataLists.items()]
+    return [dtFile for shapeDTs in zip(*dtLists) for dtFile in shapeDTs]
+
+def addGroomNodes(pipeline, parentDir, inDataListSeg, inDataListImg=None, padSize=10, cache=None, artifacts=None, findReference=FindReferenceImage):
+    """
+    Adds the grooming of each subject to a Pipeline (see CommonUtils) as its
+    own chain of nodes: isotropic resampling, padding, center of mass
+    alignment, rigid alignment, cropping and distance transform. A subject
+    only waits for the others where all of them are needed, which is for
+    the reference of the rigid alignment and for the bounding box of the
+    cropping. The raw images are processed along if inDataListImg is given.
+    findReference chooses the rigid alignment reference from the center of
+    mass aligned segmentations.
+    Returns the name of the node whose result is the list of distance
+    transforms.
+    """
+    processRaw = inDataListImg is not None
+
+    # the result of each per subject node is [segmentation, image]
+    def resample(i):
+        seg = applyIsotropicResampling(parentDir + "resampled/segmentations", [inDataListSeg[i]], isBinary=True, cache=cache)[0]
+        img = None
+        if processRaw:
+            img = applyIsotropicResampling(parentDir + "resampled/images", [inDataListImg[i]], isBinary=False, cache=cache)[0]
+        return [seg, img]
+
+    def pad(files):
+        if processRaw:
+            return [f[0] for f in applyPadding(parentDir, [files[0]], [files[1]], padSize, processRaw=True, cache=cache)]
+        return [applyPadding(parentDir, [files[0]], None, padSize, cache=cache)[0], None]
+
+    def alignCOM(files):
+        if processRaw:
+            return [f[0] for f in applyCOMAlignment(parentDir, [files[0]], [files[1]], processRaw=True, cache=cache)]
+        return [applyCOMAlignment(parentDir, [files[0]], None, cache=cache)[0], None]
+
+    def reference(*comFiles):
+        refFile = findReference([files[0] for files in comFiles])
+        return [refFile, prepareRigidReference(parentDir, refFile, cache=cache, artifacts=artifacts)]
+
+    def alignRigid(files, ref):
+        if processRaw:
+            aligned = [f[0] for f in applyRigidAlignment(parentDir, [files[0]], [files[1]], ref[0], processRaw=True,
+                                                         cache=cache, artifacts=artifacts, refDTFile=ref[1])]
+        else:
+            aligned = [applyRigidAlignment(parentDir, [files[0]], None, ref[0], cache=cache, artifacts=artifacts, refDTFile=ref[1])[0], None]
+        # the extent for the bounding box, while the other subjects are aligned
+        computeExtents([aligned[0]], cache=cache)
+        return aligned
+
+    def boundingBox(*rigidFiles):
+        cropinfoDir = parentDir + '/cropped/crop_info'
+        os.makedirs(cropinfoDir, exist_ok=True)
+        return findLargestBoundingBox(cropinfoDir, [files[0] for files in rigidFiles], cache=cache)
+
+    def crop(files, bb):
+        if processRaw:
+            return [f[0] for f in applyCropping(parentDir, [files[0]], [files[1]], processRaw=True,
+                                                cache=cache, artifacts=artifacts, boundingBox=bb)]
+        return [applyCropping(parentDir, [files[0]], None, cache=cache, artifacts=artifacts, boundingBox=bb)[0], None]
+
+    def distanceTransform(files):
+        return applyDistanceTransforms(parentDir, [files[0]], cache=cache, artifacts=artifacts)[0]
+
+    comNodes = []
+    for i in range(len(inDataListSeg)):
+        subject = os.path.basename(inDataListSeg[i])
+        pipeline.addNode("resample/" + subject, lambda i=i: resample(i),
+                         inputs=[inDataListSeg[i]] + ([inDataListImg[i]] if inDataListImg else []))
+        pipeline.addNode("pad/" + subject, pad, ["resample/" + subject])
+        comNodes.append(pipeline.addNode("com/" + subject, alignCOM, ["pad/" + subject]))
+    pipeline.addNode("reference", reference, comNodes)
+
+    rigidNodes = []
+    for i in range(len(inDataListSeg)):
+        subject = os.path.basename(inDataListSeg[i])
+        rigidNodes.append(pipeline.addNode("rigid/" + subject, alignRigid, ["com/" + subject, "reference"]))
+    pipeline.addNode("boundingbox", boundingBox, rigidNodes)
+
+    dtNodes = []
+    for i in range(len(inDataListSeg)):
+        subject = os.path.basename(inDataListSeg[i])
+        pipeline.addNode("crop/" + subject, crop, ["rigid/" + subject, "boundingbox"])
+        dtNodes.append(pipeline.addNode("dt/" + subject, distanceTransform, ["crop/" + subject]))
+    return pipeline.addNode("distance_transforms", lambda *dtFiles: list(dtFiles), dtNodes)
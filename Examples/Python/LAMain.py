@@ -25,6 +25,16 @@ parser.add_argument("--interactive", help="Run in interactive mode", action="sto
 parser.add_argument("--start_with_prepped_data", help="Start with already prepped data", action="store_true")
 parser.add_argument("--start_with_image_and_segmentation_data", help = "use images and segmentations data for preprocessing", action="store_true")
 parser.add_argument("--use_single_scale", help="Single scale or multi scale optimization", action="store_true")
+parser.add_argument("--use_scheduler", help="Groom each subject independently, as soon as its previous step is done", action="store_true")
+parser.add_argument("--workers", help="Number of steps run at the same time with --use_scheduler", type=int, default=1)
+parser.add_argument("--memory_limit", help="Memory (in GB) the steps run at the same time may use", type=float, default=None)
+parser.add_argument("--shapeworks_workers", help="Number of shapeworks serve processes the shapeworks commands are sent to", type=int, default=0)
+parser.add_argument("--compress_intermediates", help="Compress the intermediate groom images as well as the final ones", action="store_true")
+parser.add_argument("--distance_transform", help="How the signed distance transforms are computed", choices=["fastmarching", "maurer"], default="fastmarching")
+parser.add_argument("--icp_method", help="How rigid alignment runs ICP", choices=["vtk", "multiresolution"], default="vtk")
+parser.add_argument("--shape_index", help="SQLite file in which the groom steps record per subject metadata (size, center of mass, bounding box, mask thumbnail) for the later steps and QC", default=None)
+parser.add_argument("--resume", help="Start again from the first step not completed by the previous run", action="store_true")
+parser.add_argument("--single_resampling", help="Resample images once for center of mass alignment, rigid alignment and cropping", action="store_true")
 parser.add_argument("shapeworks_path", help="Path to ShapeWorks executables (default: "+binpath+")", nargs='?', type=str, default=binpath)
 args = parser.parse_args()
 binpath = args.shapeworks_path
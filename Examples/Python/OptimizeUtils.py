@@ -1,11 +1,17 @@
-import numpy as np
 import io
-from termcolor import colored, cprint
+import csv
 import glob
+import hashlib
+import itertools
+import json
 import os
+import queue
+import re
+import time
 import subprocess
 import shutil
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 from CommonUtils import *
 
@@ -56,6 +62,16 @@ def create_SWRun_xml(xmlfilename, inDataFiles, parameterDictionary, outDir):
     mesh_based_attributes.text = "\n" + str(1) + "\n"
     verbosity = ET.SubElement(root, 'verbosity')
     verbosity.text = "\n" + str(parameterDictionary['verbosity']) + "\n"
+    if parameterDictionary.get('narrow_band', 0):
+        narrow_band = ET.SubElement(root, 'narrow_band')
+        narrow_band.text = "\n" + str(parameterDictionary['narrow_band']) + "\n"
+    if parameterDictionary.get('log_energy', 0):
+        log_energy = ET.SubElement(root, 'log_energy')
+        log_energy.text = "\n" + str(parameterDictionary['log_energy']) + "\n"
+    for tag in ('opt_criterion', 'opt_update_tolerance', 'progress_file', 'particle_format'):
+        if parameterDictionary.get(tag):
+            element = ET.SubElement(root, tag)
+            element.text = "\n" + str(parameterDictionary[tag]).replace('\\','/') + "\n"
     use_xyz = ET.SubElement(root, 'use_xyz')
     use_xyz.text = "\n" + str(1) + "\n"
     inputs = ET.SubElement(root, 'inputs')
@@ -117,6 +133,16 @@ def create_SWRun_multi_xml(xmlfilename, inDataFiles, parameterDictionary, outDir
     mesh_based_attributes.text = "\n" + str(1) + "\n"
     verbosity = ET.SubElement(root, 'verbosity')
     verbosity.text = "\n" + str(parameterDictionary['verbosity']) + "\n"
+    if parameterDictionary.get('narrow_band', 0):
+        narrow_band = ET.SubElement(root, 'narrow_band')
+        narrow_band.text = "\n" + str(parameterDictionary['narrow_band']) + "\n"
+    if parameterDictionary.get('log_energy', 0):
+        log_energy = ET.SubElement(root, 'log_energy')
+        log_energy.text = "\n" + str(parameterDictionary['log_energy']) + "\n"
+    for tag in ('opt_criterion', 'opt_update_tolerance', 'progress_file', 'particle_format'):
+        if parameterDictionary.get(tag):
+            element = ET.SubElement(root, tag)
+            element.text = "\n" + str(parameterDictionary[tag]).replace('\\','/') + "\n"
     use_xyz = ET.SubElement(root, 'use_xyz')
     use_xyz.text = "\n" + str(1) + "\n"
     inputs = ET.SubElement(root, 'inputs')
@@ -143,17 +169,90 @@ def create_SWRun_multi_xml(xmlfilename, inDataFiles, parameterDictionary, outDir
     file = open(xmlfilename, "w+")
     file.write(data)
     
-def runShapeWorksOptimize_SingleScale(parentDir, inDataFiles, parameterDictionary):
+def iterateShapeWorksOptimize(parameterFile, progressFile, pollInterval=0.2, **popenArgs):
+    """
+    Runs ShapeWorksRun on parameterFile and yields its progress records as
+    they are written to progressFile (the progress_file of parameterFile),
+    one dictionary per iteration with its stage, iteration, particles,
+    sampling, correspondence and total energies and max_update, the
+    largest distance a particle moved (None where a value is not finite).
+    The last record has the stage
+    finished, the number of iterations run and whether the optimization
+    stopped early (see opt_criterion and opt_update_tolerance).
+    Raises CalledProcessError if ShapeWorksRun fails; closing the
+    generator before the end stops it.
+    """
+    if os.path.exists(progressFile):
+        os.remove(progressFile)
+    execCommand = ["ShapeWorksRun", parameterFile]
+    process = startProcess(execCommand, **popenArgs)
+    progress = None
+    pending = ''
+    try:
+        while True:
+            running = process.poll() is None
+            if progress is None and os.path.exists(progressFile):
+                progress = open(progressFile)
+            if progress is not None:
+                pending += progress.read()
+                lines = pending.split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+            if not running:
+                break
+            time.sleep(pollInterval)
+    finally:
+        if progress is not None:
+            progress.close()
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, execCommand)
+
+def printProgress(record):
+    """
+    Progress callback of the runShapeWorksOptimize functions printing every
+    100th iteration
+    """
+    if record['stage'] == 'finished':
+        cprint(("Optimization finished after " + str(record['iteration']) + " iterations" +
+                (", stopped early" if record['early_stop'] else "")), 'green')
+    elif record['iteration'] % 100 == 0:
+        number = lambda value, spec: "nan" if value is None else format(value, spec)
+        print("{stage} iteration {iteration}: {particles} particles, energy {total}, "
+              "max update {max_update}".format(**dict(record, total=number(record['total'], '.6g'),
+                                                       max_update=number(record['max_update'], '.3g'))))
+
+def runShapeWorksRun(parameterFile, inputs, progress=None, **popenArgs):
+    if progress is None:
+        runTool(["ShapeWorksRun", parameterFile], inputs=inputs, **popenArgs)
+        return
+    with open(parameterFile) as f:
+        match = re.search(r'<progress_file>\s*(.*?)\s*</progress_file>', f.read(), flags=re.DOTALL)
+    for record in iterateShapeWorksOptimize(parameterFile, match.group(1), **popenArgs):
+        progress(record)
+
+def runShapeWorksOptimize_SingleScale(parentDir, inDataFiles, parameterDictionary, cpus=None, threads=None, progress=None):
+    """
+    Optimizes number_of_particles particles in parentDir/number_of_particles,
+    on the given cpus with at most threads threads if they are given (see
+    getPinningArgs). progress, e.g. printProgress, is called with each
+    record of iterateShapeWorksOptimize while the optimization runs.
+    """
     numP = parameterDictionary['number_of_particles']
     outDir = parentDir + '/' + str(numP) + '/'
     if not os.path.exists(outDir):
         os.makedirs(outDir)
+    if progress is not None:
+        parameterDictionary = dict(parameterDictionary, progress_file=outDir + 'progress.jsonl')
     parameterFile = parentDir + "correspondence_" + str(numP) + '.xml'
     create_SWRun_xml(parameterFile, inDataFiles, parameterDictionary, outDir)
     create_cpp_xml(parameterFile, parameterFile)
     print(parameterFile)
-    execCommand = ["ShapeWorksRun" , parameterFile]
-    subprocess.check_call(execCommand )
+    runShapeWorksRun(parameterFile, [parameterFile] + inDataFiles, progress, **getPinningArgs(cpus, threads))
     outPointsWorld = []
     outPointsLocal = []
     for i in range(len(inDataFiles)):
@@ -166,40 +265,308 @@ def runShapeWorksOptimize_SingleScale(parentDir, inDataFiles, parameterDictionar
         outPointsLocal.append(lclname)
     return [outPointsLocal, outPointsWorld]
 
-def runShapeWorksOptimize_MultiScale(parentDir, inDataFiles, parameterDictionary):
+def hashFiles(sha, files):
+    """
+    Adds the names and contents of files to a hashlib object
+    """
+    for filename in files:
+        sha.update(filename.encode('utf-8'))
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return sha
+
+# parameters that only change what ShapeWorksRun reports, not the particles
+outputOnlyParameters = ('progress_file', 'verbosity')
+
+def getLevelFingerprint(inputsFingerprint, parameterFile, lastPointFiles):
+    """
+    Fingerprint of a level of the multiscale optimization: that of its
+    distance transforms, its parameter file (without outputOnlyParameters)
+    and the particles of the previous level it starts from
+    """
+    sha = hashlib.sha256(inputsFingerprint.encode('utf-8'))
+    with open(parameterFile) as f:
+        text = f.read()
+    for tag in outputOnlyParameters:
+        text = re.sub('<' + tag + r'>.*?</' + tag + r'>\s*', '', text, flags=re.DOTALL)
+    sha.update(parameterFile.encode('utf-8'))
+    sha.update(text.encode('utf-8'))
+    return hashFiles(sha, lastPointFiles).hexdigest()
+
+def readLevelState(outDir):
+    stateFile = os.path.join(outDir, 'level_state.json')
+    if not os.path.exists(stateFile):
+        return {}
+    with open(stateFile) as f:
+        return json.load(f)
+
+def writeLevelState(outDir, fingerprint, complete):
+    with open(os.path.join(outDir, 'level_state.json'), 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'complete': complete}, f)
+
+def findLatestCheckpoint(outDir, numParticles):
+    """
+    Returns the iteration and directory of the newest checkpoint that
+    ShapeWorksRun kept (keep_checkpoints) in outDir for numParticles
+    particles, or None
+    """
+    latest = None
+    for checkpointDir in glob.glob(os.path.join(outDir, 'iter*_p' + str(numParticles))):
+        match = re.match(r'iter(\d+)_p\d+$', os.path.basename(checkpointDir))
+        if match and os.path.isdir(checkpointDir) and (latest is None or int(match.group(1)) > latest[0]):
+            latest = (int(match.group(1)), checkpointDir)
+    return latest
+
+def create_resume_xml(parameterFile, resumeFile, pointFiles, iterationsCompleted):
+    """
+    Copies a ShapeWorksRun parameter file, starting the optimization from
+    the given particles with iterationsCompleted of its iterations done
+    """
+    with open(parameterFile) as f:
+        text = f.read()
+    for tag in ('point_files', 'optimization_iterations_completed'):
+        text = re.sub(r'<' + tag + r'>.*?</' + tag + r'>\s*', '', text, flags=re.DOTALL)
+    text += "<point_files>\n" + "".join(f.replace('\\', '/') + "\n" for f in pointFiles) + "</point_files>\n\n"
+    text += "<optimization_iterations_completed>\n" + str(iterationsCompleted) + "\n</optimization_iterations_completed>\n\n"
+    with open(resumeFile, 'w') as f:
+        f.write(text)
+
+def getParticleFiles(outDir, inDataFiles, suffix):
+    particleFiles = []
+    for inname in inDataFiles:
+        inname = inname.replace('\\','/')
+        inpath = os.path.dirname(inname) + '/'
+        particleFiles.append(inname.replace(inpath, outDir).replace('.nrrd', suffix))
+    return particleFiles
+
+def runShapeWorksOptimize_MultiScale(parentDir, inDataFiles, parameterDictionary, resume=True, progress=None):
+    """
+    Optimizes starting_particles particles, then doubles them number_of_levels - 1
+    times, each level starting from the particles of the previous one.
+    With resume, each level is fingerprinted by its distance transforms,
+    parameter file and starting particles: a level already completed with
+    the same fingerprint is skipped, and an interrupted one restarts from
+    its newest checkpoint (kept with keep_checkpoints).
+    progress is called with the progress records of each level, as in
+    runShapeWorksOptimize_SingleScale.
+    """
     numP_init = parameterDictionary['starting_particles']
     num_levels = parameterDictionary['number_of_levels']    
     
     startFactor = int(np.floor(np.log2(numP_init)))
     print("Starting Factor", startFactor)
 
+    if resume:
+        inputsFingerprint = hashFiles(hashlib.sha256(), inDataFiles).hexdigest()
+
     for i in range(num_levels):
-        outDir = parentDir + '/' + str(2**(startFactor + i)) + '/'
+        numP = 2**(startFactor + i)
+        outDir = parentDir + '/' + str(numP) + '/'
         if not os.path.exists(outDir):
             os.makedirs(outDir)
         prevOutDir = parentDir + '/' + str(2**(startFactor + i - 1)) + '/'
-        parameterFile = parentDir + "correspondence_" + str(2**(startFactor + i)) + '.xml'
-        inparts = []
-        for j in range(len(inDataFiles)):
-            inname = inDataFiles[j].replace('\\','/')
-            inpath = os.path.dirname(inDataFiles[j]) + '/'
-            outname = inname.replace(inpath, prevOutDir)
-            lclname = outname.replace('.nrrd', '_local.particles')
-            inparts.append(lclname)
-        create_SWRun_multi_xml(parameterFile, inDataFiles, parameterDictionary, outDir, i, inparts)
+        parameterFile = parentDir + "correspondence_" + str(numP) + '.xml'
+        inparts = getParticleFiles(prevOutDir, inDataFiles, '_local.particles')
+        levelParameters = parameterDictionary
+        if progress is not None:
+            levelParameters = dict(parameterDictionary, progress_file=outDir + 'progress.jsonl')
+        create_SWRun_multi_xml(parameterFile, inDataFiles, levelParameters, outDir, i, inparts)
         create_cpp_xml(parameterFile, parameterFile)
         print(parameterFile)
-        execCommand = ["ShapeWorksRun" , parameterFile]
-        subprocess.check_call(execCommand )
 
-    outPointsWorld = []
-    outPointsLocal = []
-    for i in range(len(inDataFiles)):
-        inname = inDataFiles[i].replace('\\','/')
-        inpath = os.path.dirname(inDataFiles[i]) + '/'
-        outname = inname.replace(inpath, outDir)
-        wrdname = outname.replace('.nrrd', '_world.particles')
-        lclname = outname.replace('.nrrd', '_local.particles')
-        outPointsWorld.append(wrdname)
-        outPointsLocal.append(lclname)
+        runFile = parameterFile
+        if resume:
+            fingerprint = getLevelFingerprint(inputsFingerprint, parameterFile, inparts if i != 0 else [])
+            state = readLevelState(outDir)
+            outParts = getParticleFiles(outDir, inDataFiles, '_local.particles')
+            if state.get('fingerprint') == fingerprint:
+                if state.get('complete') and all(os.path.exists(f) for f in outParts):
+                    cprint(("Level with " + str(numP) + " particles already optimized, skipping it"), 'green')
+                    continue
+                checkpoint = findLatestCheckpoint(outDir, numP)
+                if checkpoint is not None:
+                    iteration, checkpointDir = checkpoint
+                    cprint(("Resuming level with " + str(numP) + " particles from " + checkpointDir), 'green')
+                    runFile = parameterFile.replace('.xml', '_resume.xml')
+                    create_resume_xml(parameterFile, runFile, getParticleFiles(checkpointDir + '/', inDataFiles, '_local.particles'), iteration)
+            else:
+                # checkpoints of a run with other inputs or parameters
+                for checkpointDir in glob.glob(os.path.join(outDir, 'iter*_p*')):
+                    shutil.rmtree(checkpointDir)
+                writeLevelState(outDir, fingerprint, False)
+
+        runShapeWorksRun(runFile, [runFile] + inDataFiles + inparts, progress)
+        if resume:
+            writeLevelState(outDir, fingerprint, True)
+
+    outPointsWorld = getParticleFiles(outDir, inDataFiles, '_world.particles')
+    outPointsLocal = getParticleFiles(outDir, inDataFiles, '_local.particles')
     return [outPointsLocal, outPointsWorld]
+
+def expandParameterGrid(parameterDictionary, grid):
+    """
+    Returns a copy of parameterDictionary for each combination of the
+    values in grid, a dictionary of the list of values of each parameter,
+    e.g. {'relative_weighting': [1, 10], 'number_of_particles': [128, 256]}
+    """
+    names = list(grid.keys())
+    return [dict(parameterDictionary, **dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+def readFinalEnergy(energyFile):
+    """
+    Last value of a ShapeWorksRun energy file, or None
+    """
+    if not os.path.exists(energyFile):
+        return None
+    with open(energyFile) as f:
+        values = [line.strip() for line in f if line.strip()]
+    return float(values[-1]) if values else None
+
+def getShapeCompactness(particleFiles, modes=3):
+    """
+    Returns the fraction of the shape variance captured by the first modes
+    of the particle systems, and the number of modes needed for 95% of it
+    """
+    shapes = readParticleStack(particleFiles).reshape(len(particleFiles), -1).astype(np.float64)
+    shapes -= shapes.mean(axis=0)
+    variances = np.linalg.svd(shapes, compute_uv=False) ** 2
+    if variances.sum() == 0:
+        return 1.0, 0
+    explained = np.cumsum(variances) / variances.sum()
+    return float(explained[min(modes, len(explained)) - 1]), int(np.searchsorted(explained, 0.95) + 1)
+
+def getSubjectId(particleFile):
+    name = os.path.basename(particleFile)
+    for suffix in ('_local.particles', '_world.particles', '.particles'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+def getFileStamps(files):
+    """
+    Modification times (in ns) and sizes of files, as an (N, 2) array
+    """
+    stats = [os.stat(f) for f in files]
+    return np.array([[stat.st_mtime_ns, stat.st_size] for stat in stats], dtype=np.int64).reshape(-1, 2)
+
+def readParticleStack(particleFiles, workers=8):
+    """
+    Reads particle files on workers threads into a (files, particles, 3) array
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        arrays = list(executor.map(lambda f: np.array(readParticleArray(f)), particleFiles))
+    if len({a.shape for a in arrays}) > 1:
+        raise ValueError("The particle files don't all have the same number of particles")
+    return np.stack(arrays)
+
+def loadCohortParticles(localFiles, worldFiles, cacheFile=None, workers=8):
+    """
+    Returns the subject ids of the given particle files (such as those
+    returned by the runShapeWorksOptimize functions) and their local and
+    world particles as (subjects, particles, 3) arrays.
+    The arrays are cached in cacheFile (cohort_particles.npz next to the
+    first local file by default), which is read instead of the particle
+    files as long as they are the same files with the same modification
+    times and sizes; otherwise the files are read on workers threads and
+    the cache rewritten.
+    """
+    if len(localFiles) == 0:
+        raise ValueError("No particle files to load")
+    if len(localFiles) != len(worldFiles):
+        raise ValueError("There are " + str(len(localFiles)) + " local particle files but " +
+                         str(len(worldFiles)) + " world particle files")
+    files = np.array([f.replace('\\','/') for f in list(localFiles) + list(worldFiles)])
+    stamps = getFileStamps(files)
+    if cacheFile is None:
+        cacheFile = os.path.join(os.path.dirname(localFiles[0]), 'cohort_particles.npz')
+    if os.path.exists(cacheFile):
+        try:
+            with np.load(cacheFile) as cache:
+                if np.array_equal(cache['files'], files) and np.array_equal(cache['stamps'], stamps):
+                    return [str(subject) for subject in cache['subjects']], cache['local'], cache['world']
+        except (OSError, KeyError, ValueError):
+            pass
+
+    subjects = [getSubjectId(f) for f in localFiles]
+    particles = readParticleStack(files, workers)
+    local, world = particles[:len(localFiles)], particles[len(localFiles):]
+    tempFile = cacheFile + '.tmp'
+    with open(tempFile, 'wb') as f:
+        np.savez(f, files=files, stamps=stamps, subjects=np.array(subjects), local=local, world=world)
+    os.replace(tempFile, cacheFile)
+    return subjects, local, world
+
+def runParameterSweep(parentDir, inDataFiles, parameterDictionaries, jobs=None, threadsPerJob=1, resultsFile=None):
+    """
+    Runs runShapeWorksOptimize_SingleScale for each parameter dictionary
+    (e.g. from expandParameterGrid), jobs at a time, each in its own
+    parentDir/sweep_<index>/ directory and pinned to its own threadsPerJob
+    CPUs with as many threads. By default as many jobs run as there are
+    sets of threadsPerJob CPUs.
+    Returns a row per dictionary with the parameters that differ between
+    the dictionaries, the wall time, the final sampling, correspondence and
+    total energies and the compactness of the resulting shape model (see
+    getShapeCompactness), also written as CSV to resultsFile
+    (parentDir/sweep_results.csv by default).
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if jobs is None:
+        jobs = max(1, len(cpus) // threadsPerJob)
+    jobs = max(1, min(jobs, len(parameterDictionaries)))
+    # each running job owns one of these sets of CPUs
+    slots = queue.Queue()
+    for j in range(jobs):
+        slots.put(cpus[j * threadsPerJob:(j + 1) * threadsPerJob] if (j + 1) * threadsPerJob <= len(cpus) else None)
+
+    mappings = [d for d in parameterDictionaries if isinstance(d, dict)]
+    sweptNames = sorted(name for name in set().union(*mappings)
+                        if len(set(str(d.get(name)) for d in mappings)) > 1)
+    fieldnames = (['index'] + sweptNames + ['output_dir', 'status', 'wall_time'] +
+                  [energy + '_energy' for energy in ('sampling', 'correspondence', 'total')] + ['compactness', 'modes_95'])
+
+    def runJob(index):
+        row = dict.fromkeys(fieldnames)
+        row['index'] = index
+        # a failed job, even one with a bad parameter dictionary, is
+        # recorded as such without losing the other rows
+        try:
+            parameterDictionary = dict(parameterDictionaries[index], log_energy=1)
+            row.update((name, parameterDictionary.get(name)) for name in sweptNames)
+            sweepDir = os.path.join(parentDir, 'sweep_' + str(index)) + '/'
+            row['output_dir'] = sweepDir
+            os.makedirs(sweepDir, exist_ok=True)
+            slot = slots.get()
+            start = time.time()
+            try:
+                localFiles, worldFiles = runShapeWorksOptimize_SingleScale(sweepDir, inDataFiles, parameterDictionary,
+                                                                           cpus=slot, threads=threadsPerJob)
+            finally:
+                slots.put(slot)
+                row['wall_time'] = time.time() - start
+            outDir = sweepDir + str(parameterDictionary['number_of_particles']) + '/'
+            for energy in ('sampling', 'correspondence', 'total'):
+                row[energy + '_energy'] = readFinalEnergy(outDir + 'opt_' + energy + 'Energy.txt')
+            row['compactness'], row['modes_95'] = getShapeCompactness(worldFiles)
+            row['status'] = 'done'
+        except subprocess.CalledProcessError as error:
+            row['status'] = 'failed (' + str(error.returncode) + ')'
+        except Exception as error:
+            row['status'] = 'failed (' + type(error).__name__ + ': ' + str(error) + ')'
+        cprint(("Sweep job " + str(index) + " " + row['status'] + " in " + str(round(row['wall_time'] or 0)) + " s"), 'cyan')
+        return row
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(runJob, range(len(parameterDictionaries))))
+
+    if resultsFile is None:
+        resultsFile = os.path.join(parentDir, 'sweep_results.csv')
+    with open(resultsFile, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+    return results
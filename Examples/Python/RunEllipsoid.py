@@ -95,14 +95,81 @@ def Run_Ellipsoid_Pipeline(args):
     if not os.path.exists(parentDir):
         os.makedirs(parentDir)
 
-    if int(args.start_with_prepped_data) == 0:
+    """
+    The steps are run through a Pipeline, which saves the result of each step
+    so that --resume starts again from the first incomplete one.
+    """
+    pipeline = Pipeline(parentDir + "pipeline_state.json", workers=args.workers, resume=args.resume)
+
+    """
+    With --memory_limit (in GB), parallel steps only start when their estimated
+    peak memory fits under the limit. The measured peak memory of each tool is
+    kept in memory_model.json to refine the estimates of later runs.
+    """
+    if args.memory_limit is not None:
+        setMemoryLimit(args.memory_limit * 1024**3, parentDir + "memory_model.json")
+
+    """
+    Every tool run is traced to tool_trace.jsonl (time, CPU, peak memory and
+    bytes read and written), and the slowest tools and subjects are listed
+    before the analysis.
+    """
+    traceFile = parentDir + "tool_trace.jsonl"
+    setTraceFile(traceFile, append=args.resume)
+
+    """
+    With --shapeworks_workers, the shapeworks commands are sent to that many
+    `shapeworks serve` processes instead of starting a process for each one.
+    """
+    if args.shapeworks_workers:
+        setShapeworksWorkers(args.shapeworks_workers)
+
+    """
+    The intermediate groom images are written uncompressed, so the next step
+    reads them without decompressing (or maps them with numpy.memmap), and
+    only the final groomed images are compressed. --compress_intermediates
+    compresses them all, trading groom time for disk space.
+    """
+    setIntermediateCompression(args.compress_intermediates)
+
+    """
+    --distance_transform maurer computes the signed distance transforms with
+    the exact separable Euclidean distance transform instead of fast marching
+    (see DTBenchmark.py for how the two compare).
+    """
+    setDistanceTransformMethod(args.distance_transform)
+
+    """
+    --icp_method multiresolution aligns the segmentations with a coarse to
+    fine ICP on subsampled surfaces, with kd-tree matching and a convergence
+    tolerance, instead of full resolution vtk ICP.
+    """
+    setICPMethod(args.icp_method)
+
+    """
+    --shape_index records the size, center of mass, bounding box and a mask
+    thumbnail of each groomed segmentation in a SQLite file. Center of mass
+    alignment, the bounding box and the choice of the reference then use it
+    instead of reading the segmentations again.
+    """
+    setShapeIndex(args.shape_index)
+
+    if args.use_scheduler and int(args.start_with_prepped_data) == 0:
+        """
+        The same steps as below, but each subject moves on to its next step as
+        soon as it is done with the previous one.
+        """
+        dtNode = addGroomNodes(pipeline, parentDir, fileList, findReference=lambda comFiles: comFiles[0])
+        pipeline.run()
+
+    elif int(args.start_with_prepped_data) == 0:
         """
         Apply isotropic resampling
 
         For detailed explainations of parameters for resampling volumes, go to
         ... link
         """
-        resampledFiles = applyIsotropicResampling(parentDir + "resampled", fileList)
+        resampledFiles = pipeline.step("resample", applyIsotropicResampling, parentDir + "resampled", fileList)
 
         """
         Apply padding
@@ -111,7 +178,7 @@ def Run_Ellipsoid_Pipeline(args):
         ... link
         """
 
-        paddedFiles = applyPadding(parentDir, resampledFiles, None,  10)
+        paddedFiles = pipeline.step("pad", applyPadding, parentDir, resampledFiles, None,  10)
 
         """
         Apply center of mass alignment
@@ -119,13 +186,13 @@ def Run_Ellipsoid_Pipeline(args):
         For detailed explainations of parameters for center of mass (COM) alignment of volumes, go to
         ... link
         """
-        comFiles = applyCOMAlignment(parentDir, paddedFiles, None)
+        comFiles = pipeline.step("com_align", applyCOMAlignment, parentDir, paddedFiles, None)
         """Apply rigid alignment"""
 
-        rigidFiles = applyRigidAlignment(parentDir, comFiles, None, comFiles[0])
+        rigidFiles = pipeline.step("rigid_align", applyRigidAlignment, parentDir, comFiles, None, comFiles[0])
 
         """Compute largest bounding box and apply cropping"""
-        croppedFiles = applyCropping(parentDir, rigidFiles, None)
+        croppedFiles = pipeline.step("crop", applyCropping, parentDir, rigidFiles, None)
 
     """
     We convert the scans to distance transforms, this step is common for both the 
@@ -136,10 +203,12 @@ def Run_Ellipsoid_Pipeline(args):
     if int(args.interactive) != 0:
         input("Press Enter to continue")
 
-    if int(args.start_with_prepped_data) == 0:
-        dtFiles = applyDistanceTransforms(parentDir, croppedFiles)
+    if args.use_scheduler and int(args.start_with_prepped_data) == 0:
+        dtFiles = pipeline.results[dtNode]
+    elif int(args.start_with_prepped_data) == 0:
+        dtFiles = pipeline.step("distance_transforms", applyDistanceTransforms, parentDir, croppedFiles)
     else:
-        dtFiles = applyDistanceTransforms(parentDir, fileList)
+        dtFiles = pipeline.step("distance_transforms", applyDistanceTransforms, parentDir, fileList)
 
     """
     ## OPTIMIZE : Particle Based Optimization
@@ -190,7 +259,7 @@ def Run_Ellipsoid_Pipeline(args):
         """
         Now we execute a single scale particle optimization function.
         """
-        [localPointFiles, worldPointFiles] = runShapeWorksOptimize_SingleScale(pointDir, dtFiles, parameterDictionary)
+        [localPointFiles, worldPointFiles] = pipeline.step("optimize", runShapeWorksOptimize_SingleScale, pointDir, dtFiles, parameterDictionary)
 
     else:
         parameterDictionary = {
@@ -218,7 +287,7 @@ def Run_Ellipsoid_Pipeline(args):
         """
         Now we execute a multi-scale particle optimization function.
         """
-        [localPointFiles, worldPointFiles] = runShapeWorksOptimize_MultiScale(pointDir, dtFiles, parameterDictionary)
+        [localPointFiles, worldPointFiles] = pipeline.step("optimize", runShapeWorksOptimize_MultiScale, pointDir, dtFiles, parameterDictionary)
 
     if args.tiny_test:
         print("Done with tiny test")
@@ -286,7 +355,7 @@ def Run_Ellipsoid_Pipeline(args):
         "glyph_radius" : 1
     }
 
-    runReconstructMeanSurface(dtFiles, localPointFiles, worldPointFiles, parameterDictionary)
+    pipeline.step("reconstruct_mean_surface", runReconstructMeanSurface, dtFiles, localPointFiles, worldPointFiles, parameterDictionary)
 
     """
     Reconstruct the dense sample-specfic surface in the local coordinate system given the dense mean surface
@@ -313,7 +382,7 @@ def Run_Ellipsoid_Pipeline(args):
         "glyph_radius" : 1
     }
 
-    localDensePointFiles = runReconstructSurface(localPointFiles, parameterDictionary)
+    localDensePointFiles = pipeline.step("reconstruct_local_surfaces", runReconstructSurface, localPointFiles, parameterDictionary)
 
 
     """
@@ -341,7 +410,7 @@ def Run_Ellipsoid_Pipeline(args):
         "glyph_radius" : 1
     }
 
-    worldDensePointFiles = runReconstructSurface(worldPointFiles, parameterDictionary)
+    worldDensePointFiles = pipeline.step("reconstruct_world_surfaces", runReconstructSurface, worldPointFiles, parameterDictionary)
 
     """
     Reconstruct dense meshes along dominant pca modes
@@ -371,7 +440,7 @@ def Run_Ellipsoid_Pipeline(args):
         "number_of_samples_per_mode" : 10
     }
 
-    runReconstructSamplesAlongPCAModes(worldPointFiles, parameterDictionary)
+    pipeline.step("reconstruct_pca_modes", runReconstructSamplesAlongPCAModes, worldPointFiles, parameterDictionary)
 
     """
     The local and world particles will be saved in TestEllipsoids/PointFiles/128
@@ -386,6 +455,8 @@ def Run_Ellipsoid_Pipeline(args):
     visualized.
     """
 
+    summarizeTrace(traceFile)
+
     print("\nStep 9. Analysis - Launch ShapeWorksView2 - sparse correspondence model.\n")
     if args.interactive != 0:
         input("Press Enter to continue")
@@ -66,7 +66,88 @@ def Run_LeftAtrium_Pipline(args):
         fileList_img = sorted(glob.glob(parentDir + "LGE/*.nrrd"))
         fileList_seg = sorted(glob.glob(parentDir +"segmentation_LGE/*.nrrd"))
 
-    if args.start_with_image_and_segmentation_data:
+    """
+    The steps are run through a Pipeline, which saves the result of each step
+    so that --resume starts again from the first incomplete one.
+    """
+    pipeline = Pipeline(parentDir + "pipeline_state.json", workers=args.workers, resume=args.resume)
+
+    """
+    With --memory_limit (in GB), parallel steps only start when their estimated
+    peak memory fits under the limit. The measured peak memory of each tool is
+    kept in memory_model.json to refine the estimates of later runs.
+    """
+    if args.memory_limit is not None:
+        setMemoryLimit(args.memory_limit * 1024**3, parentDir + "memory_model.json")
+
+    """
+    Every tool run is traced to tool_trace.jsonl (time, CPU, peak memory and
+    bytes read and written), and the slowest tools and subjects are listed
+    before the analysis.
+    """
+    traceFile = parentDir + "tool_trace.jsonl"
+    setTraceFile(traceFile, append=args.resume)
+
+    """
+    With --shapeworks_workers, the shapeworks commands are sent to that many
+    `shapeworks serve` processes instead of starting a process for each one.
+    """
+    if args.shapeworks_workers:
+        setShapeworksWorkers(args.shapeworks_workers)
+
+    """
+    The intermediate groom images are written uncompressed, so the next step
+    reads them without decompressing (or maps them with numpy.memmap), and
+    only the final groomed images are compressed. --compress_intermediates
+    compresses them all, trading groom time for disk space.
+    """
+    setIntermediateCompression(args.compress_intermediates)
+
+    """
+    --distance_transform maurer computes the signed distance transforms with
+    the exact separable Euclidean distance transform instead of fast marching
+    (see DTBenchmark.py for how the two compare).
+    """
+    setDistanceTransformMethod(args.distance_transform)
+
+    """
+    --icp_method multiresolution aligns the segmentations with a coarse to
+    fine ICP on subsampled surfaces, with kd-tree matching and a convergence
+    tolerance, instead of full resolution vtk ICP.
+    """
+    setICPMethod(args.icp_method)
+
+    """
+    --shape_index records the size, center of mass, bounding box and a mask
+    thumbnail of each groomed segmentation in a SQLite file. Center of mass
+    alignment, the bounding box and the choice of the reference then use it
+    instead of reading the segmentations again.
+    """
+    setShapeIndex(args.shape_index)
+
+    if args.use_scheduler and not args.start_with_prepped_data:
+
+        """
+        ## GROOM : Data Pre-processing, scheduled per subject
+        The same steps as below, but each subject moves on to its next step as
+        soon as it is done with the previous one. Subjects only wait for each
+        other for the choice of the rigid alignment reference and for the
+        largest bounding box. Up to --workers steps run at a time.
+        """
+
+        parentDir = './TestLeftAtrium/PrepOutput/'
+        groomCache = GroomCache(parentDir + "groom_cache")
+        groomArtifacts = ArtifactStore(parentDir + "groom_artifacts.json", resume=args.resume)
+
+        print("\nStep 2. Groom - Data Pre-processing\n")
+        if args.start_with_image_and_segmentation_data:
+            dtNode = addGroomNodes(pipeline, parentDir, fileList_seg, fileList_img, cache=groomCache, artifacts=groomArtifacts)
+        else:
+            dtNode = addGroomNodes(pipeline, parentDir, fileList_seg, cache=groomCache, artifacts=groomArtifacts)
+        pipeline.run()
+        dtFiles = pipeline.results[dtNode]
+
+    elif args.start_with_image_and_segmentation_data:
 
         """
         ## GROOM : Data Pre-processing
@@ -79,6 +160,10 @@ def Run_LeftAtrium_Pipline(args):
         """
 
         parentDir = './TestLeftAtrium/PrepOutput/'
+        # results of groom steps are reused when rerunning with unchanged inputs and parameters
+        groomCache = GroomCache(parentDir + "groom_cache")
+        # distance transforms computed for rigid alignment are carried through cropping
+        groomArtifacts = ArtifactStore(parentDir + "groom_artifacts.json", resume=args.resume)
 
         print("\nStep 2. Groom - Data Pre-processing\n")
         if args.interactive:
@@ -94,8 +179,8 @@ def Run_LeftAtrium_Pipline(args):
         the segmentation and images are resampled independently and the result files are saved in two different directories.
         """
 
-        resampledFiles_segmentations = applyIsotropicResampling(parentDir + "resampled/segmentations", fileList_seg, isBinary=True)
-        resampledFiles_images = applyIsotropicResampling(parentDir + "resampled/images", fileList_img, isBinary=False)
+        resampledFiles_segmentations = pipeline.step("resample_segmentations", applyIsotropicResampling, parentDir + "resampled/segmentations", fileList_seg, isBinary=True, cache=groomCache)
+        resampledFiles_images = pipeline.step("resample_images", applyIsotropicResampling, parentDir + "resampled/images", fileList_img, isBinary=False, cache=groomCache)
 
         """
         Apply padding
@@ -106,7 +191,7 @@ def Run_LeftAtrium_Pipline(args):
         Both the segmentation and raw images are padded.
         """
 
-        [paddedFiles_segmentations,  paddedFiles_images] = applyPadding(parentDir, resampledFiles_segmentations,resampledFiles_images, 10, processRaw = True)
+        [paddedFiles_segmentations,  paddedFiles_images] = pipeline.step("pad", applyPadding, parentDir, resampledFiles_segmentations,resampledFiles_images, 10, processRaw = True, cache=groomCache)
 
 
         """
@@ -118,7 +203,11 @@ def Run_LeftAtrium_Pipline(args):
         This function can handle both cases(processing only segmentation data or raw and segmentation data at the same time).
         There is parameter that you can change to switch between cases. processRaw = True, processes raw and binary images with shared parameters.
         """
-        [comFiles_segmentations, comFiles_images] = applyCOMAlignment( parentDir, paddedFiles_segmentations, paddedFiles_images , processRaw=True)
+        if args.single_resampling:
+            # only the segmentations are needed to compute the transformations and the bounding box
+            comFiles_segmentations = pipeline.step("com_align", applyCOMAlignment, parentDir, paddedFiles_segmentations, None, cache=groomCache)
+        else:
+            [comFiles_segmentations, comFiles_images] = pipeline.step("com_align", applyCOMAlignment, parentDir, paddedFiles_segmentations, paddedFiles_images , processRaw=True, cache=groomCache)
 
         """
         Apply rigid alignment
@@ -132,9 +221,12 @@ def Run_LeftAtrium_Pipline(args):
         This function uses the same transfrmation matrix for alignment of raw and segmentation files.
         Rigid alignment needs a reference file to align all the input files, FindMedianImage function defines the median file as the reference.
         """
-        medianFile = FindReferenceImage(comFiles_segmentations)
+        medianFile = pipeline.step("reference", FindReferenceImage, comFiles_segmentations)
 
-        [rigidFiles_segmentations, rigidFiles_images] = applyRigidAlignment(parentDir, comFiles_segmentations, comFiles_images , medianFile, processRaw = True)
+        if args.single_resampling:
+            rigidFiles_segmentations = pipeline.step("rigid_align", applyRigidAlignment, parentDir, comFiles_segmentations, None, medianFile, cache=groomCache)
+        else:
+            [rigidFiles_segmentations, rigidFiles_images] = pipeline.step("rigid_align", applyRigidAlignment, parentDir, comFiles_segmentations, comFiles_images , medianFile, processRaw = True, cache=groomCache, artifacts=groomArtifacts)
 
         """
         For detailed explainations of parameters for finding the largest bounding box and cropping, go to
@@ -146,8 +238,15 @@ def Run_LeftAtrium_Pipline(args):
         processRaw = False, applies the center of mass alignment only on segemnattion data.
         The function uses the same bounding box to crop the raw and segemnattion data.
 
+        With --single_resampling, the center of mass translation, the rigid transformation
+        and the crop are combined, and the padded files are resampled only once.
         """
-        [croppedFiles_segmentations, croppedFiles_images] = applyCropping(parentDir, rigidFiles_segmentations,  rigidFiles_images, processRaw=True)
+        if args.single_resampling:
+            [croppedFiles_segmentations, croppedFiles_images] = pipeline.step("crop", applyAlignmentAndCropping, parentDir, paddedFiles_segmentations, paddedFiles_images,
+                                                                              comFiles_segmentations, medianFile,
+                                                                              processRaw=True, cache=groomCache)
+        else:
+            [croppedFiles_segmentations, croppedFiles_images] = pipeline.step("crop", applyCropping, parentDir, rigidFiles_segmentations,  rigidFiles_images, processRaw=True, cache=groomCache, artifacts=groomArtifacts)
 
 
         print("\nStep 3. Groom - Convert to distance transforms\n")
@@ -159,9 +258,9 @@ def Run_LeftAtrium_Pipline(args):
         prepped as well as unprepped data, just provide correct filenames.
         """
         if not args.start_with_prepped_data:
-            dtFiles = applyDistanceTransforms(parentDir, croppedFiles_segmentations)
+            dtFiles = pipeline.step("distance_transforms", applyDistanceTransforms, parentDir, croppedFiles_segmentations, cache=groomCache, artifacts=groomArtifacts)
         else:
-            dtFiles = applyDistanceTransforms(parentDir, fileList_seg)
+            dtFiles = pipeline.step("distance_transforms", applyDistanceTransforms, parentDir, fileList_seg)
     else:
 
         if not args.start_with_prepped_data:
@@ -183,6 +282,10 @@ def Run_LeftAtrium_Pipline(args):
             parentDir = './TestLeftAtrium/PrepOutput/'
             if not os.path.exists(parentDir):
                 os.makedirs(parentDir)
+            # results of groom steps are reused when rerunning with unchanged inputs and parameters
+            groomCache = GroomCache(parentDir + "groom_cache")
+            # distance transforms computed for rigid alignment are carried through cropping
+            groomArtifacts = ArtifactStore(parentDir + "groom_artifacts.json", resume=args.resume)
 
 
 
@@ -194,7 +297,7 @@ def Run_LeftAtrium_Pipline(args):
 
             """
 
-            resampledFiles = applyIsotropicResampling(parentDir + "resampled", fileList_seg)
+            resampledFiles = pipeline.step("resample", applyIsotropicResampling, parentDir + "resampled", fileList_seg, cache=groomCache)
 
             """
             Apply padding
@@ -204,7 +307,7 @@ def Run_LeftAtrium_Pipline(args):
 
             """
 
-            paddedFiles = applyPadding(parentDir, resampledFiles ,None, 10)
+            paddedFiles = pipeline.step("pad", applyPadding, parentDir, resampledFiles ,None, 10, cache=groomCache)
 
             """
             Apply center of mass alignment
@@ -213,7 +316,7 @@ def Run_LeftAtrium_Pipline(args):
             'https://github.com/SCIInstitute/ShapeWorks/blob/master/Prep/Documentation/AlgnmentTools.pdf'
 
              """
-            comFiles = applyCOMAlignment(parentDir, paddedFiles, None)
+            comFiles = pipeline.step("com_align", applyCOMAlignment, parentDir, paddedFiles, None, cache=groomCache)
 
             """
             Apply rigid alignment
@@ -223,9 +326,9 @@ def Run_LeftAtrium_Pipline(args):
 
             Rigid alignment needs a reference file to align all the input files, FindMedianImage function defines the median file as the reference.
             """
-            medianFile = FindReferenceImage(comFiles)
+            medianFile = pipeline.step("reference", FindReferenceImage, comFiles)
 
-            rigidFiles = applyRigidAlignment(parentDir, comFiles, None, medianFile)
+            rigidFiles = pipeline.step("rigid_align", applyRigidAlignment, parentDir, comFiles, None, medianFile, cache=groomCache, artifacts=groomArtifacts)
 
             """
             Compute largest bounding box and apply cropping
@@ -234,7 +337,7 @@ def Run_LeftAtrium_Pipline(args):
 
             'https://github.com/SCIInstitute/ShapeWorks/blob/master/Prep/Documentation/ImagePrepTools.pdf'
             """
-            croppedFiles = applyCropping(parentDir, rigidFiles, None )
+            croppedFiles = pipeline.step("crop", applyCropping, parentDir, rigidFiles, None, cache=groomCache, artifacts=groomArtifacts)
 
 
         print("\nStep 3. Groom - Convert to distance transforms\n")
@@ -246,9 +349,9 @@ def Run_LeftAtrium_Pipline(args):
         prepped as well as unprepped data, just provide correct filenames.
         """
         if not args.start_with_prepped_data:
-            dtFiles = applyDistanceTransforms(parentDir, croppedFiles)
+            dtFiles = pipeline.step("distance_transforms", applyDistanceTransforms, parentDir, croppedFiles, cache=groomCache, artifacts=groomArtifacts)
         else:
-            dtFiles = applyDistanceTransforms(parentDir, fileList_seg)
+            dtFiles = pipeline.step("distance_transforms", applyDistanceTransforms, parentDir, fileList_seg)
 
 
 
@@ -307,7 +410,7 @@ def Run_LeftAtrium_Pipline(args):
         """
         Now we execute the particle optimization function.
         """
-        [localPointFiles, worldPointFiles] = runShapeWorksOptimize_SingleScale(pointDir, dtFiles, parameterDictionary)
+        [localPointFiles, worldPointFiles] = pipeline.step("optimize", runShapeWorksOptimize_SingleScale, pointDir, dtFiles, parameterDictionary)
 
     else:
         parameterDictionary = {
@@ -332,7 +435,7 @@ def Run_LeftAtrium_Pipline(args):
             "verbosity" : 3
         }
 
-        [localPointFiles, worldPointFiles] = runShapeWorksOptimize_MultiScale(pointDir, dtFiles, parameterDictionary)
+        [localPointFiles, worldPointFiles] = pipeline.step("optimize", runShapeWorksOptimize_MultiScale, pointDir, dtFiles, parameterDictionary)
 
 
 
@@ -400,7 +503,7 @@ def Run_LeftAtrium_Pipline(args):
     }
 
 
-    runReconstructMeanSurface(dtFiles, localPointFiles, worldPointFiles, parameterDictionary)
+    pipeline.step("reconstruct_mean_surface", runReconstructMeanSurface, dtFiles, localPointFiles, worldPointFiles, parameterDictionary)
 
     """
     Reconstruct the dense sample-specfic surface in the local coordinate system given the dense mean surface
@@ -427,7 +530,7 @@ def Run_LeftAtrium_Pipline(args):
         "glyph_radius" : 1
     }
 
-    localDensePointFiles = runReconstructSurface(localPointFiles, parameterDictionary)
+    localDensePointFiles = pipeline.step("reconstruct_local_surfaces", runReconstructSurface, localPointFiles, parameterDictionary)
 
 
     """
@@ -455,7 +558,7 @@ def Run_LeftAtrium_Pipline(args):
         "glyph_radius" : 1
     }
 
-    worldDensePointFiles = runReconstructSurface(worldPointFiles, parameterDictionary)
+    worldDensePointFiles = pipeline.step("reconstruct_world_surfaces", runReconstructSurface, worldPointFiles, parameterDictionary)
 
     """
     Reconstruct dense meshes along dominant pca modes
@@ -485,7 +588,7 @@ def Run_LeftAtrium_Pipline(args):
         "number_of_samples_per_mode" : 10
     }
 
-    runReconstructSamplesAlongPCAModes(worldPointFiles, parameterDictionary)
+    pipeline.step("reconstruct_pca_modes", runReconstructSamplesAlongPCAModes, worldPointFiles, parameterDictionary)
 
     """
     The local and world particles will be saved in TestLeftAtrium/PointFiles/<number_of_particles>
@@ -500,6 +603,8 @@ def Run_LeftAtrium_Pipline(args):
     visualized.
     """
 
+    summarizeTrace(traceFile)
+
     print("\nStep 9. Analysis - Launch ShapeWorksView2 - sparse correspondence model.\n")
     if args.interactive :
         input("Press Enter to continue")
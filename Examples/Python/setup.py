@@ -0,0 +1,9 @@
+import setuptools
+
+setuptools.setup(
+   name='ShapeWorksUtils',
+   version='1.0',
+   description='Python functions for grooming, optimizing and analyzing shape models with the ShapeWorks tools',
+   py_modules=['CommonUtils', 'GroomUtils', 'OptimizeUtils', 'AnalyzeUtils'],
+   install_requires=['numpy', 'termcolor', 'itk'], #external packages as dependencies, imported on first use
+)
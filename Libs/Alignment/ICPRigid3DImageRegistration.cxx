@@ -15,6 +15,9 @@
 
 =========================================================================*/
 
+#include <algorithm>
+#include <cmath>
+
 #include "itkCommand.h"
 #include "itkImage.h"
 #include "itkVTKImageExport.h"
@@ -29,6 +32,7 @@
 #include "itkResampleImageFilter.h"
 #include "itkLinearInterpolateImageFunction.h"
 #include "itkNearestNeighborInterpolateImageFunction.h"
+#include "itkMinimumMaximumImageCalculator.h"
 
 #include "vtkImageImport.h"
 #include "vtkImageExport.h"
@@ -56,6 +60,8 @@
 #include "vtkTransformPolyDataFilter.h"
 #include "vtkLandmarkTransform.h"
 #include "vtkMath.h"
+#include "vtkImageShrink3D.h"
+#include "vtkKdTreePointLocator.h"
 
 #include "OptionParser.h"
 
@@ -78,11 +84,16 @@ optparse::OptionParser buildParser()
     parser.add_option("--sourceSegmentation").action("store").type("string").set_default("").help("The segmentation of source image.");
     parser.add_option("--isoValue").action("store").type("float").set_default(0.0).help("As we need to get point set from surface for ICP, this iso value is required to get the isosurface. The default value is 0.0.");
     parser.add_option("--icpIterations").action("store").type("int").set_default(20).help("The number of iterations user want to run ICP registration.");
+    parser.add_option("--multiResolution").action("store").type("bool").set_default(false).help("Run ICP coarse to fine, on subsampled surfaces with kd-tree closest point queries, stopping each level once it converges (icpIterations is then the most iterations per level).");
+    parser.add_option("--levels").action("store").type("int").set_default(3).help("The number of resolution levels of the multi resolution ICP, each half the resolution of the next. The default value is 3.");
+    parser.add_option("--landmarks").action("store").type("int").set_default(1000).help("The number of source surface points matched at each level of the multi resolution ICP. The default value is 1000.");
+    parser.add_option("--tolerance").action("store").type("float").set_default(0.001).help("A level of the multi resolution ICP stops once the mean distance between matched points changes by less than this. The default value is 0.001.");
     parser.add_option("--visualizeResult").action("store").type("bool").set_default(false).help("A flag to visualize the registration result.");
     parser.add_option("--solutionSegmentation").action("store").type("string").set_default("").help("The filename of the aligned segmentation of source image.");
     parser.add_option("--solutionRaw").action("store").type("string").set_default("").help("The filename of the aligned raw source image.");
     parser.add_option("--sourceRaw").action("store").type("string").set_default("").help("The raw source image.");
     parser.add_option("--solutionTransformation").action("store").type("string").set_default("").help("The filename of the textfile containing the transformation matrix.");
+    parser.add_option("--solutionDistanceMap").action("store").type("string").set_default("").help("The filename of the source distance map resampled with the same transformation (optional).");
     return parser;
 }
 
@@ -152,6 +163,102 @@ void ConnectPipelines(VTK_Exporter* exporter, ITK_Importer importer)
 }
 
 
+/**
+ * Extracts the isosurface of a distance map subsampled by the given factor.
+ */
+vtkSmartPointer<vtkPolyData> ContourAtResolution(vtkImageData* distanceMap, float isovalue, int factor)
+{
+    vtkSmartPointer<vtkContourFilter> contour = vtkSmartPointer<vtkContourFilter>::New();
+    vtkSmartPointer<vtkImageShrink3D> shrink = vtkSmartPointer<vtkImageShrink3D>::New();
+    if (factor > 1)
+    {
+        shrink->SetInputData( distanceMap );
+        shrink->SetShrinkFactors( factor, factor, factor );
+        shrink->AveragingOn();
+        contour->SetInputConnection( shrink->GetOutputPort() );
+    }
+    else
+    {
+        contour->SetInputData( distanceMap );
+    }
+    contour->SetValue( 0, isovalue );
+    contour->ComputeNormalsOff();
+    contour->ComputeScalarsOff();
+    contour->Update();
+    return contour->GetOutput();
+}
+
+/**
+ * Rigid ICP run coarse to fine: at each level both isosurfaces are extracted
+ * from the distance maps subsampled by 2^level, at most numLandmarks source
+ * points are matched to their closest target points with a kd-tree, and the
+ * level stops once the mean distance between matched points changes by less
+ * than tolerance (or after maxIterations). Each level starts from the
+ * transform of the previous one. Returns the matrix taking the source
+ * surface to the target.
+ */
+vtkSmartPointer<vtkMatrix4x4> MultiResolutionICP(vtkImageData* target, vtkImageData* moving, float isovalue,
+                                                 int levels, int maxIterations, int numLandmarks, double tolerance)
+{
+    vtkSmartPointer<vtkMatrix4x4> matrix = vtkSmartPointer<vtkMatrix4x4>::New();
+
+    for (int level = levels - 1; level >= 0; level--)
+    {
+        const int factor = 1 << level;
+        vtkSmartPointer<vtkPolyData> targetSurface = ContourAtResolution(target, isovalue, factor);
+        vtkSmartPointer<vtkPolyData> movingSurface = ContourAtResolution(moving, isovalue, factor);
+        if (targetSurface->GetNumberOfPoints() == 0 || movingSurface->GetNumberOfPoints() == 0)
+            continue;
+
+        vtkSmartPointer<vtkKdTreePointLocator> locator = vtkSmartPointer<vtkKdTreePointLocator>::New();
+        locator->SetDataSet( targetSurface );
+        locator->BuildLocator();
+
+        // evenly spread source points
+        vtkSmartPointer<vtkPoints> sourcePoints = vtkSmartPointer<vtkPoints>::New();
+        const vtkIdType stride = std::max<vtkIdType>(1, movingSurface->GetNumberOfPoints() / std::max(1, numLandmarks));
+        for (vtkIdType i = 0; i < movingSurface->GetNumberOfPoints(); i += stride)
+            sourcePoints->InsertNextPoint( movingSurface->GetPoint(i) );
+
+        vtkSmartPointer<vtkPoints> matchedSource = vtkSmartPointer<vtkPoints>::New();
+        vtkSmartPointer<vtkPoints> matchedTarget = vtkSmartPointer<vtkPoints>::New();
+        double lastMeanDistance = VTK_DOUBLE_MAX;
+        for (int iteration = 0; iteration < maxIterations; iteration++)
+        {
+            matchedSource->Reset();
+            matchedTarget->Reset();
+            double meanDistance = 0.0;
+            for (vtkIdType i = 0; i < sourcePoints->GetNumberOfPoints(); i++)
+            {
+                double p[4];
+                sourcePoints->GetPoint(i, p);
+                p[3] = 1.0;
+                matrix->MultiplyPoint(p, p);
+                double q[3];
+                targetSurface->GetPoint(locator->FindClosestPoint(p), q);
+                matchedSource->InsertNextPoint(p);
+                matchedTarget->InsertNextPoint(q);
+                meanDistance += std::sqrt(vtkMath::Distance2BetweenPoints(p, q));
+            }
+            meanDistance /= sourcePoints->GetNumberOfPoints();
+            if (std::fabs(lastMeanDistance - meanDistance) < tolerance)
+                break;
+            lastMeanDistance = meanDistance;
+
+            vtkSmartPointer<vtkLandmarkTransform> step = vtkSmartPointer<vtkLandmarkTransform>::New();
+            step->SetSourceLandmarks( matchedSource );
+            step->SetTargetLandmarks( matchedTarget );
+            step->SetModeToRigidBody();
+            step->Update();
+
+            vtkSmartPointer<vtkMatrix4x4> composed = vtkSmartPointer<vtkMatrix4x4>::New();
+            vtkMatrix4x4::Multiply4x4(step->GetMatrix(), matrix, composed);
+            matrix->DeepCopy(composed);
+        }
+    }
+    return matrix;
+}
+
 /**
  * This program implements an example connection between ITK and VTK
  * pipelines.  The combined pipeline flows as follows:
@@ -185,9 +292,14 @@ int main(int argc, char * argv [] )
     std::string sourceRaw            = (std::string) options.get("sourceRaw");
     std::string solutionRaw          = (std::string) options.get("solutionRaw");
     std::string solutionTransformation   = (std::string) options.get("solutionTransformation");
+    std::string solutionDistanceMap  = (std::string) options.get("solutionDistanceMap");
     float         isovalue           = (float) options.get("isoValue");
     int         icpIterations        = (int) options.get("icpIterations");
     bool      visualizeResult        = (bool) options.get("visualizeResult");
+    bool      multiResolution        = (bool) options.get("multiResolution");
+    int         levels               = (int) options.get("levels");
+    int         landmarks            = (int) options.get("landmarks");
+    double      tolerance            = (double) options.get("tolerance");
 
     try
     {
@@ -228,7 +340,9 @@ int main(int argc, char * argv [] )
         vtkContourFilter * targetContour = vtkContourFilter::New();
         targetContour->SetInputData( vtkTargetImporter->GetOutput() );
         targetContour->SetValue( 0, isovalue  );
-        targetContour->Update();
+        // the multi resolution ICP extracts its own surfaces
+        if (!multiResolution || visualizeResult)
+            targetContour->Update();
 
         ReaderType::Pointer movingReader  = ReaderType::New();
         movingReader->SetFileName( sourceDistanceMap );
@@ -248,34 +362,47 @@ int main(int argc, char * argv [] )
         vtkContourFilter * movingContour = vtkContourFilter::New();
         movingContour->SetInputData( vtkMovingImporter->GetOutput() );
         movingContour->SetValue( 0, isovalue );
-        movingContour->Update();
+        if (!multiResolution || visualizeResult)
+            movingContour->Update();
 
         vtkSmartPointer<vtkPolyData> target = targetContour->GetOutput();
         vtkSmartPointer<vtkPolyData> moving = movingContour->GetOutput();
 
 
-        // Setup ICP transform		 // Setup ICP transform
-        vtkSmartPointer<vtkIterativeClosestPointTransform> icp =
-                vtkSmartPointer<vtkIterativeClosestPointTransform>::New();
-        icp->SetSource(moving);
-        icp->SetTarget(target);
-        icp->GetLandmarkTransform()->SetModeToRigidBody();
-        icp->SetMaximumNumberOfIterations(icpIterations);
-        //icp->StartByMatchingCentroidsOn();
-        icp->Modified();
-        icp->Update();
+        // Get the resulting transformation matrix (this matrix takes the source points to the target points)
+        vtkSmartPointer<vtkMatrix4x4> m1;
+        if (multiResolution)
+        {
+            m1 = MultiResolutionICP(vtkTargetImporter->GetOutput(), vtkMovingImporter->GetOutput(), isovalue,
+                                    levels, icpIterations, landmarks, tolerance);
+        }
+        else
+        {
+            // Setup ICP transform		 // Setup ICP transform
+            vtkSmartPointer<vtkIterativeClosestPointTransform> icp =
+                    vtkSmartPointer<vtkIterativeClosestPointTransform>::New();
+            icp->SetSource(moving);
+            icp->SetTarget(target);
+            icp->GetLandmarkTransform()->SetModeToRigidBody();
+            icp->SetMaximumNumberOfIterations(icpIterations);
+            //icp->StartByMatchingCentroidsOn();
+            icp->Modified();
+            icp->Update();
+            m1 = icp->GetMatrix();
+        }
 
+        vtkSmartPointer<vtkTransform> icpTransform = vtkSmartPointer<vtkTransform>::New();
+        icpTransform->SetMatrix(m1);
 
         vtkSmartPointer<vtkTransformPolyDataFilter> icpTransformFilter =
                 vtkSmartPointer<vtkTransformPolyDataFilter>::New();
         icpTransformFilter->SetInputData(moving);
-        icpTransformFilter->SetTransform(icp);
-        icpTransformFilter->Update();
+        icpTransformFilter->SetTransform(icpTransform);
+        if (visualizeResult)
+            icpTransformFilter->Update();
 
 
         //Transform Segmentation
-        // Get the resulting transformation matrix (this matrix takes the source points to the target points)
-        vtkSmartPointer<vtkMatrix4x4> m1 = icp->GetMatrix();
         vtkSmartPointer<vtkMatrix4x4> m  = vtkMatrix4x4::New();
 
         vtkMatrix4x4::Invert(m1, m);
@@ -387,6 +514,44 @@ int main(int argc, char * argv [] )
             itkImageWriter->Update();
          }
 
+        //////////////////////////////////
+        // Same transformation applied on the source distance map, so the
+        // aligned segmentation does not need its distance map recomputed
+        if (solutionDistanceMap != "")
+        {
+            // voxels mapped from outside the source are given the largest
+            // distance, so no spurious zero crossing is created
+            typedef itk::MinimumMaximumImageCalculator< InputImageType > CalculatorType;
+            CalculatorType::Pointer calculator = CalculatorType::New();
+            calculator->SetImage( movingInputImage );
+            calculator->ComputeMaximum();
+
+            typedef itk::ResampleImageFilter< InputImageType
+                    , OutputImageType > ResampleFilterType;
+            ResampleFilterType::Pointer resampler = ResampleFilterType::New();
+            resampler->SetTransform( transform );
+
+            typedef itk::LinearInterpolateImageFunction<
+                    InputImageType, double > InterpolatorType;
+            InterpolatorType::Pointer interpolator = InterpolatorType::New();
+
+            resampler->SetInterpolator( interpolator );
+            resampler->SetDefaultPixelValue( calculator->GetMaximum() );
+            resampler->SetOutputSpacing( targetInputImage->GetSpacing() );
+            resampler->SetSize( size );
+            resampler->SetOutputOrigin( targetInputImage->GetOrigin() );
+            resampler->SetOutputDirection( targetInputImage->GetDirection() );
+            resampler->SetInput( movingInputImage );
+            resampler->Update();
+
+            typedef itk::ImageFileWriter< OutputImageType >  ITKWriterType;
+            ITKWriterType::Pointer itkImageWriter = ITKWriterType::New();
+
+            itkImageWriter->SetInput( resampler->GetOutput() );
+            itkImageWriter->SetFileName( solutionDistanceMap );
+            itkImageWriter->Update();
+        }
+
         if(visualizeResult){
             //------------------------------------------------------------------------
             // VTK Render pipeline.
@@ -82,15 +82,9 @@ int main(int argc, char * argv[] )
         typedef itk::ImageFileReader< InputImageType  >  ReaderType;
         ReaderType::Pointer reader = ReaderType::New();
         reader->SetFileName(inFilename);
-        try
-        {
-            reader->Update();
-        }
-        catch( itk::ExceptionObject & excep )
-        {
-            std::cerr << "Exception caught!" << std::endl;
-            std::cerr << excep << std::endl;
-        }
+        // not updated here: the extract filter requests only the cropped
+        // region, so image IOs that support streaming only read that region
+        reader->UseStreamingOn();
 
         InputImageType::IndexType index;
         index[0]=startingIndexX;
@@ -154,15 +148,9 @@ int main(int argc, char * argv[] )
         typedef itk::ImageFileReader< MRIInputImageType  >  MRIReaderType;
         MRIReaderType::Pointer MRIreader = MRIReaderType::New();
         MRIreader->SetFileName(MRIinFilename);
-        try
-        {
-            MRIreader->Update();
-        }
-        catch( itk::ExceptionObject & excep )
-        {
-            std::cerr << "Exception caught!" << std::endl;
-            std::cerr << excep << std::endl;
-        }
+        // not updated here: the extract filter requests only the cropped
+        // region, so image IOs that support streaming only read that region
+        MRIreader->UseStreamingOn();
 
         MRIInputImageType::IndexType MRIindex;
         MRIindex[0]=startingIndexX;
@@ -8,6 +8,10 @@
 #include "itkImageRegionIterator.h"
 #include "itkChangeInformationImageFilter.h"
 #include "string.h"
+#include <sstream>
+#include <thread>
+#include <vector>
+#include <algorithm>
 
 #include "OptionParser.h"
 
@@ -28,6 +32,8 @@ optparse::OptionParser buildParser()
     parser.add_option("--inFilename").action("store").type("string").set_default("").help("The filename of the input image from which label has to be extracted.");
     parser.add_option("--labelVal").action("store").type("int").set_default(1).help("The label value which has to be extracted.");
     parser.add_option("--outFilename").action("store").type("string").set_default("").help("The filename of the output image.");
+    parser.add_option("--labels").action("store").type("string").set_default("").help("Comma separated label values to extract from a single read of the input, each written to <outPrefix>label<value>.nrrd in parallel (replaces labelVal and outFilename).");
+    parser.add_option("--outPrefix").action("store").type("string").set_default("").help("Prefix of the output filenames of --labels.");
     
     return parser;
 }
@@ -51,6 +57,46 @@ void DeepCopy(typename TImage::Pointer input, typename TImage::Pointer output)
     }
 }
 
+// writes the binary image of each label, one thread per label
+template<typename TImage>
+bool ExtractLabels(typename TImage::Pointer input, const std::vector<int> &labels, const std::string &outPrefix)
+{
+    std::vector<std::thread> threads;
+    std::vector<char> succeeded(labels.size(), 0);
+    for (unsigned int i = 0; i < labels.size(); i++)
+    {
+        threads.emplace_back([&, i]() {
+            typename TImage::Pointer output = TImage::New();
+            output->CopyInformation(input);
+            output->SetRegions(input->GetLargestPossibleRegion());
+            output->Allocate();
+
+            itk::ImageRegionConstIterator<TImage> inIterator(input, input->GetLargestPossibleRegion());
+            itk::ImageRegionIterator<TImage> outIterator(output, output->GetLargestPossibleRegion());
+            for (; !inIterator.IsAtEnd(); ++inIterator, ++outIterator)
+                outIterator.Set(inIterator.Get() == labels[i] ? 1 : 0);
+
+            typedef itk::ImageFileWriter< TImage >  WriterType;
+            typename WriterType::Pointer writer = WriterType::New();
+            writer->SetFileName( outPrefix + "label" + std::to_string(labels[i]) + ".nrrd" );
+            writer->SetInput(output);
+            try
+            {
+                writer->Update();
+                succeeded[i] = 1;
+            }
+            catch( itk::ExceptionObject & excep )
+            {
+                std::cerr << "Exception caught !" << std::endl;
+                std::cerr << excep << std::endl;
+            }
+        });
+    }
+    for (auto &thread : threads)
+        thread.join();
+    return std::find(succeeded.begin(), succeeded.end(), 0) == succeeded.end();
+}
+
 int main( int argc, char * argv[] )
 {
     optparse::OptionParser parser = buildParser();
@@ -66,6 +112,8 @@ int main( int argc, char * argv[] )
     std::string inFilename    = (std::string) options.get("inFilename");
     std::string outFilename   = (std::string) options.get("outFilename");
     int         label         = (int) options.get("labelVal");
+    std::string labelList     = (std::string) options.get("labels");
+    std::string outPrefix     = (std::string) options.get("outPrefix");
     
     typedef   float InputPixelType;
     typedef   float InternalPixelType;
@@ -90,6 +138,16 @@ int main( int argc, char * argv[] )
     }
 
 	InputImageType::ConstPointer inputImage = reader->GetOutput();
+
+    if (labelList != "")
+    {
+        std::vector<int> labels;
+        std::stringstream labelStream(labelList);
+        std::string value;
+        while (std::getline(labelStream, value, ','))
+            labels.push_back(std::stoi(value));
+        return ExtractLabels<InputImageType>(reader->GetOutput(), labels, outPrefix) ? EXIT_SUCCESS : EXIT_FAILURE;
+    }
 	typedef itk::Image< OutputPixelType,   Dimension >   OutputImageType;
 
         OutputImageType::Pointer inImage = reader->GetOutput();
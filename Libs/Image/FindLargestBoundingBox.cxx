@@ -5,6 +5,7 @@
 #include "itkIdentityTransform.h"
 #include "itkImageRegionIterator.h"
 #include "itkImageRegionIteratorWithIndex.h"
+#include "itksys/SystemTools.hxx"
 #include "string.h"
 #include <iostream>
 #include <fstream>
@@ -31,6 +32,8 @@ optparse::OptionParser buildParser()
     parser.add_option("--inFilename").action("store").type("string").set_default("").help("A text file with the file names for which the largest size has to be computed.");
     parser.add_option("--outPrefix").action("store").type("string").set_default("").help("Output prefix to be used to save the parameters for the estimated bounding box.");
     parser.add_option("--paddingSize").action("store").type("int").set_default(0).help("Number of extra voxels in each direction to pad the largest bounding box, checks agains min image size is performed to make sure that this padding won't get out of bounds for the smallest image in the file names provides");
+    parser.add_option("--useExtentFiles").action("store").type("bool").set_default(false).help("Read the extent of each image from its extent file (the image filename followed by .extent.txt) when it is newer than the image, and write the extent files of the images read.");
+    parser.add_option("--image").action("store").type("string").set_default("").help("Only compute the extent of this image and write it to its extent file, so that the extents of many images can be computed in parallel before combining them with --useExtentFiles.");
 
     return parser;
 }
@@ -92,6 +95,104 @@ void ThresholdImage(typename InImageType::Pointer input, typename OutImageType::
     }
 }
 
+// extent of the voxels of an image that are 1, along with the image size
+struct Extent
+{
+    int size[3];
+    int smallestIndex[3];
+    int largestIndex[3];
+    int volume;
+};
+
+std::string ExtentFilename(const std::string &filename)
+{
+    return filename + ".extent.txt";
+}
+
+// reads the extent file of an image, if it is newer than the image
+bool ReadExtentFile(const std::string &filename, Extent &extent)
+{
+    std::string extentFilename = ExtentFilename(filename);
+    int newer = 0;
+    if (!itksys::SystemTools::FileExists(extentFilename.c_str(), true) ||
+        !itksys::SystemTools::FileTimeCompare(extentFilename, filename, &newer) || newer <= 0)
+        return false;
+
+    std::ifstream extentFile(extentFilename.c_str());
+    for (int i = 0; i < 3; i++)
+        extentFile >> extent.size[i];
+    for (int i = 0; i < 3; i++)
+        extentFile >> extent.smallestIndex[i];
+    for (int i = 0; i < 3; i++)
+        extentFile >> extent.largestIndex[i];
+    extentFile >> extent.volume;
+    return !extentFile.fail();
+}
+
+void WriteExtentFile(const std::string &filename, const Extent &extent)
+{
+    std::ofstream extentFile(ExtentFilename(filename).c_str());
+    extentFile << extent.size[0] << " " << extent.size[1] << " " << extent.size[2] << "\n"
+               << extent.smallestIndex[0] << " " << extent.smallestIndex[1] << " " << extent.smallestIndex[2] << "\n"
+               << extent.largestIndex[0] << " " << extent.largestIndex[1] << " " << extent.largestIndex[2] << "\n"
+               << extent.volume << "\n";
+}
+
+// computes the extent of the voxels of value 1, returns false if the image can't be read
+bool ComputeExtent(const std::string &filename, Extent &extent)
+{
+    //typedef   unsigned char InputPixelType;
+
+    // ANTs output float-type images even with nearest neighbor resampling
+    typedef   float InputPixelType;
+
+    const     unsigned int    Dimension = 3;
+    typedef itk::Image< InputPixelType,    Dimension >   InputImageType;
+    typedef itk::ImageFileReader< InputImageType  >  ReaderType;
+    ReaderType::Pointer reader = ReaderType::New();
+    reader->SetFileName( filename );
+
+    try
+    {
+        reader->Update();
+    }
+    catch( itk::ExceptionObject & excep )
+    {
+        std::cerr << "Exception caught!" << std::endl;
+        std::cerr << excep << std::endl;
+        return false;
+    }
+
+    for (int i = 0; i < 3; i++)
+    {
+        extent.size[i] = reader->GetOutput()->GetLargestPossibleRegion().GetSize()[i];
+        extent.smallestIndex[i] = 1e6;
+        extent.largestIndex[i] = 0;
+    }
+    extent.volume = 0;
+
+    InputImageType::Pointer inputImage = reader->GetOutput();
+    itk::ImageRegionIteratorWithIndex<InputImageType> imageIterator(inputImage, inputImage->GetLargestPossibleRegion());
+
+    while(!imageIterator.IsAtEnd())
+    {
+        InputPixelType val = imageIterator.Get();
+
+        if(val == 1)
+        {
+            for (int i = 0; i < 3; i++)
+            {
+                extent.smallestIndex[i] = std::min(extent.smallestIndex[i], (int) imageIterator.GetIndex()[i]);
+                extent.largestIndex[i] = std::max(extent.largestIndex[i], (int) imageIterator.GetIndex()[i]);
+            }
+            extent.volume++;
+        }
+
+        ++imageIterator;
+    }
+    return true;
+}
+
 int main( int argc, char * argv[] )
 {
     optparse::OptionParser parser = buildParser();
@@ -107,6 +208,19 @@ int main( int argc, char * argv[] )
     std::string inFilename    = (std::string) options.get("inFilename");
     std::string outPrefix   = (std::string) options.get("outPrefix");
     int         paddingSize   = (int) options.get("paddingSize");
+    bool        useExtentFiles = (bool) options.get("useExtentFiles");
+    std::string image         = (std::string) options.get("image");
+
+    if (image != "")
+    {
+        std::cout<<"Processing: " << image<<std::endl;
+        Extent extent;
+        // an unreadable image gets no extent file, which the main pass would trust
+        if (!ComputeExtent(image, extent))
+            return EXIT_FAILURE;
+        WriteExtentFile(image, extent);
+        return EXIT_SUCCESS;
+    }
 
 
     std::ifstream myfile;
@@ -145,69 +259,30 @@ int main( int argc, char * argv[] )
         {
 
             int cur_bb[3]={0,0,0};
-            int cur_smallestIndex[3];
-            cur_smallestIndex[0] = 1e6;
-            cur_smallestIndex[1] = 1e6;
-            cur_smallestIndex[2] = 1e6;
-            int cur_largestIndex[3]  = {0,0,0};
-
-            //typedef   unsigned char InputPixelType;
-            //typedef   unsigned char OutputPixelType;
-
-            // ANTs output float-type images even with nearest neighbor resampling
-            typedef   float InputPixelType;
-            typedef   unsigned char OutputPixelType;
-
-            const     unsigned int    Dimension = 3;
-            typedef itk::Image< InputPixelType,    Dimension >   InputImageType;
-            typedef itk::ImageFileReader< InputImageType  >  ReaderType;
-            ReaderType::Pointer reader = ReaderType::New();
-            std::cout<<"Processing: " << line<<std::endl;
-            reader->SetFileName( line );
 
             filenames.push_back(line);
-            try
-            {
-                reader->Update();
-            }
-            catch( itk::ExceptionObject & excep )
-            {
-                std::cerr << "Exception caught!" << std::endl;
-                std::cerr << excep << std::endl;
-            }
-
-            int curXsize = reader->GetOutput()->GetLargestPossibleRegion().GetSize()[0];
-            int curYsize = reader->GetOutput()->GetLargestPossibleRegion().GetSize()[1];
-            int curZsize = reader->GetOutput()->GetLargestPossibleRegion().GetSize()[2];
-
-            minXsize = std::min(minXsize, curXsize);
-            minYsize = std::min(minYsize, curYsize);
-            minZsize = std::min(minZsize, curZsize);
-
-            InputImageType::Pointer inputImage = reader->GetOutput();
-            itk::ImageRegionIteratorWithIndex<InputImageType> imageIterator(inputImage, inputImage->GetLargestPossibleRegion());
 
-            int cur_volume = 0;
-            while(!imageIterator.IsAtEnd())
+            Extent extent;
+            if (!useExtentFiles || !ReadExtentFile(line, extent))
             {
-                InputPixelType val = imageIterator.Get();
-
-                if(val == 1)
+                std::cout<<"Processing: " << line<<std::endl;
+                if (!ComputeExtent(line, extent))
                 {
-                    cur_smallestIndex[0] = std::min(cur_smallestIndex[0], (int) imageIterator.GetIndex()[0]);
-                    cur_smallestIndex[1] = std::min(cur_smallestIndex[1], (int) imageIterator.GetIndex()[1]);
-                    cur_smallestIndex[2] = std::min(cur_smallestIndex[2], (int) imageIterator.GetIndex()[2]);
-
-                    cur_largestIndex[0] = std::max(cur_largestIndex[0], (int)imageIterator.GetIndex()[0]);
-                    cur_largestIndex[1] = std::max(cur_largestIndex[1], (int)imageIterator.GetIndex()[1]);
-                    cur_largestIndex[2] = std::max(cur_largestIndex[2], (int)imageIterator.GetIndex()[2]);
-
-                    cur_volume++;
+                    std::cerr << "Could not read " << line << std::endl;
+                    return EXIT_FAILURE;
                 }
-
-                ++imageIterator;
+                if (useExtentFiles)
+                    WriteExtentFile(line, extent);
             }
 
+            int *cur_smallestIndex = extent.smallestIndex;
+            int *cur_largestIndex = extent.largestIndex;
+            int cur_volume = extent.volume;
+
+            minXsize = std::min(minXsize, extent.size[0]);
+            minYsize = std::min(minYsize, extent.size[1]);
+            minZsize = std::min(minZsize, extent.size[2]);
+
             smallestIndex[0] = std::min(smallestIndex[0], cur_smallestIndex[0]);
             smallestIndex[1] = std::min(smallestIndex[1], cur_smallestIndex[1]);
             smallestIndex[2] = std::min(smallestIndex[2], cur_smallestIndex[2]);
@@ -11,6 +11,17 @@
 #include <itkConstantPadImageFilter.h>
 #include <itkTestingComparisonImageFilter.h>
 #include <itkRegionOfInterestImageFilter.h>
+#include <itkBinaryFillholeImageFilter.h>
+#include <itkReinitializeLevelSetImageFilter.h>
+#include <itkSignedMaurerDistanceMapImageFilter.h>
+#include <itkShiftScaleImageFilter.h>
+#include <itkCurvatureFlowImageFilter.h>
+#include <itkGradientMagnitudeImageFilter.h>
+#include <itkSigmoidImageFilter.h>
+#include <itkExtractImageFilter.h>
+#include <itkLinearInterpolateImageFunction.h>
+#include <itkImageRegionConstIteratorWithIndex.h>
+#include "itkTPGACLevelSetImageFilter.h"
 
 namespace shapeworks {
 
@@ -339,6 +350,518 @@ bool Image::pad(int padding, PixelType value)
 
 }
 
-} // Shapeworks
+/// extractLabel
+///
+/// extracts/isolates a specific voxel label from a multi-label volume, producing a binary image
+///
+/// \param label       value of the label to extract [default 1.0]
+bool Image::extractLabel(PixelType label)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+
+  using FilterType = itk::BinaryThresholdImageFilter<ImageType, ImageType>;
+  FilterType::Pointer filter = FilterType::New();
+  filter->SetLowerThreshold(label);
+  filter->SetUpperThreshold(label);
+  filter->SetInsideValue(itk::NumericTraits<PixelType>::One);
+  filter->SetOutsideValue(itk::NumericTraits<PixelType>::Zero);
+
+  filter->SetInput(this->image);
+  this->image = filter->GetOutput();
+
+  try
+  {
+    filter->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Extract label failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Extract label succeeded!\n";
+#endif
+  return true;
+}
+
+/// closeHoles
+///
+/// closes holes in a binary volume (same foreground value as the CloseHoles tool)
+bool Image::closeHoles()
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+
+  using FilterType = itk::BinaryFillholeImageFilter<ImageType>;
+  FilterType::Pointer filter = FilterType::New();
+  filter->SetForegroundValue(itk::NumericTraits<PixelType>::min());
+
+  filter->SetInput(this->image);
+  this->image = filter->GetOutput();
+
+  try
+  {
+    filter->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Close holes failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Close holes succeeded!\n";
+#endif
+  return true;
+}
+
+/// threshold
+///
+/// thresholds the image into a binary label based on lower and upper intensity bounds
+///
+/// \param min         lower threshold level [default lowest float]
+/// \param max         upper threshold level [default largest float]
+/// \param inside      value for pixels within [min, max] [default is 1]
+/// \param outside     value for all other pixels [default is 0]
+bool Image::threshold(PixelType min, PixelType max, PixelType inside, PixelType outside)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+
+  using FilterType = itk::BinaryThresholdImageFilter<ImageType, ImageType>;
+  FilterType::Pointer filter = FilterType::New();
+  filter->SetLowerThreshold(min);
+  filter->SetUpperThreshold(max);
+  filter->SetInsideValue(inside);
+  filter->SetOutsideValue(outside);
+
+  filter->SetInput(this->image);
+  this->image = filter->GetOutput();
+
+  try
+  {
+    filter->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Threshold filter failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Threshold filter succeeded!\n";
+#endif
+  return true;
+}
+
+/// fastMarch
+///
+/// computes the signed distance transform of an (antialiased) image, as done by the FastMarching tool
+///
+/// \param isoValue    level set value that defines the interface between foreground and background [default 0.0]
+bool Image::fastMarch(PixelType isoValue)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+
+  using FilterType = itk::ReinitializeLevelSetImageFilter<ImageType>;
+  FilterType::Pointer filter = FilterType::New();
+  filter->NarrowBandingOff();
+  filter->SetLevelSetValue(isoValue);
+
+  filter->SetInput(this->image);
+  this->image = filter->GetOutput();
+
+  try
+  {
+    filter->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Fast marching failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Fast marching succeeded!\n";
+#endif
+  return true;
+}
+
+/// signedDistance
+///
+/// computes the signed distance transform of an (antialiased or binary) image with the exact, linear time, separable
+/// Euclidean distance transform of Maurer et al. rather than fast marching. As with fastMarch, voxels above isoValue
+/// are positive. The interface is placed halfway between the voxels on either side of it.
+///
+/// \param isoValue    level set value that defines the interface between foreground and background [default 0.0]
+/// \param numThreads  number of threads the rows of each dimension are split across [default 0, all available]
+bool Image::signedDistance(PixelType isoValue, unsigned numThreads)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+
+  using ThresholdType = itk::BinaryThresholdImageFilter<ImageType, ImageType>;
+  ThresholdType::Pointer threshold = ThresholdType::New();
+  threshold->SetLowerThreshold(isoValue);
+  threshold->SetInsideValue(1.0);
+  threshold->SetOutsideValue(0.0);
+  threshold->SetInput(this->image);
+
+  using DistanceType = itk::SignedMaurerDistanceMapImageFilter<ImageType, ImageType>;
+  DistanceType::Pointer distance = DistanceType::New();
+  distance->SetBackgroundValue(0.0);
+  distance->SetInsideIsPositive(true);
+  distance->SetSquaredDistance(false);
+  distance->SetUseImageSpacing(true);
+  if (numThreads > 0)
+    distance->SetNumberOfWorkUnits(numThreads);
+  distance->SetInput(threshold->GetOutput());
+
+  // the boundary voxels of the foreground are at 0 and their background neighbors at -spacing, so move the interface
+  // between them
+  const ImageType::SpacingType &spacing = this->image->GetSpacing();
+  double halfVoxel = 0.5 * std::min(spacing[0], std::min(spacing[1], spacing[2]));
+
+  using ShiftType = itk::ShiftScaleImageFilter<ImageType, ImageType>;
+  ShiftType::Pointer shift = ShiftType::New();
+  shift->SetShift(halfVoxel);
+  shift->SetInput(distance->GetOutput());
+  this->image = shift->GetOutput();
+
+  try
+  {
+    shift->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Signed distance failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Signed distance succeeded!\n";
+#endif
+  return true;
+}
+
+/// topologyPreservingSmooth
+///
+/// smooths a distance transform the way the TopologyPreservingSmoothing tool does. By default the result is the
+/// curvature flow smoothed distance transform (the tool's dtFiles output, which is what grooming uses downstream).
+///
+/// \param smoothingIterations   number of curvature flow iterations [default 10]
+/// \param scaling               propagation scaling of the topology preserving level set [default 20.0]
+/// \param alpha                 sigmoid alpha used to compute the level set's feature image [default 10.5]
+/// \param beta                  sigmoid beta used to compute the level set's feature image [default 10.0]
+/// \param levelSetOutput        replace the image with the topology preserving level set (the tool's outputs) instead
+bool Image::topologyPreservingSmooth(unsigned smoothingIterations, float scaling, float alpha, float beta, bool levelSetOutput)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
 
+  using SmoothingFilterType = itk::CurvatureFlowImageFilter<ImageType, ImageType>;
+  SmoothingFilterType::Pointer smoothing = SmoothingFilterType::New();
+  smoothing->SetTimeStep(0.0625);
+  smoothing->SetNumberOfIterations(smoothingIterations);
+  smoothing->SetInput(this->image);
 
+  try
+  {
+    smoothing->Update();
+
+    if (levelSetOutput)
+    {
+      using GradientFilterType = itk::GradientMagnitudeImageFilter<ImageType, ImageType>;
+      GradientFilterType::Pointer gradientMag = GradientFilterType::New();
+      gradientMag->SetInput(smoothing->GetOutput());
+
+      using SigmoidFilterType = itk::SigmoidImageFilter<ImageType, ImageType>;
+      SigmoidFilterType::Pointer sigmoid = SigmoidFilterType::New();
+      sigmoid->SetAlpha(alpha);
+      sigmoid->SetBeta(beta);
+      sigmoid->SetOutputMinimum(0.0);
+      sigmoid->SetOutputMaximum(1.0);
+      sigmoid->SetInput(gradientMag->GetOutput());
+      sigmoid->Update();
+
+      using LevelSetFilterType = itk::TPGACLevelSetImageFilter<ImageType, ImageType>;
+      LevelSetFilterType::Pointer levelSet = LevelSetFilterType::New();
+      levelSet->SetPropagationScaling(scaling);
+      levelSet->SetCurvatureScaling(1.0);
+      levelSet->SetAdvectionScaling(1.0);
+      levelSet->SetMaximumRMSError(0.0);
+      levelSet->SetNumberOfIterations(20);
+      levelSet->SetInput(smoothing->GetOutput());
+      levelSet->SetFeatureImage(sigmoid->GetOutput());
+      levelSet->Update();
+      this->image = levelSet->GetOutput();
+    }
+    else
+    {
+      this->image = smoothing->GetOutput();
+    }
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Topology preserving smoothing failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Topology preserving smoothing succeeded!\n";
+#endif
+  return true;
+}
+
+/// crop
+///
+/// crops the image to the region of the given size starting at the given index
+///
+/// \param start       starting index of the region to keep
+/// \param size        size of the region to keep
+bool Image::crop(const ImageType::IndexType &start, const Dims &size)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+
+  using FilterType = itk::ExtractImageFilter<ImageType, ImageType>;
+  FilterType::Pointer filter = FilterType::New();
+  filter->SetExtractionRegion(ImageType::RegionType(start, size));
+  filter->SetDirectionCollapseToIdentity();
+
+  filter->SetInput(this->image);
+  this->image = filter->GetOutput();
+
+  try
+  {
+    filter->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Crop image failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Crop image succeeded!\n";
+#endif
+  return true;
+}
+
+/// applyTranslation
+///
+/// resamples the image through the given translation, as done by TranslateShapeToImageOrigin
+///
+/// \param transform   translation to apply
+/// \param isBinary    antialias before and rebinarize after resampling [default false]
+bool Image::applyTranslation(const TransformType::Pointer transform, bool isBinary)
+{
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+  if (!transform)
+  {
+    std::cerr << "No transform given, so returning false." << std::endl;
+    return false;
+  }
+
+  if (isBinary && !antialias(50, 0.01f, 0))
+    return false;
+
+  using ResampleFilter = itk::ResampleImageFilter<ImageType, ImageType>;
+  ResampleFilter::Pointer resampler = ResampleFilter::New();
+  using InterpolatorType = itk::LinearInterpolateImageFunction<ImageType, double>;
+  resampler->SetInterpolator(InterpolatorType::New());
+  resampler->SetTransform(transform.GetPointer());
+  resampler->SetDefaultPixelValue(isBinary ? -1.0 : 0.0);
+  resampler->SetSize(image->GetLargestPossibleRegion().GetSize());
+  resampler->SetOutputOrigin(image->GetOrigin());
+  resampler->SetOutputDirection(image->GetDirection());
+  resampler->SetOutputSpacing(image->GetSpacing());
+  resampler->SetInput(this->image);
+  this->image = resampler->GetOutput();
+
+  try
+  {
+    resampler->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Apply translation failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+  if (isBinary)
+    return binarize(0.0);
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Apply translation succeeded!\n";
+#endif
+  return true;
+}
+
+/// resampleToRegion
+///
+/// resamples the image through the given transform (mapping output points to input points) directly into a
+/// region of the reference image's grid, so that a chain of alignments and a crop interpolate only once
+///
+/// \param transform   transform to apply
+/// \param reference   image whose grid (origin, spacing, direction) the output uses
+/// \param start       starting index of the output region in the reference grid
+/// \param size        size of the output region, the whole reference region if zero
+/// \param isBinary    antialias before and rebinarize after resampling [default false]
+bool Image::resampleToRegion(const AffineTransformType::Pointer transform, const Image &reference,
+                             const ImageType::IndexType &start, const Dims &size, bool isBinary)
+{
+  if (!this->image || !reference.image)
+  {
+    std::cerr << "No image loaded, so returning false." << std::endl;
+    return false;
+  }
+  if (!transform)
+  {
+    std::cerr << "No transform given, so returning false." << std::endl;
+    return false;
+  }
+
+  Dims outputSize = size;
+  ImageType::IndexType outputStart = start;
+  if (outputSize[0] == 0 || outputSize[1] == 0 || outputSize[2] == 0)
+  {
+    outputSize = reference.image->GetLargestPossibleRegion().GetSize();
+    outputStart = reference.image->GetLargestPossibleRegion().GetIndex();
+  }
+  Point3 outputOrigin;
+  reference.image->TransformIndexToPhysicalPoint(outputStart, outputOrigin);
+
+  if (isBinary && !antialias(50, 0.01f, 0))
+    return false;
+
+  using ResampleFilter = itk::ResampleImageFilter<ImageType, ImageType>;
+  ResampleFilter::Pointer resampler = ResampleFilter::New();
+  using InterpolatorType = itk::LinearInterpolateImageFunction<ImageType, double>;
+  resampler->SetInterpolator(InterpolatorType::New());
+  resampler->SetTransform(transform.GetPointer());
+  resampler->SetDefaultPixelValue(isBinary ? -1.0 : 0.0);
+  resampler->SetSize(outputSize);
+  resampler->SetOutputOrigin(outputOrigin);
+  resampler->SetOutputDirection(reference.image->GetDirection());
+  resampler->SetOutputSpacing(reference.image->GetSpacing());
+  resampler->SetInput(this->image);
+  this->image = resampler->GetOutput();
+
+  try
+  {
+    resampler->Update();
+  }
+  catch (itk::ExceptionObject &exp)
+  {
+    std::cerr << "Resample to region failed:" << std::endl;
+    std::cerr << exp << std::endl;
+    return false;
+  }
+
+  if (isBinary)
+    return binarize(0.0);
+
+#if DEBUG_CONSOLIDATION
+  std::cout << "Resample to region succeeded!\n";
+#endif
+  return true;
+}
+
+/// centerOfMass
+///
+/// physical coordinates of the center of mass of the voxels labeled 1 in a binary image
+Point3 Image::centerOfMass() const
+{
+  Point3 com;
+  com.Fill(0.0);
+
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning origin." << std::endl;
+    return com;
+  }
+
+  size_t numPixels = 0;
+  itk::ImageRegionConstIteratorWithIndex<ImageType> imageIt(image, image->GetLargestPossibleRegion());
+  for (; !imageIt.IsAtEnd(); ++imageIt)
+  {
+    if (imageIt.Get() == 1.0)
+    {
+      Point3 point;
+      image->TransformIndexToPhysicalPoint(imageIt.GetIndex(), point);
+      com[0] += point[0];
+      com[1] += point[1];
+      com[2] += point[2];
+      numPixels++;
+    }
+  }
+
+  if (numPixels > 0)
+  {
+    com[0] /= numPixels;
+    com[1] /= numPixels;
+    com[2] /= numPixels;
+  }
+  return com;
+}
+
+/// center
+///
+/// physical coordinates of the center of the image region
+Point3 Image::center() const
+{
+  Point3 center;
+  center.Fill(0.0);
+
+  if (!this->image)
+  {
+    std::cerr << "No image loaded, so returning origin." << std::endl;
+    return center;
+  }
+
+  ImageType::RegionType region = image->GetLargestPossibleRegion();
+  itk::ContinuousIndex<double, dims> index;
+  for (unsigned i = 0; i < dims; i++)
+    index[i] = region.GetIndex()[i] + (region.GetSize()[i] - 1) / 2.0;
+  image->TransformContinuousIndexToPhysicalPoint(index, center);
+  return center;
+}
+
+} // Shapeworks
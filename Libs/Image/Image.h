@@ -4,6 +4,7 @@
 #include "ImageUtils.h"
 #include <limits>
 #include <itkTranslationTransform.h>
+#include <itkAffineTransform.h>
 
 namespace shapeworks {
 
@@ -13,9 +14,12 @@ public:
   static const unsigned dims = 3;
   using PixelType = float;
   using ImageType = itk::Image<PixelType, dims>;
+  using TransformType = itk::TranslationTransform<double, dims>;
+  using AffineTransformType = itk::AffineTransform<double, dims>;
 
   Image() {}
   Image(const std::string &inFilename) { read(inFilename); }
+  Image(const ImageType::Pointer image) : image(image) {}
 
   bool read(const std::string &inFilename);
   bool write(const std::string &outFilename, bool useCompression = true);
@@ -26,8 +30,27 @@ public:
   bool recenter();
   bool isoresample(double isoSpacing = 1.0f, Dims outputSize = Dims());
   bool pad(int padding, PixelType value);
+  bool extractLabel(PixelType label = 1.0);
+  bool closeHoles();
+  bool threshold(PixelType min = std::numeric_limits<PixelType>::lowest(),
+                 PixelType max = std::numeric_limits<PixelType>::max(),
+                 PixelType inside = itk::NumericTraits<PixelType>::One,
+                 PixelType outside = itk::NumericTraits<PixelType>::Zero);
+  bool fastMarch(PixelType isoValue = 0.0);
+  bool signedDistance(PixelType isoValue = 0.0, unsigned numThreads = 0);
+  bool topologyPreservingSmooth(unsigned smoothingIterations = 10, float scaling = 20.0, float alpha = 10.5, float beta = 10.0, bool levelSetOutput = false);
+  bool crop(const ImageType::IndexType &start, const Dims &size);
+  bool applyTranslation(const TransformType::Pointer transform, bool isBinary = false);
+  bool resampleToRegion(const AffineTransformType::Pointer transform, const Image &reference,
+                        const ImageType::IndexType &start, const Dims &size, bool isBinary = false);
   // bool nextfunction(...);
 
+  Point3 centerOfMass() const;
+  Point3 center() const;
+
+  /// the underlying itk image, shared rather than copied (ex: for the python bindings)
+  ImageType::Pointer getITKImage() const { return image; }
+
   bool compare_equal(const Image &other);
 
 private:
@@ -33,6 +33,9 @@ public:
   /// Compare if scalars in two meshes are equal
   bool compare_scalars_equal(const Mesh& other_mesh);
 
+  /// the underlying vtk mesh, shared rather than copied (ex: for the python bindings)
+  vtkSmartPointer<vtkPolyData> getVTKMesh() const { return poly_data_; }
+
 private:
   vtkSmartPointer<vtkPolyData> poly_data_;
 };
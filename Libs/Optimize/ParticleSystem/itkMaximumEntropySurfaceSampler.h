@@ -345,6 +345,15 @@ public:
     unsigned int GetVerbosity()
     { return m_verbosity; }
 
+    /** Half width, in voxels, of the band around the surface the domains keep
+        their gradient, Hessian and curvature images in (0 keeps them dense).
+        See ParticleImageDomain::SetNarrowBand. */
+    void SetNarrowBand(double band)
+    { m_NarrowBand = band; }
+
+    double GetNarrowBand() const
+    { return m_NarrowBand; }
+
     MeanCurvatureCacheType *GetMeanCurvatureCache()
     {   return  m_MeanCurvatureCache.GetPointer();  }
 
@@ -433,6 +442,7 @@ private:
     std::vector< std::vector<SphereType> > m_Spheres;
 
     unsigned int m_verbosity;
+    double m_NarrowBand;
 
 };
 
@@ -29,6 +29,7 @@ MaximumEntropySurfaceSampler<TImage>::MaximumEntropySurfaceSampler()
 {
     m_AdaptivityMode = 0;
     m_Initializing = false;
+    m_NarrowBand = 0.0;
 
     m_PrefixTransformFile = "";
     m_TransformFile = "";
@@ -104,6 +105,8 @@ MaximumEntropySurfaceSampler<TImage>::AllocateDomainsAndNeighborhoods()
 
         m_DomainList[i]->SetSigma(img_temp->GetSpacing()[0] * 2.0);
 
+        m_DomainList[i]->SetNarrowBand(m_NarrowBand);
+
         m_DomainList[i]->SetImage(img_temp);
 
         if (m_CuttingPlanes.size() > i)
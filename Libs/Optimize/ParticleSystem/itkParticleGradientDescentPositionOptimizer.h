@@ -124,6 +124,9 @@ public:
   /** Get/Set the precision of the solution. */
   itkGetMacro(Tolerance, double);
   itkSetMacro(Tolerance, double);
+
+  /** Get the largest distance a particle moved during the last iteration. */
+  itkGetMacro(MaxChange, double);
   
   /** Get/Set the ParticleSystem modified by this optimizer. */
   itkGetObjectMacro(ParticleSystem, ParticleSystemType);
@@ -151,6 +154,7 @@ private:
   unsigned int m_NumberOfIterations;
   unsigned int m_MaximumNumberOfIterations;
   double m_Tolerance;
+  double m_MaxChange;
   double m_TimeStep;
   int m_OptimizationMode;
   std::vector< std::vector<double> > m_TimeSteps;
@@ -40,6 +40,7 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
     m_NumberOfIterations = 0;
     m_MaximumNumberOfIterations = 0;
     m_Tolerance = 0.0;
+    m_MaxChange = 0.0;
     m_TimeStep = 1.0;
     m_OptimizationMode = 0;
 }
@@ -104,7 +105,7 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
     }
     time_t timerBefore, timerAfter;
 
-    double maxchange = 0.0;
+    std::vector<double> maxchange(numdomains);
     while (m_StopOptimization == false) // iterations loop
     {
         m_GradientFunction->SetParticleSystem(m_ParticleSystem);
@@ -153,7 +154,7 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
 
                     // Iterate over each particle position
                     unsigned int k = 0;
-                    maxchange = 0.0;
+                    maxchange[dom] = 0.0;
                     typename ParticleSystemType::PointContainerType::ConstIterator endit =
                             m_ParticleSystem->GetPositions(dom)->GetEnd();
                     for (typename ParticleSystemType::PointContainerType::ConstIterator it
@@ -208,7 +209,7 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
                                     meantime[dom] += m_TimeSteps[dom][k];
                                     m_TimeSteps[dom][k] *= factor;
                                     if (m_TimeSteps[dom][k] > maxtime[dom]) m_TimeSteps[dom][k] = maxtime[dom];
-                                    if (gradmag > maxchange) maxchange = gradmag;
+                                    if (gradmag > maxchange[dom]) maxchange[dom] = gradmag;
                                     done = true;
                                 }
                                 else
@@ -241,6 +242,12 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
             }// for each domain
         }
 
+        m_MaxChange = 0.0;
+        for (unsigned int dom = 0; dom < numdomains; dom++)
+        {
+            if (maxchange[dom] > m_MaxChange) m_MaxChange = maxchange[dom];
+        }
+
         m_NumberOfIterations++;
         m_GradientFunction->AfterIteration();
 
@@ -257,10 +264,8 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
         // Check for convergence.  Optimization is considered to have converged if
         // max number of iterations is reached or maximum distance moved by any
         // particle is less than the specified precision.
-        //    std::cout << "maxchange = " << maxchange << std::endl;
-
         if ((m_NumberOfIterations >= m_MaximumNumberOfIterations)
-                || (m_Tolerance > 0.0 &&  maxchange <  m_Tolerance))
+                || (m_Tolerance > 0.0 &&  m_MaxChange <  m_Tolerance))
         {
             m_StopOptimization = true;
         }
@@ -294,6 +299,7 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
 
         m_GradientFunction->BeforeIteration();
         double maxdt;
+        m_MaxChange = 0.0;
 
         // Iterate over each domain
         for (unsigned int dom = 0; dom < m_ParticleSystem->GetNumberOfDomains(); dom++)
@@ -324,6 +330,8 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
                     // Hack to avoid blowing up under certain conditions.
                     if (gradient.magnitude() > maxdt)
                     { gradient = (gradient / gradient.magnitude()) * maxdt; }
+                    if (gradient.magnitude() * m_TimeStep > m_MaxChange)
+                    { m_MaxChange = gradient.magnitude() * m_TimeStep; }
 
                     // Compute particle move based on update.
                     for (unsigned int i = 0; i < VDimension; i++)
@@ -356,7 +364,8 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
         // Check for convergence.  Optimization is considered to have converged if
         // max number of iterations is reached or maximum distance moved by any
         // particle is less than the specified precision.
-        if (m_NumberOfIterations >= m_MaximumNumberOfIterations)
+        if ((m_NumberOfIterations >= m_MaximumNumberOfIterations)
+                || (m_Tolerance > 0.0 &&  m_MaxChange <  m_Tolerance))
         {
             m_StopOptimization = true;
         }
@@ -399,6 +408,7 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
 
         m_GradientFunction->BeforeIteration();
         double maxdt;
+        m_MaxChange = 0.0;
 
         // Iterate over each domain
         for (unsigned int dom = 0; dom < m_ParticleSystem->GetNumberOfDomains(); dom++)
@@ -429,6 +439,10 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
                     {
                         gradient = (gradient / gradient.magnitude()) * maxdt;
                     }
+                    if (gradient.magnitude() * m_TimeStep > m_MaxChange)
+                    {
+                        m_MaxChange = gradient.magnitude() * m_TimeStep;
+                    }
 
                     // Compute particle move based on update.
                     for (unsigned int i = 0; i < VDimension; i++)
@@ -477,7 +491,8 @@ ParticleGradientDescentPositionOptimizer<TGradientNumericType, VDimension>
         // Check for convergence.  Optimization is considered to have converged if
         // max number of iterations is reached or maximum distance moved by any
         // particle is less than the specified precision.
-        if (m_NumberOfIterations >= m_MaximumNumberOfIterations)
+        if ((m_NumberOfIterations >= m_MaximumNumberOfIterations)
+                || (m_Tolerance > 0.0 &&  m_MaxChange <  m_Tolerance))
         {
             m_StopOptimization = true;
         }
@@ -126,9 +126,18 @@ public:
 
   /** Allow public access to the scalar interpolator. */
   itkGetObjectMacro(ScalarInterpolator, ScalarInterpolatorType);
+
+  /** Set/Get the half width, in voxels, of the band around the surface in
+      which the images derived from the distance transform (gradients,
+      Hessians, curvature) are kept.  They are stored sparsely (see
+      ParticleNarrowBandImage) instead of as dense images, which is most of
+      the memory of a domain.  0, the default, keeps dense images.  This must
+      be set before SetImage. */
+  itkSetMacro(NarrowBand, double);
+  itkGetConstMacro(NarrowBand, double);
   
 protected:
-  ParticleImageDomain()
+  ParticleImageDomain() : m_NarrowBand(0.0)
   {
     m_ScalarInterpolator = ScalarInterpolatorType::New();
   }
@@ -139,6 +148,7 @@ protected:
     
     os << indent << "m_Image = " << m_Image << std::endl;
     os << indent << "m_ScalarInterpolator = " << m_ScalarInterpolator << std::endl;
+    os << indent << "m_NarrowBand = " << m_NarrowBand << std::endl;
   }
   virtual ~ParticleImageDomain() {};
   
@@ -148,6 +158,7 @@ private:
 
   typename ImageType::Pointer m_Image;
   typename ScalarInterpolatorType::Pointer m_ScalarInterpolator;
+  double m_NarrowBand;
 };
 
 } // end namespace itk
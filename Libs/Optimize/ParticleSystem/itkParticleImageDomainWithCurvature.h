@@ -100,12 +100,26 @@ public:
     
     // Release the memory in the parent hessian images.
     //this->DeletePartialDerivativeImages();
+
+    if (this->GetNarrowBand() > 0.0)
+      {
+      m_NarrowBandCurvature.Allocate(this->GetImage(), this->GetNarrowBand());
+      m_NarrowBandCurvature.Fill(m_CurvatureImage);
+      m_CurvatureImage = 0;
+      return;
+      }
     
     m_CurvatureInterpolator->SetInputImage(m_CurvatureImage);
   } // end setimage
   
   double GetCurvature(const PointType &pos) const
   {
+    if (this->GetNarrowBand() > 0.0)
+      {
+      if (m_NarrowBandCurvature.IsInsideBand(pos))
+        return m_NarrowBandCurvature.Evaluate(pos);
+      return 1.0e-6;
+      }
     return m_CurvatureInterpolator->Evaluate(pos);
   }
   
@@ -180,6 +194,7 @@ private:
   // Curvature values are stored in an image
   typename ImageType::Pointer m_CurvatureImage;
   typename ScalarInterpolatorType::Pointer m_CurvatureInterpolator;
+  ParticleNarrowBandImage<T, VDimension> m_NarrowBandCurvature;
 };
 
 } // end namespace itk
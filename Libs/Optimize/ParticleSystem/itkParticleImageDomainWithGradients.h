@@ -18,6 +18,7 @@
 #include "itkImage.h"
 #include "itkImageDuplicator.h"
 #include "itkParticleImageDomain.h"
+#include "itkParticleNarrowBandImage.h"
 #include "itkVectorLinearInterpolateImageFunction.h"
 #include "itkGradientImageFilter.h"
 #include "itkFixedArray.h"
@@ -78,6 +79,16 @@ public:
     filter->SetInput(I);
     filter->SetUseImageSpacingOn();
     filter->Update();
+
+    if (this->GetNarrowBand() > 0.0)
+      {
+      // Only keep the gradients near the surface.
+      m_NarrowBandGradient.Allocate(I, this->GetNarrowBand());
+      m_NarrowBandGradient.Fill(filter->GetOutput());
+      m_GradientImage = 0;
+      return;
+      }
+
     m_GradientImage = filter->GetOutput();
     
     m_GradientInterpolator->SetInputImage(m_GradientImage);
@@ -92,7 +103,15 @@ public:
   inline VectorType SampleGradient(const PointType &p) const
   {
       if(this->IsInsideBuffer(p))
+        {
+        if (this->GetNarrowBand() > 0.0)
+          {
+          if (m_NarrowBandGradient.IsInsideBand(p))
+            return m_NarrowBandGradient.Evaluate(p);
+          return this->SampleGradientByDifferences(p);
+          }
         return  m_GradientInterpolator->Evaluate(p);
+        }
       else {
           itkExceptionMacro("Gradient queried for a Point, " << p << ", outside the given image domain." );
          VectorType g(1.0e-5);
@@ -146,6 +165,7 @@ public:
     Superclass::DeleteImages();
     m_GradientImage = 0;
     m_GradientInterpolator = 0;
+    m_NarrowBandGradient.Clear();
   }
   
 protected:
@@ -162,12 +182,30 @@ protected:
   }
   virtual ~ParticleImageDomainWithGradients() {};
   
+  /** Central differences of the distance transform, for the points outside
+      the narrow band. */
+  VectorType SampleGradientByDifferences(const PointType &p) const
+  {
+    VectorType g;
+    for (unsigned int i = 0; i < VDimension; i++)
+      {
+      const double h = this->GetImage()->GetSpacing()[i];
+      PointType a = p;
+      PointType b = p;
+      a[i] -= h;
+      b[i] += h;
+      g[i] = (this->Sample(b) - this->Sample(a)) / (2.0 * h);
+      }
+    return g;
+  }
+
 private:
   ParticleImageDomainWithGradients(const Self&); //purposely not implemented
   void operator=(const Self&); //purposely not implemented
 
   typename GradientImageType::Pointer m_GradientImage;
   typename GradientInterpolatorType::Pointer m_GradientInterpolator;
+  ParticleNarrowBandImage<typename GradientImageType::PixelType, VDimension> m_NarrowBandGradient;
 };
 
 } // end namespace itk
@@ -78,6 +78,14 @@ public:
     gaussian->SetInput(this->GetImage());
     gaussian->SetUseImageSpacingOn();
     gaussian->Update();
+
+    if (this->GetNarrowBand() > 0.0)
+      {
+      // The partial derivatives share the band of the distance transform.
+      m_NarrowBandPartials[0].Allocate(this->GetImage(), this->GetNarrowBand());
+      for (unsigned int k = 1; k < NumberOfPartials; k++)
+        m_NarrowBandPartials[k] = m_NarrowBandPartials[0];
+      }
     
     // Compute the second derivatives and set up the interpolators
     for (unsigned int i = 0; i < VDimension; i++)
@@ -90,10 +98,7 @@ public:
       deriv->SetUseImageSpacingOn();
       deriv->Update();
 
-      m_PartialDerivatives[i] = deriv->GetOutput();
-
-      m_Interpolators[i] = ScalarInterpolatorType::New();
-      m_Interpolators[i]->SetInputImage(m_PartialDerivatives[i]);
+      this->SetPartialDerivative(i, deriv->GetOutput());
       }
 
     // Compute the cross derivatives and set up the interpolators
@@ -119,9 +124,7 @@ public:
         
         deriv2->Update();
         
-        m_PartialDerivatives[k] = deriv2->GetOutput();
-        m_Interpolators[k] = ScalarInterpolatorType::New();
-        m_Interpolators[k]->SetInputImage(m_PartialDerivatives[k]);
+        this->SetPartialDerivative(k, deriv2->GetOutput());
         }
       }
   } // end setimage
@@ -133,7 +136,7 @@ public:
   {
     VnlMatrixType ans;
     for (unsigned int i = 0; i < VDimension; i++)
-      {      ans[i][i] = m_Interpolators[i]->Evaluate(p);      }
+      {      ans[i][i] = this->SamplePartialDerivative(i, p);      }
     
     // Cross derivatives
     unsigned int k = VDimension;
@@ -141,7 +144,7 @@ public:
       {
       for (unsigned int j = i+1; j < VDimension; j++, k++)
         {
-        ans[i][j] = ans[j][i] = m_Interpolators[k]->Evaluate(p);
+        ans[i][j] = ans[j][i] = this->SamplePartialDerivative(k, p);
         }
       }
     return ans;
@@ -156,10 +159,11 @@ public:
 
   void DeletePartialDerivativeImages()
   {
-    for (unsigned int i = 0; i < VDimension + ((VDimension * VDimension) - VDimension) / 2; i++)
+    for (unsigned int i = 0; i < NumberOfPartials; i++)
       {
       m_PartialDerivatives[i]=0;
       m_Interpolators[i]=0;
+      m_NarrowBandPartials[i].Clear();
       }
   }
 
@@ -170,7 +174,8 @@ public:
     this->DeletePartialDerivativeImages();
   }
 
-  /** Access interpolators and partial derivative images. */
+  /** Access interpolators and partial derivative images (these are null
+      when the partial derivatives are kept in a narrow band). */
   typename ScalarInterpolatorType::Pointer *GetInterpolators()
   { return m_Interpolators; }
   typename ImageType::Pointer *GetPartialDerivatives()
@@ -188,8 +193,30 @@ protected:
   }
   virtual ~ParticleImageDomainWithHessians() {};
 
+  /** Partial derivative k at p, zero outside the narrow band. */
+  inline T SamplePartialDerivative(unsigned int k, const PointType &p) const
+  {
+    if (this->GetNarrowBand() > 0.0)
+      return m_NarrowBandPartials[k].Evaluate(p);
+    return m_Interpolators[k]->Evaluate(p);
+  }
+
+  void SetPartialDerivative(unsigned int k, ImageType *image)
+  {
+    if (this->GetNarrowBand() > 0.0)
+      {
+      m_NarrowBandPartials[k].Fill(image);
+      return;
+      }
+    m_PartialDerivatives[k] = image;
+    m_Interpolators[k] = ScalarInterpolatorType::New();
+    m_Interpolators[k]->SetInputImage(m_PartialDerivatives[k]);
+  }
+
   
 private:
+  static const unsigned int NumberOfPartials = VDimension + ((VDimension * VDimension) - VDimension) / 2;
+
   double m_Sigma;
   
   ParticleImageDomainWithHessians(const Self&); //purposely not implemented
@@ -203,6 +230,8 @@ private:
   typename ImageType::Pointer  m_PartialDerivatives[ VDimension + ((VDimension * VDimension) - VDimension) / 2];
 
   typename ScalarInterpolatorType::Pointer m_Interpolators[VDimension + ((VDimension * VDimension) - VDimension) / 2];
+
+  ParticleNarrowBandImage<T, VDimension> m_NarrowBandPartials[VDimension + ((VDimension * VDimension) - VDimension) / 2];
 };
 
 } // end namespace itk
@@ -0,0 +1,235 @@
+/*=========================================================================
+  Program:   ShapeWorks: Particle-based Shape Correspondence & Visualization
+
+  Copyright (c) 2009 Scientific Computing and Imaging Institute.
+  See ShapeWorksLicense.txt for details.
+
+     This software is distributed WITHOUT ANY WARRANTY; without even
+     the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+     PURPOSE.  See the above copyright notices for more information.
+=========================================================================*/
+#ifndef __itkParticleNarrowBandImage_h
+#define __itkParticleNarrowBandImage_h
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+#include "itkImage.h"
+#include "itkImageRegionConstIteratorWithIndex.h"
+#include "itkNumericTraits.h"
+
+namespace itk
+{
+/** \class ParticleNarrowBandImage
+ *
+ * Blocked sparse storage for the voxels of an image that lie within a narrow
+ * band around the zero level set of a distance transform.  The image is
+ * divided into blocks of BlockSize^VDimension voxels and only the blocks
+ * holding band voxels are allocated, so memory grows with the area of the
+ * surface rather than with the volume of the image.  Values are interpolated
+ * linearly, as LinearInterpolateImageFunction does, wherever all the voxels
+ * around a point are stored (see IsInsideBand).
+ *
+ * \sa ParticleImageDomain::SetNarrowBand
+ */
+template <class TPixel, unsigned int VDimension=3>
+class ParticleNarrowBandImage
+{
+public:
+  typedef Image<TPixel, VDimension> ImageType;
+  typedef Point<double, VDimension> PointType;
+  typedef typename NumericTraits<TPixel>::ValueType ValueType;
+
+  /** Width of the blocks, in voxels. */
+  static const unsigned int BlockSize = 8;
+
+  ParticleNarrowBandImage() : m_NumberOfBlocks(0) {}
+
+  /** Chooses the blocks to store: those holding a voxel of distance within
+      bandWidth voxels of the zero level set, or next to one (so that the
+      points between band voxels can be interpolated). */
+  template <class TDistanceImage>
+  void Allocate(const TDistanceImage *distance, double bandWidth)
+  {
+    m_Geometry = ImageType::New();
+    m_Geometry->CopyInformation(distance);
+    m_Region = distance->GetBufferedRegion();
+
+    const typename TDistanceImage::SpacingType &spacing = distance->GetSpacing();
+    double minSpacing = spacing[0];
+    for (unsigned int i = 1; i < VDimension; i++)
+      minSpacing = std::min(minSpacing, static_cast<double>(spacing[i]));
+    const double band = bandWidth * minSpacing;
+
+    unsigned long totalBlocks = 1;
+    for (unsigned int i = 0; i < VDimension; i++)
+      {
+      m_BlocksPerDimension[i] = (m_Region.GetSize()[i] + BlockSize - 1) / BlockSize;
+      totalBlocks *= m_BlocksPerDimension[i];
+      }
+    m_BlockTable.assign(totalBlocks, -1);
+    m_NumberOfBlocks = 0;
+
+    ImageRegionConstIteratorWithIndex<TDistanceImage> it(distance, m_Region);
+    for (; !it.IsAtEnd(); ++it)
+      {
+      if (std::abs(it.Get()) > band)
+        continue;
+      // mark the blocks of the voxel's neighbors, which include its own
+      for (unsigned int corner = 0; corner < (1u << VDimension); corner++)
+        {
+        IndexType idx = it.GetIndex();
+        for (unsigned int i = 0; i < VDimension; i++)
+          {
+          idx[i] += (corner & (1u << i)) ? 1 : -1;
+          idx[i] = std::max(idx[i], m_Region.GetIndex()[i]);
+          idx[i] = std::min(idx[i], m_Region.GetIndex()[i] + static_cast<IndexValueType>(m_Region.GetSize()[i]) - 1);
+          }
+        long &entry = m_BlockTable[this->BlockNumber(idx)];
+        if (entry < 0)
+          entry = m_NumberOfBlocks++;
+        }
+      }
+    m_Data.clear();
+    m_Data.shrink_to_fit();
+  }
+
+  /** Copies the band voxels of image, which must have the geometry of the
+      distance transform given to Allocate. */
+  void Fill(const ImageType *image)
+  {
+    m_Data.assign(m_NumberOfBlocks * VoxelsPerBlock(), NumericTraits<TPixel>::ZeroValue(TPixel()));
+    ImageRegionConstIteratorWithIndex<ImageType> it(image, m_Region);
+    for (; !it.IsAtEnd(); ++it)
+      {
+      long offset = this->Offset(it.GetIndex());
+      if (offset >= 0)
+        m_Data[offset] = it.Get();
+      }
+  }
+
+  /** Whether the voxels needed to interpolate at p are stored. */
+  bool IsInsideBand(const PointType &p) const
+  {
+    IndexType base;
+    double weights[VDimension];
+    return this->Corners(p, base, weights);
+  }
+
+  /** Interpolates the image at p, a point inside the band. */
+  TPixel Evaluate(const PointType &p) const
+  {
+    IndexType base;
+    double weights[VDimension];
+    TPixel value = NumericTraits<TPixel>::ZeroValue(TPixel());
+    if (!this->Corners(p, base, weights))
+      return value;
+
+    for (unsigned int corner = 0; corner < (1u << VDimension); corner++)
+      {
+      IndexType idx = base;
+      double w = 1.0;
+      for (unsigned int i = 0; i < VDimension; i++)
+        {
+        if (corner & (1u << i))
+          {
+          idx[i] = std::min(idx[i] + 1, m_Region.GetIndex()[i] + static_cast<IndexValueType>(m_Region.GetSize()[i]) - 1);
+          w *= weights[i];
+          }
+        else
+          w *= 1.0 - weights[i];
+        }
+      if (w != 0.0)
+        value += m_Data[this->Offset(idx)] * static_cast<ValueType>(w);
+      }
+    return value;
+  }
+
+  /** Number of voxels stored. */
+  unsigned long GetNumberOfStoredVoxels() const
+  { return m_NumberOfBlocks * VoxelsPerBlock(); }
+
+  /** Releases the storage. */
+  void Clear()
+  {
+    m_Data.clear();
+    m_Data.shrink_to_fit();
+    m_BlockTable.clear();
+    m_BlockTable.shrink_to_fit();
+    m_NumberOfBlocks = 0;
+    m_Geometry = 0;
+  }
+
+private:
+  typedef typename ImageType::IndexType IndexType;
+  typedef typename IndexType::IndexValueType IndexValueType;
+
+  static unsigned long VoxelsPerBlock()
+  {
+    unsigned long voxels = 1;
+    for (unsigned int i = 0; i < VDimension; i++)
+      voxels *= BlockSize;
+    return voxels;
+  }
+
+  unsigned long BlockNumber(const IndexType &idx) const
+  {
+    unsigned long block = 0;
+    for (int i = VDimension - 1; i >= 0; i--)
+      block = block * m_BlocksPerDimension[i] + (idx[i] - m_Region.GetIndex()[i]) / BlockSize;
+    return block;
+  }
+
+  /** Position of a voxel in m_Data, or -1 if its block isn't stored. */
+  long Offset(const IndexType &idx) const
+  {
+    long block = m_BlockTable[this->BlockNumber(idx)];
+    if (block < 0)
+      return -1;
+    long inBlock = 0;
+    for (int i = VDimension - 1; i >= 0; i--)
+      inBlock = inBlock * BlockSize + (idx[i] - m_Region.GetIndex()[i]) % BlockSize;
+    return block * VoxelsPerBlock() + inBlock;
+  }
+
+  /** Finds the voxel below p and the interpolation weights along each
+      dimension, returns false if p is outside the image or any voxel around
+      it isn't stored. */
+  bool Corners(const PointType &p, IndexType &base, double *weights) const
+  {
+    if (!m_Geometry)
+      return false;
+    ContinuousIndex<double, VDimension> cidx;
+    m_Geometry->TransformPhysicalPointToContinuousIndex(p, cidx);
+    for (unsigned int i = 0; i < VDimension; i++)
+      {
+      const IndexValueType first = m_Region.GetIndex()[i];
+      const IndexValueType last = first + static_cast<IndexValueType>(m_Region.GetSize()[i]) - 1;
+      if (cidx[i] < first || cidx[i] > last)
+        return false;
+      base[i] = static_cast<IndexValueType>(std::floor(cidx[i]));
+      weights[i] = cidx[i] - base[i];
+      }
+    for (unsigned int corner = 0; corner < (1u << VDimension); corner++)
+      {
+      IndexType idx = base;
+      for (unsigned int i = 0; i < VDimension; i++)
+        if (corner & (1u << i))
+          idx[i] = std::min(idx[i] + 1, m_Region.GetIndex()[i] + static_cast<IndexValueType>(m_Region.GetSize()[i]) - 1);
+      if (m_BlockTable[this->BlockNumber(idx)] < 0)
+        return false;
+      }
+    return true;
+  }
+
+  typename ImageType::Pointer m_Geometry;
+  typename ImageType::RegionType m_Region;
+  unsigned long m_BlocksPerDimension[VDimension];
+  std::vector<long> m_BlockTable;
+  long m_NumberOfBlocks;
+  std::vector<TPixel> m_Data;
+};
+
+} // end namespace itk
+
+#endif
@@ -15,11 +15,58 @@
 #ifndef __itkParticlePositionReader_txx
 #define __itkParticlePositionReader_txx
 
+#include <cstring>
 #include <fstream>
+#include <stdint.h>
 #include "itkParticlePositionReader.h"
 namespace itk
 {
 
+template <unsigned int VDimension>
+bool ParticlePositionReader<VDimension>::ReadBinary()
+{
+  std::ifstream in( m_FileName.c_str(), std::ios::binary );
+  char magic[8];
+  if ( !in.read(magic, 8) || std::memcmp(magic, "SWPARTS", 8) != 0 )
+    {
+    return false;
+    }
+
+  // version, dimension, bytes per value, reserved, then the particle count
+  uint32_t header[4];
+  uint64_t count;
+  in.read(reinterpret_cast<char *>(header), sizeof(header));
+  in.read(reinterpret_cast<char *>(&count), sizeof(count));
+  if ( !in || header[0] != 1 || header[1] != VDimension || (header[2] != 4 && header[2] != 8) )
+    {
+    itkExceptionMacro("Unsupported binary point file: " << m_FileName.c_str());
+    }
+
+  std::vector<char> buffer(count * VDimension * header[2]);
+  in.read(buffer.data(), buffer.size());
+  if ( !in )
+    {
+    itkExceptionMacro("Truncated binary point file: " << m_FileName.c_str());
+    }
+  for (uint64_t i = 0; i < count; i++)
+    {
+    PointType pt;
+    for (unsigned int d = 0; d < VDimension; d++)
+      {
+      if (header[2] == 8)
+        {
+        pt[d] = reinterpret_cast<const double *>(buffer.data())[i * VDimension + d];
+        }
+      else
+        {
+        pt[d] = reinterpret_cast<const float *>(buffer.data())[i * VDimension + d];
+        }
+      }
+    m_Output.push_back(pt);
+    }
+  return true;
+}
+
 template <unsigned int VDimension>
 void ParticlePositionReader<VDimension>::Update()
 {
@@ -30,6 +77,10 @@ void ParticlePositionReader<VDimension>::Update()
     {
     itkExceptionMacro("Could not open point file for input: " << m_FileName.c_str());
     }
+  if ( this->ReadBinary() )
+    {
+    return;
+    }
 
   //  in >> num_points;
 
@@ -37,6 +37,9 @@ namespace itk
  * 4.0 8.21 4.44
  *
  * etc..
+ *
+ * Binary particle files (see Utils::writeBinaryParticles), which start with
+ * the magic "SWPARTS", are read as well.
  */
 template <unsigned int VDimension>
 class ITK_EXPORT ParticlePositionReader : public DataObject
@@ -74,6 +77,9 @@ public:
   void Update();
   
 protected:
+  /** Reads a binary particle file, returns false if the file isn't one. */
+  bool ReadBinary();
+
   ParticlePositionReader() { }
   void PrintSelf(std::ostream& os, Indent indent) const
   {
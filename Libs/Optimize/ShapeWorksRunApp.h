@@ -21,6 +21,7 @@
 
 #include <itkParticleSystem.h>
 #include <cstdio>
+#include <fstream>
 #include "itkImage.h"
 #include "itkMaximumEntropyCorrespondenceSampler.h"
 #include "itkCommand.h"
@@ -128,6 +129,7 @@ public:
     virtual void optimize_stop();
     void IterateCallback(itk::Object *, const itk::EventObject &);
     virtual void ComputeEnergyAfterIteration();
+    void WriteProgress();
     void SetCotanSigma();
 
     void PrintParamInfo();
@@ -171,6 +173,7 @@ protected:
     std::string m_prefix_transform_file;
     std::string m_output_dir;
     std::string m_output_transform_file;
+    unsigned int m_particle_bytes; // 0 writes text particle files
     bool m_mesh_based_attributes;
     std::vector<bool> m_use_xyz;
     std::vector<bool> m_use_normals;
@@ -190,8 +193,10 @@ protected:
     int m_iterations_per_split;
     double m_init_criterion;
     double m_opt_criterion;
+    double m_opt_update_tolerance;
     bool m_use_shape_statistics_in_init;
     unsigned int m_procrustes_interval;
+    double m_narrow_band;
     int m_procrustes_scaling;
     double m_relative_weighting;
     double m_initial_relative_weighting;
@@ -217,6 +222,9 @@ protected:
     std::vector<double> m_TotalEnergy;
     bool m_logEnergy;
     std::string m_strEnergy;
+    std::string m_progress_file;
+    std::ofstream m_progress;
+    bool m_early_stop;
 
     std::vector<std::vector<int> > m_badIds; //GoodBadAssessment
     double m_normalAngle; //GoodBadAssessment
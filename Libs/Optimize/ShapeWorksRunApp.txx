@@ -17,6 +17,8 @@
 #include <vector>
 #include <numeric>
 #include <algorithm>
+#include <cmath>
+#include <stdexcept>
 
 #ifdef _WIN32
 #include <direct.h>
@@ -76,6 +78,7 @@ ShapeWorksRunApp < SAMPLERTYPE > ::ShapeWorksRunApp(const char* fn) {
   m_optimizing = false;
   m_use_regression = false;
   m_use_mixed_effects = false;
+  m_early_stop = false;
 
   // Read parameter file
   this->startMessage("Reading i/o parameters...");
@@ -288,6 +291,22 @@ ShapeWorksRunApp < SAMPLERTYPE > ::ReadIOParameters(const char* fname) {
     elem = docHandle.FirstChild("output_transform_file").Element();
     if (elem) { this->m_output_transform_file = elem->GetText();}
 
+    // text (default), float32 or float64, see Utils::writeBinaryParticles
+    this->m_particle_bytes = 0;
+    elem = docHandle.FirstChild("particle_format").Element();
+    if (elem) {
+      std::istringstream inputsBuffer;
+      std::string format;
+      inputsBuffer.str(elem->GetText());
+      inputsBuffer >> format;
+      if (format == "float32") { this->m_particle_bytes = 4;}
+      else if (format == "float64") { this->m_particle_bytes = 8;}
+      else if (format != "text") {
+        std::cerr << "Unknown particle_format " << format << ", expected text, float32 or float64" << std::endl;
+        throw 1;
+      }
+    }
+
     this->m_mesh_based_attributes = false;
     elem = docHandle.FirstChild("mesh_based_attributes").Element();
     if (elem) { this->m_mesh_based_attributes = (bool) atoi(elem->GetText());}
@@ -410,6 +429,10 @@ ShapeWorksRunApp < SAMPLERTYPE > ::ReadOptimizationParameters(const char* fname)
     elem = docHandle.FirstChild("opt_criterion").Element();
     if (elem) { this->m_opt_criterion = atof(elem->GetText());}
 
+    m_opt_update_tolerance = 0.0;
+    elem = docHandle.FirstChild("opt_update_tolerance").Element();
+    if (elem) { this->m_opt_update_tolerance = atof(elem->GetText());}
+
     m_use_shape_statistics_in_init = false;
     elem = docHandle.FirstChild("use_shape_statistics_in_init").Element();
     if (elem) { this->m_use_shape_statistics_in_init = (bool) atoi(elem->GetText());}
@@ -418,6 +441,16 @@ ShapeWorksRunApp < SAMPLERTYPE > ::ReadOptimizationParameters(const char* fname)
     elem = docHandle.FirstChild("procrustes_interval").Element();
     if (elem) { this->m_procrustes_interval = atoi(elem->GetText());}
 
+    this->m_narrow_band = 0.0;     // 0 : dense gradient, Hessian and curvature images
+    elem = docHandle.FirstChild("narrow_band").Element();
+    if (elem) { this->m_narrow_band = atof(elem->GetText());}
+    // the curvature is computed within a distance of 4 of the surface, a narrower
+    // band would drop part of it and the optimization would differ from dense images
+    if (this->m_narrow_band != 0.0 && this->m_narrow_band < 4.0) {
+      std::cerr << "narrow_band must be 0 (dense images) or at least 4, got " << this->m_narrow_band << std::endl;
+      throw 1;
+    }
+
     this->m_procrustes_scaling = 1;
     elem = docHandle.FirstChild("procrustes_scaling").Element();
     if (elem) { this->m_procrustes_scaling = atoi(elem->GetText());}
@@ -483,6 +516,23 @@ ShapeWorksRunApp < SAMPLERTYPE > ::SetDebugParameters(const char* fname) {
     this->m_logEnergy = false;
     elem = docHandle.FirstChild("log_energy").Element();
     if (elem) { this->m_logEnergy = bool(atoi(elem->GetText()));}
+
+    this->m_progress_file = "";
+    elem = docHandle.FirstChild("progress_file").Element();
+    if (elem) {
+      std::istringstream inputsBuffer;
+      inputsBuffer.str(elem->GetText());
+      inputsBuffer >> this->m_progress_file;
+    }
+  }
+
+  if (!m_progress_file.empty()) {
+    // may be a named pipe, in which case this waits for the reader
+    m_progress.open(m_progress_file.c_str());
+    if (!m_progress) {
+      std::cerr << "Could not open progress file " << m_progress_file << std::endl;
+    }
+    m_progress.precision(10);
   }
 }
 
@@ -1223,6 +1273,7 @@ ShapeWorksRunApp < SAMPLERTYPE > ::InitializeSampler() {
   m_Sampler->SetCorrespondenceOn();
 
   m_Sampler->SetAdaptivityMode(m_adaptivity_mode);
+  m_Sampler->SetNarrowBand(m_narrow_band);
   m_Sampler->GetEnsembleEntropyFunction()
   ->SetRecomputeCovarianceInterval(m_recompute_regularization_interval);
   m_Sampler->GetMeshBasedGeneralEntropyGradientFunction()
@@ -1687,6 +1738,12 @@ ShapeWorksRunApp < SAMPLERTYPE > ::Optimize() {
   m_Sampler->Modified();
   m_Sampler->Update();
 
+  if (m_progress.is_open()) {
+    m_progress << "{\"stage\": \"finished\", \"iteration\": "
+               << m_Sampler->GetOptimizer()->GetNumberOfIterations() + m_optimization_iterations_completed
+               << ", \"early_stop\": " << (m_early_stop ? "true" : "false") << "}" << std::endl;
+  }
+
   this->WritePointFiles();
   this->WritePointFilesWithFeatures();
   this->WriteEnergyFiles();
@@ -1747,7 +1804,9 @@ ShapeWorksRunApp < SAMPLERTYPE > ::IterateCallback(itk::Object*, const itk::Even
     double val = std::abs(m_TotalEnergy[lnth - 1] - m_TotalEnergy[lnth - 2]) / std::abs(
       m_TotalEnergy[lnth - 2]);
     if ((m_optimizing == false && val < m_init_criterion) ||
-        (m_optimizing == true && val < m_opt_criterion)) {
+        (m_optimizing == true && val < m_opt_criterion) ||
+        (m_optimizing == true && m_opt_update_tolerance > 0.0 &&
+         m_Sampler->GetOptimizer()->GetMaxChange() < m_opt_update_tolerance)) {
       m_SaturationCounter++;
     }
     else {
@@ -1757,10 +1816,15 @@ ShapeWorksRunApp < SAMPLERTYPE > ::IterateCallback(itk::Object*, const itk::Even
       if (m_verbosity_level > 2) {
         std::cout << " \n ----Early termination due to minimal energy decay---- \n";
       }
+      if (m_optimizing == true) {
+        m_early_stop = true;
+      }
       this->optimize_stop();
     }
   }
 
+  this->WriteProgress();
+
   if (m_checkpointing_interval != 0 && m_disable_checkpointing == false) {
     m_CheckpointCounter++;
     if (m_CheckpointCounter == (int)m_checkpointing_interval) {
@@ -1855,6 +1919,34 @@ ShapeWorksRunApp < SAMPLERTYPE > ::ComputeEnergyAfterIteration() {
   }
 }
 
+template < class SAMPLERTYPE >
+void
+ShapeWorksRunApp < SAMPLERTYPE > ::WriteProgress() {
+  if (!m_progress.is_open() || m_TotalEnergy.empty()) {
+    return;
+  }
+  // one JSON record per line, flushed so that a reader sees each iteration as it ends
+  // non-finite values are written as null, JSON has no NaN or Infinity
+  auto number = [](double value) {
+    std::stringstream ss;
+    ss.precision(10);
+    if (std::isfinite(value)) { ss << value;}
+    else { ss << "null";}
+    return ss.str();
+  };
+  int iteration = m_Sampler->GetOptimizer()->GetNumberOfIterations();
+  if (m_optimizing == true) {
+    iteration += m_optimization_iterations_completed;
+  }
+  m_progress << "{\"stage\": \"" << m_strEnergy << "\", \"iteration\": " << iteration
+             << ", \"particles\": " << m_Sampler->GetParticleSystem()->GetNumberOfParticles()
+             << ", \"sampling\": " << number(m_EnergyA.back())
+             << ", \"correspondence\": " << number(m_EnergyB.back())
+             << ", \"total\": " << number(m_TotalEnergy.back())
+             << ", \"max_update\": " << number(m_Sampler->GetOptimizer()->GetMaxChange())
+             << "}" << std::endl;
+}
+
 template < class SAMPLERTYPE >
 void
 ShapeWorksRunApp < SAMPLERTYPE > ::SetCotanSigma() {
@@ -2058,6 +2150,7 @@ ShapeWorksRunApp < SAMPLERTYPE > ::PrintParamInfo() {
   std::cout << "m_iterations_per_split = " << m_iterations_per_split << std::endl;
   std::cout << "m_init_criterion = " << m_init_criterion << std::endl;
   std::cout << "m_opt_criterion = " << m_opt_criterion << std::endl;
+  std::cout << "m_opt_update_tolerance = " << m_opt_update_tolerance << std::endl;
   std::cout << "m_use_shape_statistics_in_init = " << m_use_shape_statistics_in_init << std::endl;
   std::cout << "m_procrustes_interval = " << m_procrustes_interval << std::endl;
   std::cout << "m_procrustes_scaling = " << m_procrustes_scaling << std::endl;
@@ -2159,6 +2252,30 @@ ShapeWorksRunApp < SAMPLERTYPE > ::WritePointFiles(std::string iter_prefix) {
     std::string local_file = iter_prefix + "/" + m_filenames[i] + "_local.particles";
     std::string world_file = iter_prefix + "/" + m_filenames[i] + "_world.particles";
 
+    if (m_particle_bytes > 0) {
+      std::string str = "Writing " + world_file + " and " + local_file + " files...";
+      this->startMessage(str, 1);
+      std::vector < double > local, world;
+      for (unsigned int j = 0; j < m_Sampler->GetParticleSystem()->GetNumberOfParticles(i); j++) {
+        PointType pos = m_Sampler->GetParticleSystem()->GetPosition(j, i);
+        PointType wpos = m_Sampler->GetParticleSystem()->GetTransformedPosition(j, i);
+        for (unsigned int k = 0; k < 3; k++) {
+          local.push_back(pos[k]);
+          world.push_back(wpos[k]);
+        }
+      }
+      try {
+        Utils::writeBinaryParticles(local_file, local, m_particle_bytes == 8);
+        Utils::writeBinaryParticles(world_file, world, m_particle_bytes == 8);
+      }
+      catch (std::runtime_error & e) {
+        std::cerr << "Error writing particle files: " << e.what() << std::endl;
+        throw 1;
+      }
+      this->doneMessage(1);
+      continue;
+    }
+
     std::ofstream out(local_file.c_str());
     std::ofstream outw(world_file.c_str());
 
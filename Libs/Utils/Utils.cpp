@@ -3,6 +3,9 @@
 
 #include <vtkMath.h>
 #include <cmath>
+#include <cstdint>
+#include <cstring>
+#include <fstream>
 #include <sstream>      // std::istringstream
 
 std::vector<int> Utils::randperm(int n)
@@ -28,10 +31,81 @@ std::vector<int> Utils::randperm(int n)
 
 // ------------------- IO ------------------------------------
 
+namespace
+{
+const char binaryParticlesMagic[8] = {'S', 'W', 'P', 'A', 'R', 'T', 'S', '\0'};
+const uint32_t binaryParticlesVersion = 1;
+}
+
+bool Utils::readBinaryParticles(const std::string& filename, std::vector<double>& coordinates)
+{
+    std::ifstream ifs(filename.c_str(), std::ios::binary);
+    if(!ifs.good())
+        throw std::runtime_error("Could not open file for input: " + filename);
+
+    char magic[8];
+    if(!ifs.read(magic, 8) || std::memcmp(magic, binaryParticlesMagic, 8) != 0)
+        return false;
+
+    uint32_t header[4];
+    uint64_t count;
+    ifs.read(reinterpret_cast<char*>(header), sizeof(header));
+    ifs.read(reinterpret_cast<char*>(&count), sizeof(count));
+    if(!ifs || header[0] != binaryParticlesVersion || header[1] != 3 || (header[2] != 4 && header[2] != 8))
+        throw std::runtime_error("Unsupported binary particle file: " + filename);
+
+    coordinates.resize(count * 3);
+    if(header[2] == 8)
+        ifs.read(reinterpret_cast<char*>(coordinates.data()), count * 3 * sizeof(double));
+    else
+    {
+        std::vector<float> values(count * 3);
+        ifs.read(reinterpret_cast<char*>(values.data()), count * 3 * sizeof(float));
+        std::copy(values.begin(), values.end(), coordinates.begin());
+    }
+    if(!ifs)
+        throw std::runtime_error("Truncated binary particle file: " + filename);
+    return true;
+}
+
+void Utils::writeBinaryParticles(const std::string& filename, const std::vector<double>& coordinates, bool doublePrecision)
+{
+    std::ofstream ofs(filename.c_str(), std::ios::binary);
+    if(!ofs.good())
+        throw std::runtime_error("Could not open file for output: " + filename);
+
+    uint32_t header[4] = {binaryParticlesVersion, 3, doublePrecision ? 8u : 4u, 0};
+    uint64_t count = coordinates.size() / 3;
+    ofs.write(binaryParticlesMagic, 8);
+    ofs.write(reinterpret_cast<const char*>(header), sizeof(header));
+    ofs.write(reinterpret_cast<const char*>(&count), sizeof(count));
+    if(doublePrecision)
+        ofs.write(reinterpret_cast<const char*>(coordinates.data()), coordinates.size() * sizeof(double));
+    else
+    {
+        std::vector<float> values(coordinates.begin(), coordinates.end());
+        ofs.write(reinterpret_cast<const char*>(values.data()), values.size() * sizeof(float));
+    }
+    if(!ofs)
+        throw std::runtime_error("Could not write file: " + filename);
+}
+
 void Utils::readSparseShape(vtkSmartPointer<vtkPoints>& points, char* filename, int number_of_particles)
 {
     points->Reset();
 
+    std::vector<double> coordinates;
+    if(Utils::readBinaryParticles(filename, coordinates))
+    {
+        size_t count = coordinates.size() / 3;
+        if(number_of_particles > 0)
+            count = std::min(count, static_cast<size_t>(number_of_particles));
+        for(size_t ii = 0; ii < count; ii++)
+            points->InsertNextPoint(coordinates[3*ii], coordinates[3*ii+1], coordinates[3*ii+2]);
+        std::cout << "total number of correspondences read: " << points->GetNumberOfPoints() << std::endl;
+        return;
+    }
+
     std::ifstream ifs;
     ifs.open(filename);
     if(!ifs.good())
@@ -75,6 +149,23 @@ void Utils::readSparseShape(vtkSmartPointer<vtkPoints>& points, char* filename,
 void Utils::readSparseShape(std::vector<itk::Point<double> > & points, char* filename, int number_of_particles)
 {
     points.clear();
+
+    std::vector<double> coordinates;
+    if(Utils::readBinaryParticles(filename, coordinates))
+    {
+        size_t count = coordinates.size() / 3;
+        if(number_of_particles > 0)
+            count = std::min(count, static_cast<size_t>(number_of_particles));
+        for(size_t ii = 0; ii < count; ii++)
+        {
+            itk::Point<double> p;
+            p[0] = coordinates[3*ii]; p[1] = coordinates[3*ii+1]; p[2] = coordinates[3*ii+2];
+            points.push_back(p);
+        }
+        std::cout << "total number of correspondences read: " << points.size() << std::endl;
+        return;
+    }
+
     std::ifstream ifs;
     ifs.open(filename);
     if(!ifs.good())
@@ -77,6 +77,13 @@ public:
     static std::vector<int> readParticleIds(char* filename);
     static void writeParticleIds(char* filename, std::vector<int> ids);
 
+    // binary particle files: a 32 byte header (the magic "SWPARTS\0", then the
+    // uint32 version, dimension and bytes per value (4 or 8), a reserved uint32
+    // and the uint64 number of particles) followed by the x y z of each particle,
+    // little endian. Readers of .particles files accept either this or text.
+    static bool readBinaryParticles(const std::string& filename, std::vector<double>& coordinates);
+    static void writeBinaryParticles(const std::string& filename, const std::vector<double>& coordinates, bool doublePrecision = false);
+
     //--------------- point cloud queries --------------------------------
     static void computeCenterOfMassForShapeEnsemble (std::vector< std::vector< itk::Point< double, 3 > > > points_list, itk::Point< double, 3 > & center);
     static void computeCenterOfMassForShape (std::vector< itk::Point< double, 3 > >  points, itk::Point< double, 3 > & center);
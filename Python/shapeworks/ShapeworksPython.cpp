@@ -0,0 +1,168 @@
+/*
+ * Python bindings for shapeworks::Image and shapeworks::Mesh.
+ *
+ * The voxels of an Image and the points of a Mesh are returned as numpy arrays
+ * that share their memory rather than copying it.
+ */
+
+#include "Image.h"
+#include "Mesh.h"
+
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+#include <pybind11/stl.h>
+#include <vtkPoints.h>
+#include <vtkDataArray.h>
+#include <algorithm>
+
+namespace py = pybind11;
+using namespace shapeworks;
+
+// operations return false on failure, which python reports as an exception
+static void check(bool succeeded, const std::string &operation)
+{
+  if (!succeeded)
+    throw std::runtime_error(operation + " failed");
+}
+
+static Image::ImageType::Pointer getITKImage(const Image &image)
+{
+  Image::ImageType::Pointer itkImage = image.getITKImage();
+  if (!itkImage)
+    throw std::runtime_error("no image loaded");
+  return itkImage;
+}
+
+// (z, y, x) view of the voxels, holding a reference to the itk image so the
+// view stays valid after the Image moves on to the result of another operation
+static py::array imageArray(const Image &image)
+{
+  Image::ImageType::Pointer itkImage = getITKImage(image);
+
+  auto size = itkImage->GetBufferedRegion().GetSize();
+  const py::ssize_t bytes = sizeof(Image::PixelType);
+  std::vector<py::ssize_t> shape{static_cast<py::ssize_t>(size[2]), static_cast<py::ssize_t>(size[1]), static_cast<py::ssize_t>(size[0])};
+  std::vector<py::ssize_t> strides{bytes * shape[1] * shape[2], bytes * shape[2], bytes};
+
+  py::capsule owner(new Image::ImageType::Pointer(itkImage),
+                    [](void *p) { delete reinterpret_cast<Image::ImageType::Pointer *>(p); });
+  return py::array_t<Image::PixelType>(shape, strides, itkImage->GetBufferPointer(), owner);
+}
+
+// copies a (z, y, x) array into a new Image
+static Image imageFromArray(py::array_t<Image::PixelType, py::array::c_style | py::array::forcecast> array,
+                            std::vector<double> spacing, std::vector<double> origin)
+{
+  if (array.ndim() != Image::dims || spacing.size() != Image::dims || origin.size() != Image::dims)
+    throw std::runtime_error("expected a 3d (z, y, x) array with 3d spacing and origin");
+
+  Image::ImageType::SizeType size;
+  for (unsigned i = 0; i < Image::dims; i++)
+    size[i] = array.shape(Image::dims - 1 - i);
+
+  Image::ImageType::Pointer itkImage = Image::ImageType::New();
+  itkImage->SetRegions(size);
+  itkImage->SetSpacing(spacing.data());
+  itkImage->SetOrigin(origin.data());
+  itkImage->Allocate();
+  std::copy(array.data(), array.data() + array.size(), itkImage->GetBufferPointer());
+  return Image(itkImage);
+}
+
+// (n, 3) view of the points, holding a reference to the vtk mesh
+static py::array meshPoints(const Mesh &mesh)
+{
+  vtkSmartPointer<vtkPolyData> polyData = mesh.getVTKMesh();
+  if (!polyData || !polyData->GetPoints())
+    throw std::runtime_error("no mesh to view");
+
+  vtkDataArray *points = polyData->GetPoints()->GetData();
+  const py::ssize_t count = points->GetNumberOfTuples();
+  auto release = [](void *p) { delete reinterpret_cast<vtkSmartPointer<vtkPolyData> *>(p); };
+
+  switch (points->GetDataType())
+  {
+    case VTK_FLOAT:
+      return py::array_t<float>({count, py::ssize_t(3)}, static_cast<float *>(points->GetVoidPointer(0)),
+                                py::capsule(new vtkSmartPointer<vtkPolyData>(polyData), release));
+    case VTK_DOUBLE:
+      return py::array_t<double>({count, py::ssize_t(3)}, static_cast<double *>(points->GetVoidPointer(0)),
+                                 py::capsule(new vtkSmartPointer<vtkPolyData>(polyData), release));
+    default:
+      throw std::runtime_error("mesh points are neither float nor double");
+  }
+}
+
+PYBIND11_MODULE(shapeworks, m)
+{
+  m.doc() = "In-process access to the shapeworks Image and Mesh operations";
+
+  // operations release the GIL, so python threads can process several images at once
+  using release_gil = py::call_guard<py::gil_scoped_release>;
+
+  py::class_<Image>(m, "Image")
+    .def(py::init<>())
+    .def(py::init([](const std::string &filename) {
+           Image image;
+           check(image.read(filename), "reading " + filename);
+           return image;
+         }), py::arg("filename"), release_gil())
+    .def_static("fromArray", &imageFromArray, "copies a (z, y, x) array into a new image",
+                py::arg("array"), py::arg("spacing") = std::vector<double>{1.0, 1.0, 1.0},
+                py::arg("origin") = std::vector<double>{0.0, 0.0, 0.0})
+    .def("read", [](Image &image, const std::string &filename) {
+           check(image.read(filename), "reading " + filename);
+         }, py::arg("filename"), release_gil())
+    .def("write", [](Image &image, const std::string &filename, bool compressed) {
+           check(image.write(filename, compressed), "writing " + filename);
+         }, py::arg("filename"), py::arg("compressed") = true, release_gil())
+    .def("antialias", [](Image &image, unsigned iterations, float maxRMSErr, unsigned layers) {
+           check(image.antialias(iterations, maxRMSErr, layers), "antialias");
+         }, py::arg("iterations") = 50, py::arg("maxRMSErr") = 0.01f, py::arg("layers") = static_cast<unsigned>(Image::dims), release_gil())
+    .def("binarize", [](Image &image, float threshold, float inside, float outside) {
+           check(image.binarize(threshold, inside, outside), "binarize");
+         }, py::arg("threshold") = std::numeric_limits<float>::epsilon(), py::arg("inside") = 1.0f,
+         py::arg("outside") = 0.0f, release_gil())
+    .def("recenter", [](Image &image) {
+           check(image.recenter(), "recenter");
+         }, release_gil())
+    .def("isoresample", [](Image &image, double spacing, std::vector<unsigned> size) {
+           Dims dims;
+           for (unsigned i = 0; i < Image::dims; i++)
+             dims[i] = i < size.size() ? size[i] : 0;
+           check(image.isoresample(spacing, dims), "isoresample");
+         }, py::arg("spacing") = 1.0, py::arg("size") = std::vector<unsigned>{0, 0, 0}, release_gil())
+    .def("pad", [](Image &image, int padding, float value) {
+           check(image.pad(padding, value), "pad");
+         }, py::arg("padding"), py::arg("value") = 0.0f, release_gil())
+    .def("toArray", &imageArray, "(z, y, x) view of the voxels, sharing their memory")
+    .def_property_readonly("spacing", [](const Image &image) {
+           auto spacing = getITKImage(image)->GetSpacing();
+           return std::vector<double>(spacing.Begin(), spacing.End());
+         })
+    .def_property_readonly("origin", [](const Image &image) {
+           auto origin = getITKImage(image)->GetOrigin();
+           return std::vector<double>(origin.Begin(), origin.End());
+         });
+
+  py::class_<Mesh>(m, "Mesh")
+    .def(py::init<>())
+    .def(py::init([](const std::string &filename) {
+           Mesh mesh;
+           check(mesh.read(filename), "reading " + filename);
+           return mesh;
+         }), py::arg("filename"), release_gil())
+    .def("read", [](Mesh &mesh, const std::string &filename) {
+           check(mesh.read(filename), "reading " + filename);
+         }, py::arg("filename"), release_gil())
+    .def("write", [](Mesh &mesh, const std::string &filename) {
+           check(mesh.write(filename), "writing " + filename);
+         }, py::arg("filename"), release_gil())
+    .def("smooth", [](Mesh &mesh) {
+           check(mesh.smooth(), "smooth");
+         }, release_gil())
+    .def("coverage", [](Mesh &mesh, const Mesh &other) {
+           check(mesh.coverage(other), "coverage");
+         }, py::arg("other"), release_gil())
+    .def("points", &meshPoints, "(n, 3) view of the points, sharing their memory");
+}
@@ -80,6 +80,64 @@ TEST(ImageTests, padimage_identity_test) {
   ASSERT_TRUE(image.compare_equal(ground_truth));
 }
 
+TEST(ImageTests, crop_identity_test) {
+  std::string test_location = std::string(TEST_DATA_DIR) + std::string("/padimage/");
+
+  Image image(test_location + "1x2x2.nrrd");
+  Image::ImageType::IndexType start;
+  start.Fill(0);
+  image.crop(start, Dims({1, 2, 2}));
+  Image ground_truth(test_location + "1x2x2.nrrd");
+
+  ASSERT_TRUE(image.compare_equal(ground_truth));
+}
+
+TEST(ImageTests, resample_to_region_identity_test) {
+  std::string test_location = std::string(TEST_DATA_DIR) + std::string("/padimage/");
+
+  Image image(test_location + "1x2x2.nrrd");
+  Image reference(test_location + "1x2x2.nrrd");
+  Image::ImageType::IndexType start;
+  start.Fill(0);
+  image.resampleToRegion(Image::AffineTransformType::New(), reference, start, Dims({1, 2, 2}));
+  Image ground_truth(test_location + "1x2x2.nrrd");
+
+  ASSERT_TRUE(image.compare_equal(ground_truth));
+}
+
+TEST(ImageTests, threshold_matches_binarize_test) {
+  std::string test_location = std::string(TEST_DATA_DIR) + std::string("/resample/");
+
+  Image image(test_location + "smooth-isotropic-input.nrrd");
+  image.threshold(0.5);
+  Image ground_truth(test_location + "smooth-isotropic-input.nrrd");
+  ground_truth.binarize(0.5);
+
+  ASSERT_TRUE(image.compare_equal(ground_truth));
+}
+
+TEST(ImageTests, signed_distance_sign_test) {
+  std::string test_location = std::string(TEST_DATA_DIR) + std::string("/resample/");
+
+  Image image(test_location + "smooth-isotropic-input.nrrd");
+  image.signedDistance(0.5);
+  image.binarize();
+  Image ground_truth(test_location + "smooth-isotropic-input.nrrd");
+  ground_truth.binarize(0.5);
+
+  ASSERT_TRUE(image.compare_equal(ground_truth));
+}
+
+TEST(ImageTests, shared_itk_image_test) {
+  std::string test_location = std::string(TEST_DATA_DIR) + std::string("/padimage/");
+
+  Image image(test_location + "1x2x2.nrrd");
+  Image shared(image.getITKImage());
+  shared.getITKImage()->GetBufferPointer()[0] = 42.0;
+
+  ASSERT_EQ(image.getITKImage()->GetBufferPointer()[0], 42.0);
+}
+
 // TEST(ImageTests, binarize_test) {
 
 // std::string test_location = std::string(TEST_DATA_DIR) + std::string("/binarize/");
@@ -9,7 +9,10 @@
 #include "TestConfiguration.h"
 
 #include "ShapeWorksRunApp.h"
+#include "Utils.h"
 #include "itkParticleShapeStatistics.h"
+#include "itkParticleImageDomainWithCurvature.h"
+#include "itkParticlePositionReader.h"
 
 //---------------------------------------------------------------------------
 // until we have a "groom" library we can call
@@ -82,3 +85,97 @@ TEST(OptimizeTests, sample_test) {
   double value = values[values.size() - 1];
   ASSERT_LT(value, 100);
 }
+
+//---------------------------------------------------------------------------
+TEST(OptimizeTests, narrow_band_domain_test) {
+
+  std::string test_location = std::string(TEST_DATA_DIR) + std::string("/sphere");
+  chdir(test_location.c_str());
+
+  prep_distance_transform("sphere20.nrrd", "sphere20_DT.nrrd");
+
+  typedef itk::Image<float, 3> ImageType;
+  typedef itk::ParticleImageDomainWithCurvature<float, 3> DomainType;
+  itk::ImageFileReader<ImageType>::Pointer reader = itk::ImageFileReader<ImageType>::New();
+  reader->SetFileName("sphere20_DT.nrrd");
+  reader->Update();
+  ImageType::Pointer image = reader->GetOutput();
+
+  DomainType::Pointer dense = DomainType::New();
+  dense->SetSigma(image->GetSpacing()[0] * 2.0);
+  dense->SetImage(image);
+
+  DomainType::Pointer band = DomainType::New();
+  band->SetSigma(image->GetSpacing()[0] * 2.0);
+  band->SetNarrowBand(4.0);
+  band->SetImage(image);
+
+  // near the surface, the narrow band domain must sample what the dense one does
+  int sampled = 0;
+  itk::ImageRegionConstIteratorWithIndex<ImageType> it(image, image->GetBufferedRegion());
+  for (; !it.IsAtEnd(); ++it) {
+    if (std::abs(it.Get()) > 1.0) {
+      continue;
+    }
+    DomainType::PointType p;
+    image->TransformIndexToPhysicalPoint(it.GetIndex(), p);
+    for (unsigned int i = 0; i < 3; i++) {
+      p[i] += 0.3 * image->GetSpacing()[i];
+    }
+
+    auto denseGradient = dense->SampleGradientVnl(p);
+    auto bandGradient = band->SampleGradientVnl(p);
+    auto denseHessian = dense->SampleHessianVnl(p);
+    auto bandHessian = band->SampleHessianVnl(p);
+    for (unsigned int i = 0; i < 3; i++) {
+      ASSERT_NEAR(denseGradient[i], bandGradient[i], 1e-5);
+      for (unsigned int j = 0; j < 3; j++) {
+        ASSERT_NEAR(denseHessian[i][j], bandHessian[i][j], 1e-5);
+      }
+    }
+    ASSERT_NEAR(dense->GetCurvature(p), band->GetCurvature(p), 1e-5);
+    sampled++;
+  }
+  ASSERT_GT(sampled, 0);
+}
+
+//---------------------------------------------------------------------------
+// reads a file written by Utils::writeBinaryParticles back through both particle readers
+static void check_binary_particles(const std::vector<double> &coordinates, bool doublePrecision)
+{
+  std::string filename = std::string(TEST_DATA_DIR) + (doublePrecision ? "/binary_float64.particles" : "/binary_float32.particles");
+  Utils::writeBinaryParticles(filename, coordinates, doublePrecision);
+  // float32 keeps about 7 significant digits
+  const double tolerance = doublePrecision ? 0.0 : 1e-5;
+
+  itk::ParticlePositionReader<3>::Pointer reader = itk::ParticlePositionReader<3>::New();
+  reader->SetFileName(filename);
+  reader->Update();
+  const auto &points = reader->GetOutput();
+  ASSERT_EQ(points.size(), coordinates.size() / 3);
+  for (size_t i = 0; i < points.size(); i++) {
+    for (unsigned int d = 0; d < 3; d++) {
+      ASSERT_NEAR(points[i][d], coordinates[3 * i + d], tolerance * std::abs(coordinates[3 * i + d]));
+    }
+  }
+
+  std::vector<itk::Point<double>> sparse;
+  Utils::readSparseShape(sparse, &filename[0]);
+  ASSERT_EQ(sparse.size(), coordinates.size() / 3);
+  for (size_t i = 0; i < sparse.size(); i++) {
+    for (unsigned int d = 0; d < 3; d++) {
+      ASSERT_NEAR(sparse[i][d], coordinates[3 * i + d], tolerance * std::abs(coordinates[3 * i + d]));
+    }
+  }
+
+  std::remove(filename.c_str());
+}
+
+//---------------------------------------------------------------------------
+TEST(OptimizeTests, binary_particles_test) {
+  std::vector<double> coordinates{1.0, -2.5, 3.25, 0.1, 1e5, -7.123456789, 42.0, 0.0, -0.333333333333};
+  check_binary_particles(coordinates, false);
+  check_binary_particles(coordinates, true);
+  check_binary_particles(std::vector<double>(), false);
+  check_binary_particles(std::vector<double>(), true);
+}
@@ -21,6 +21,15 @@ static bool file_exists(const std::string &filename)
   return access(filename.c_str(), 0) == 0;
 }
 
+//---------------------------------------------------------------------------
+static int run_python_test(const std::string &script)
+{
+  // the unittest scripts next to this file test the python utilities
+  std::string command = "python " + std::string(TEST_DATA_DIR) + "/../PythonTests/" + script;
+  std::cerr << "Running command: " << command << "\n";
+  return system(command.c_str());
+}
+
 //---------------------------------------------------------------------------
 TEST(PythonTests, tiny_test) {
 
@@ -57,3 +66,88 @@ TEST(PythonTests, tiny_test) {
 
   ASSERT_TRUE(file_exists(check_file));
 }
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, import_time_test) {
+
+  // importing the optimize and analyze utilities should stay fast, without loading itk or numpy
+  std::string python_examples_location = std::string(TEST_DATA_DIR) + std::string(
+    "/../../Examples/Python");
+  chdir(python_examples_location.c_str());
+
+  std::string command = "python -c \"import sys, time; start = time.time(); import OptimizeUtils, AnalyzeUtils; "
+                        "sys.exit(time.time() - start > 0.5 or 'itk' in sys.modules or 'numpy' in sys.modules)\"";
+  std::cerr << "Running command: " << command << "\n";
+
+  ASSERT_EQ(system(command.c_str()), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, workers_test) {
+  ASSERT_EQ(run_python_test("workers_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, groom_cache_test) {
+  ASSERT_EQ(run_python_test("groom_cache_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, pipeline_test) {
+  ASSERT_EQ(run_python_test("pipeline_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, bindings_test) {
+  ASSERT_EQ(run_python_test("bindings_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, manifest_test) {
+  ASSERT_EQ(run_python_test("manifest_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, particle_format_test) {
+  ASSERT_EQ(run_python_test("particle_format_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, multiscale_resume_test) {
+  ASSERT_EQ(run_python_test("multiscale_resume_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, cohort_particles_test) {
+  ASSERT_EQ(run_python_test("cohort_particles_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, subject_commands_test) {
+  ASSERT_EQ(run_python_test("subject_commands_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, reference_image_test) {
+  ASSERT_EQ(run_python_test("reference_image_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, memory_scheduler_test) {
+  ASSERT_EQ(run_python_test("memory_scheduler_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, shape_index_test) {
+  ASSERT_EQ(run_python_test("shape_index_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, parameter_sweep_test) {
+  ASSERT_EQ(run_python_test("parameter_sweep_test.py"), 0);
+}
+
+//---------------------------------------------------------------------------
+TEST(PythonTests, optimize_progress_test) {
+  ASSERT_EQ(run_python_test("optimize_progress_test.py"), 0);
+}
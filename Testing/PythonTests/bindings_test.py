@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that the numpy arrays of the shapeworks python bindings share memory
+with the Image and Mesh they come from, and that readSegmentation returns
+voxels of their own type without copying them
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+import GroomUtils
+
+sw = lazyImport('shapeworks', optional=True)
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def writeRawNrrd(filename, array):
+    header = ("NRRD0004\ntype: float\ndimension: 3\nsizes: " + " ".join(str(d) for d in reversed(array.shape)) +
+              "\nencoding: raw\nendian: little\n\n")
+    with open(filename, 'wb') as f:
+        f.write(header.encode())
+        f.write(array.astype('<f4').tobytes())
+
+
+class ReadSegmentationTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='bindings_test')
+        self.filename = os.path.join(self.dir, 'seg.nrrd')
+        self.array = np.zeros((2, 3, 4), dtype=np.float32)
+        self.array[1, 1:, 2:] = 1
+        writeRawNrrd(self.filename, self.array)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testMappedWithoutBindings(self):
+        bindings = GroomUtils.sw
+        GroomUtils.sw = None
+        try:
+            seg = GroomUtils.readSegmentation(self.filename)
+        finally:
+            GroomUtils.sw = bindings
+        self.assertEqual(seg.dtype, np.float32)
+        self.assertFalse(seg.flags.owndata)
+        np.testing.assert_array_equal(seg, self.array)
+
+    @unittest.skipIf(sw is None, "the shapeworks python module is not built")
+    def testViewWithBindings(self):
+        seg = GroomUtils.readSegmentation(self.filename)
+        self.assertEqual(seg.dtype, np.float32)
+        self.assertFalse(seg.flags.owndata)
+        np.testing.assert_array_equal(seg, self.array)
+
+
+@unittest.skipIf(sw is None, "the shapeworks python module is not built")
+class BindingsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='bindings_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testImageArraySharesMemory(self):
+        image = sw.Image.fromArray(np.zeros((2, 3, 4), dtype=np.float32))
+        view = image.toArray()
+        self.assertEqual(view.shape, (2, 3, 4))
+        self.assertTrue(np.shares_memory(view, image.toArray()))
+
+        # a change through the view is seen by the image
+        view[1, 2, 3] = 42
+        filename = os.path.join(self.dir, 'image.nrrd')
+        image.write(filename)
+        self.assertEqual(sw.Image(filename).toArray()[1, 2, 3], 42)
+
+    def testImageArrayOutlivesImage(self):
+        image = sw.Image.fromArray(np.full((2, 3, 4), 7, dtype=np.float32))
+        view = image.toArray()
+        del image
+        self.assertTrue(np.all(view == 7))
+
+    def testImageOperationKeepsOldView(self):
+        image = sw.Image.fromArray(np.ones((4, 4, 4), dtype=np.float32))
+        view = image.toArray()
+        image.pad(2)
+        self.assertEqual(view.shape, (4, 4, 4))
+        self.assertEqual(image.toArray().shape, (8, 8, 8))
+        self.assertTrue(np.all(view == 1))
+
+    def testMeshPointsShareMemory(self):
+        mesh = sw.Mesh(os.path.join(dataDir, 'coverage', 'femur.vtk'))
+        points = mesh.points()
+        self.assertEqual(points.shape[1], 3)
+        self.assertTrue(np.shares_memory(points, mesh.points()))
+
+        points[0] = [1, 2, 3]
+        filename = os.path.join(self.dir, 'mesh.vtk')
+        mesh.write(filename)
+        np.testing.assert_allclose(sw.Mesh(filename).points()[0], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the particle cache of loadCohortParticles of OptimizeUtils
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+import OptimizeUtils
+from OptimizeUtils import *
+
+
+class CohortParticlesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='cohort_particles_test')
+        self.localFiles, self.worldFiles = [], []
+        for i, subject in enumerate(['a', 'b', 'c']):
+            localFile = os.path.join(self.dir, subject + '_local.particles')
+            worldFile = os.path.join(self.dir, subject + '_world.particles')
+            writeParticleArray(localFile, np.full((4, 3), i, dtype=np.float32))
+            writeParticleArray(worldFile, np.full((4, 3), i + 10, dtype=np.float32))
+            self.localFiles.append(localFile)
+            self.worldFiles.append(worldFile)
+
+        # counts the files read from disk rather than the cache
+        self.reads = []
+        self.readParticleStack = OptimizeUtils.readParticleStack
+        def countingRead(particleFiles, workers=8):
+            self.reads.extend(particleFiles)
+            return self.readParticleStack(particleFiles, workers)
+        OptimizeUtils.readParticleStack = countingRead
+
+    def tearDown(self):
+        OptimizeUtils.readParticleStack = self.readParticleStack
+        shutil.rmtree(self.dir)
+
+    def testColdAndWarmStart(self):
+        subjects, local, world = loadCohortParticles(self.localFiles, self.worldFiles)
+        self.assertEqual(subjects, ['a', 'b', 'c'])
+        self.assertEqual(local.shape, (3, 4, 3))
+        self.assertEqual(len(self.reads), 6)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'cohort_particles.npz')))
+
+        self.reads = []
+        cached = loadCohortParticles(self.localFiles, self.worldFiles)
+        self.assertEqual(self.reads, [])
+        self.assertEqual(cached[0], subjects)
+        np.testing.assert_array_equal(cached[1], local)
+        np.testing.assert_array_equal(cached[2], world)
+
+    def testChangedFileInvalidatesCache(self):
+        loadCohortParticles(self.localFiles, self.worldFiles)
+        writeParticleArray(self.worldFiles[1], np.full((4, 3), 42, dtype=np.float64))
+
+        self.reads = []
+        subjects, local, world = loadCohortParticles(self.localFiles, self.worldFiles)
+        self.assertEqual(len(self.reads), 6)
+        self.assertTrue(np.all(world[1] == 42))
+
+        self.reads = []
+        loadCohortParticles(self.localFiles, self.worldFiles)
+        self.assertEqual(self.reads, [])
+
+    def testOtherFilesInvalidateCache(self):
+        loadCohortParticles(self.localFiles, self.worldFiles)
+        self.reads = []
+        subjects, local, world = loadCohortParticles(self.localFiles[:2], self.worldFiles[:2])
+        self.assertEqual(subjects, ['a', 'b'])
+        self.assertEqual(len(self.reads), 4)
+
+    def testNoFiles(self):
+        with self.assertRaises(ValueError):
+            loadCohortParticles([], [])
+        with self.assertRaises(ValueError):
+            loadCohortParticles(self.localFiles, self.worldFiles[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the content-addressed GroomCache of CommonUtils
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+
+
+def writeFile(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+
+def readFile(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+class GroomCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='groom_cache_test')
+        self.cache = GroomCache(os.path.join(self.dir, 'cache'), maxSize=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def step(self, dataDir, data=b'segmentation'):
+        inname = os.path.join(dataDir, 'seg.nrrd')
+        outname = os.path.join(dataDir, 'seg.pad.nrrd')
+        writeFile(inname, data)
+        commandList = [["shapeworks", "readimage", "--name", inname, "pad", "--padding", "10",
+                        "writeimage", "--name", outname]]
+        return inname, outname, commandList
+
+    def testRelocatedDataHits(self):
+        inname, outname, commandList = self.step(os.path.join(self.dir, 'a'))
+        key = self.cache.getKey([inname], commandList, [outname])
+        writeFile(outname, b'padded')
+        self.cache.store(key, [outname])
+
+        inname, outname, commandList = self.step(os.path.join(self.dir, 'b'))
+        key = self.cache.getKey([inname], commandList, [outname])
+        self.assertTrue(self.cache.fetch(key, [outname]))
+        self.assertEqual(readFile(outname), b'padded')
+
+    def testChangedContentsOrParametersMiss(self):
+        inname, outname, commandList = self.step(os.path.join(self.dir, 'a'))
+        key = self.cache.getKey([inname], commandList, [outname])
+        inname, outname, changed = self.step(os.path.join(self.dir, 'b'), b'other segmentation')
+        self.assertNotEqual(self.cache.getKey([inname], changed, [outname]), key)
+        changed[0][changed[0].index("10")] = "20"
+        inname, outname, commandList = self.step(os.path.join(self.dir, 'c'))
+        self.assertNotEqual(self.cache.getKey([inname], changed, [outname]), key)
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        outname = os.path.join(self.dir, 'out.nrrd')
+        for key in ('first', 'second', 'third'):
+            writeFile(outname, key.encode()[:1] * 400)
+            self.cache.store(key, [outname])
+            self.cache.fetch('first', [outname])
+        self.assertTrue(self.cache.fetch('first', [outname]))
+        self.assertFalse(self.cache.fetch('second', [outname]))
+        self.assertTrue(self.cache.fetch('third', [outname]))
+        self.assertLessEqual(self.cache.totalSize, 1000)
+        # the size index matches a fresh scan of the directory
+        self.assertEqual(GroomCache(self.cache.cacheDir, maxSize=1000).totalSize, self.cache.totalSize)
+
+    def testConcurrentStoresAndFetches(self):
+        def run(index):
+            outname = os.path.join(self.dir, 'out' + str(index), 'out.nrrd')
+            writeFile(outname, b'x' * 10)
+            self.cache.store('key' + str(index % 4), [outname])
+            return self.cache.fetch('key' + str(index % 4), [outname])
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(run, range(32))))
+        self.assertEqual(sorted(self.cache.entries), ['key0', 'key1', 'key2', 'key3'])
+        self.assertEqual([name for name in os.listdir(self.cache.cacheDir) if name.endswith('.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
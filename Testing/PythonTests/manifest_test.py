@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of runShapeworksManifest of CommonUtils with filenames holding commas
+and quotes. The runs need a shapeworks executable with --manifest on the path.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+import CommonUtils
+
+dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+chain = ["readimage", "--name", "{input}", "writeimage", "--name", "{output}"]
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='manifest_test')
+        self.dataDir = os.path.join(self.dir, 'with, comma')
+        os.makedirs(self.dataDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testLineBreakIsRejected(self):
+        support = CommonUtils.shapeworksManifestSupport
+        CommonUtils.shapeworksManifestSupport = True
+        try:
+            with self.assertRaises(ValueError):
+                runShapeworksManifest(self.dir, chain, [('a', os.path.join(self.dataDir, 'a\n.nrrd'),
+                                                         os.path.join(self.dataDir, 'b.nrrd'))])
+        finally:
+            CommonUtils.shapeworksManifestSupport = support
+
+    @unittest.skipUnless(hasShapeworksManifest(), "no shapeworks executable with --manifest on the path")
+    def testQuotedFilenames(self):
+        inname = os.path.join(self.dataDir, 'in "1".nrrd')
+        shutil.copyfile(os.path.join(dataDir, 'padimage', '1x2x2.nrrd'), inname)
+        outname = os.path.join(self.dataDir, 'out, "1".nrrd')
+        runShapeworksManifest(self.dir, chain, [('a', inname, outname)])
+        self.assertTrue(os.path.exists(outname))
+
+    @unittest.skipUnless(hasShapeworksManifest(), "no shapeworks executable with --manifest on the path")
+    def testFailedRowIsReported(self):
+        inname = os.path.join(self.dataDir, 'in "1".nrrd')
+        shutil.copyfile(os.path.join(dataDir, 'padimage', '1x2x2.nrrd'), inname)
+        jobs = [('a', inname, os.path.join(self.dataDir, 'out, 1.nrrd')),
+                ('b', os.path.join(self.dataDir, 'missing, 2.nrrd'), os.path.join(self.dataDir, 'out, 2.nrrd'))]
+        with self.assertRaises(SubjectProcessError) as context:
+            runShapeworksManifest(self.dir, chain, jobs, workers=2)
+        self.assertEqual(context.exception.subject, 'b')
+        self.assertTrue(os.path.exists(jobs[0][2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the MemoryScheduler of CommonUtils, with fake jobs on NRRD headers
+of known sizes and a runMeasured that reports a chosen peak memory
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+import CommonUtils
+from CommonUtils import *
+
+voxels = 100 * 100 * 100
+
+
+class MemorySchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='memory_scheduler_test')
+        # only the header is read by the scheduler
+        self.inputs = []
+        for i in range(4):
+            filename = os.path.join(self.dir, 'input' + str(i) + '.nrrd')
+            with open(filename, 'w') as f:
+                f.write("NRRD0004\ntype: float\ndimension: 3\nsizes: 100 100 100\nencoding: raw\n\n")
+            self.inputs.append(filename)
+
+        # fake runMeasured: records which jobs overlap and reports the peak
+        # memory given on the command line
+        self.lock = threading.Lock()
+        self.active = []
+        self.overlaps = []
+        self.runMeasured = CommonUtils.runMeasured
+        def fakeRunMeasured(cmd, **popenArgs):
+            with self.lock:
+                self.active.append(cmd[1])
+                self.overlaps.append(list(self.active))
+            time.sleep(0.1)
+            with self.lock:
+                self.active.remove(cmd[1])
+            return int(cmd[3]), {'wall': 0.1, 'user': None, 'sys': None, 'peakRSS': int(cmd[2])}
+        CommonUtils.runMeasured = fakeRunMeasured
+
+    def tearDown(self):
+        CommonUtils.runMeasured = self.runMeasured
+        shutil.rmtree(self.dir)
+
+    def runJobs(self, scheduler, tool='FakeTool', peak=0, returncode=0):
+        threads = [threading.Thread(target=scheduler.run, args=([tool, inname, str(peak), str(returncode)], [inname]))
+                   for inname in self.inputs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return max(len(overlap) for overlap in self.overlaps)
+
+    def testEstimate(self):
+        scheduler = MemoryScheduler(1024**3)
+        self.assertEqual(scheduler.estimate(['FakeTool', self.inputs[0]]),
+                         memoryBaseCost + voxels * memoryCostModel['default'])
+        self.assertEqual(scheduler.estimate(['CloseHoles'], [self.inputs[0]]),
+                         memoryBaseCost + voxels * memoryCostModel['CloseHoles'])
+        # a shapeworks chain costs its most expensive subcommand
+        cmd = ['shapeworks', 'readimage', '--name', self.inputs[0], 'antialias', 'writeimage', '--name', 'out.nrrd']
+        self.assertEqual(scheduler.estimate(cmd), memoryBaseCost + voxels * memoryCostModel['shapeworks:antialias'])
+
+    def testJobsOverBudgetWait(self):
+        estimate = memoryBaseCost + voxels * memoryCostModel['default']
+        self.assertEqual(self.runJobs(MemoryScheduler(int(1.5 * estimate))), 1)
+        self.overlaps = []
+        self.assertEqual(self.runJobs(MemoryScheduler(int(2.5 * estimate))), 2)
+        self.overlaps = []
+        self.assertEqual(self.runJobs(MemoryScheduler(4 * estimate)), 4)
+
+    def testJobLargerThanLimitRunsAlone(self):
+        self.assertEqual(self.runJobs(MemoryScheduler(memoryBaseCost)), 1)
+
+    def testRecordedPeakUpdatesEstimate(self):
+        modelFile = os.path.join(self.dir, 'memory_model.json')
+        scheduler = MemoryScheduler(1024**3, modelFile)
+        # a failed job isn't recorded
+        self.runJobs(scheduler, peak=memoryBaseCost + voxels * 100, returncode=1)
+        self.assertEqual(scheduler.measured, {})
+        self.runJobs(scheduler, peak=memoryBaseCost + voxels * 100)
+        expected = memoryBaseCost + voxels * 110.0
+        self.assertAlmostEqual(scheduler.estimate(['FakeTool', self.inputs[0]]), expected)
+
+        # the worst case is kept
+        self.runJobs(scheduler, peak=memoryBaseCost + voxels * 10)
+        self.assertAlmostEqual(scheduler.estimate(['FakeTool', self.inputs[0]]), expected)
+
+        # and used by the next runs
+        with open(modelFile) as f:
+            self.assertAlmostEqual(json.load(f)['FakeTool'], 110.0)
+        self.assertAlmostEqual(MemoryScheduler(1024**3, modelFile).estimate(['FakeTool', self.inputs[0]]), expected)
+
+        # a larger measured cost now keeps the jobs apart
+        self.overlaps = []
+        self.assertEqual(self.runJobs(MemoryScheduler(int(1.5 * expected), modelFile)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
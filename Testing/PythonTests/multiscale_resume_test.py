@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how runShapeWorksOptimize_MultiScale of OptimizeUtils skips and
+resumes the levels of a previous run, with a stub ShapeWorksRun on the path
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from OptimizeUtils import *
+
+# logs its parameter file and writes the particles of every input
+stubShapeWorksRun = '''#!{python}
+import json, os, re, sys
+text = open(sys.argv[1]).read()
+def tag(name):
+    match = re.search('<' + name + r'>\\s*(.*?)\\s*</' + name + '>', text, flags=re.DOTALL)
+    return match.group(1).split() if match else []
+outDir = tag('output_dir')[0]
+for inname in tag('inputs'):
+    name = os.path.join(outDir, os.path.basename(inname).replace('.nrrd', ''))
+    for suffix in ('_local.particles', '_world.particles'):
+        open(name + suffix, 'w').write('0 0 0\\n')
+with open(os.environ['STUB_LOG'], 'a') as log:
+    log.write(json.dumps({{'parameterFile': sys.argv[1], 'outDir': outDir,
+                          'completed': tag('optimization_iterations_completed'),
+                          'pointFiles': tag('point_files')}}) + '\\n')
+'''
+
+parameterDictionary = {
+    "starting_particles" : 4,
+    "number_of_levels" : 2,
+    "use_normals": 0,
+    "normal_weight": 10.0,
+    "checkpointing_interval" : 100,
+    "keep_checkpoints" : 1,
+    "iterations_per_split" : 100,
+    "optimization_iterations" : 1000,
+    "starting_regularization" : 100,
+    "ending_regularization" : 0.1,
+    "recompute_regularization_interval" : 2,
+    "domains_per_shape" : 1,
+    "relative_weighting" : 10,
+    "initial_relative_weighting" : 0.01,
+    "procrustes_interval" : 0,
+    "procrustes_scaling" : 0,
+    "save_init_splits" : 0,
+    "debug_projection" : 0,
+    "verbosity" : 0
+}
+
+
+class MultiScaleResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='multiscale_resume_test')
+        binDir = os.path.join(self.dir, 'bin')
+        os.makedirs(binDir)
+        stub = os.path.join(binDir, 'ShapeWorksRun')
+        with open(stub, 'w') as f:
+            f.write(stubShapeWorksRun.format(python=sys.executable))
+        os.chmod(stub, 0o755)
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = binDir + os.pathsep + os.environ['PATH']
+        os.environ['STUB_LOG'] = os.path.join(self.dir, 'runs.jsonl')
+
+        self.dtFiles = []
+        for name in ['a', 'b']:
+            dtFile = os.path.join(self.dir, 'groomed', name + '.nrrd')
+            os.makedirs(os.path.dirname(dtFile), exist_ok=True)
+            with open(dtFile, 'w') as f:
+                f.write(name)
+            self.dtFiles.append(dtFile)
+        self.pointDir = os.path.join(self.dir, 'points') + '/'
+        os.makedirs(self.pointDir)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.dir)
+
+    def optimize(self, parameters=parameterDictionary, progress=None):
+        '''
+            Runs the optimization and returns the runs of ShapeWorksRun
+        '''
+        if os.path.exists(os.environ['STUB_LOG']):
+            os.remove(os.environ['STUB_LOG'])
+        runShapeWorksOptimize_MultiScale(self.pointDir, self.dtFiles, parameters, progress=progress)
+        if not os.path.exists(os.environ['STUB_LOG']):
+            return []
+        with open(os.environ['STUB_LOG']) as f:
+            return [json.loads(line) for line in f]
+
+    def levelDir(self, numParticles):
+        return self.pointDir + '/' + str(numParticles) + '/'
+
+    def makeCheckpoint(self, numParticles, iteration):
+        checkpointDir = os.path.join(self.levelDir(numParticles), 'iter' + str(iteration) + '_p' + str(numParticles))
+        os.makedirs(checkpointDir)
+        return checkpointDir
+
+    def testCompletedLevelsAreSkipped(self):
+        self.assertEqual(len(self.optimize()), 2)
+        self.assertEqual(self.optimize(), [])
+
+    def testOutputOnlyParametersKeepLevels(self):
+        records = []
+        self.assertEqual(len(self.optimize(progress=records.append)), 2)
+        self.assertEqual(self.optimize(), [])
+        self.assertEqual(self.optimize(progress=records.append), [])
+        self.assertEqual(self.optimize(dict(parameterDictionary, verbosity=1)), [])
+
+    def testChangedParameterInvalidatesLevel(self):
+        self.optimize()
+        checkpoints = [self.makeCheckpoint(4, 100), self.makeCheckpoint(8, 100)]
+        runs = self.optimize(dict(parameterDictionary, relative_weighting=1))
+        self.assertEqual([os.path.normpath(run['outDir']) for run in runs],
+                         [os.path.normpath(self.levelDir(4)), os.path.normpath(self.levelDir(8))])
+        self.assertTrue(all(run['completed'] == [] for run in runs))
+        for checkpointDir in checkpoints:
+            self.assertFalse(os.path.exists(checkpointDir))
+
+    def testInterruptedLevelResumesFromNewestCheckpoint(self):
+        self.optimize()
+        # the second level was interrupted after keeping some checkpoints
+        state = readLevelState(self.levelDir(8))
+        writeLevelState(self.levelDir(8), state['fingerprint'], False)
+        for iteration in [100, 300, 200]:
+            self.makeCheckpoint(8, iteration)
+        # not a checkpoint directory
+        with open(os.path.join(self.levelDir(8), 'iter900_p8'), 'w') as f:
+            f.write('')
+
+        self.assertEqual(findLatestCheckpoint(self.levelDir(8), 8)[0], 300)
+        runs = self.optimize()
+        self.assertEqual(len(runs), 1)
+        self.assertTrue(runs[0]['parameterFile'].endswith('_resume.xml'))
+        self.assertEqual(runs[0]['completed'], ['300'])
+        self.assertEqual([os.path.basename(os.path.dirname(f)) for f in runs[0]['pointFiles']], ['iter300_p8'] * 2)
+        self.assertEqual(readLevelState(self.levelDir(8))['complete'], True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of iterateShapeWorksOptimize of OptimizeUtils, with a fake
+ShapeWorksRun writing the progress file as the optimizer does
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from OptimizeUtils import *
+
+# the parameter file holds the progress file, the text to write to it in
+# steps (waiting for a file to exist before each step but the first), and
+# the exit code
+stubShapeWorksRun = '''#!{python}
+import json, os, sys, time
+parameters = json.load(open(sys.argv[1]))
+if parameters['steps']:
+    with open(parameters['progress'], 'w') as progress:
+        for i, step in enumerate(parameters['steps']):
+            if i > 0:
+                while not os.path.exists(parameters['go'] + str(i)):
+                    time.sleep(0.01)
+            progress.write(step)
+            progress.flush()
+time.sleep(parameters.get('sleep', 0))
+sys.exit(parameters.get('returncode', 0))
+'''
+
+record = {"stage": "optimization", "iteration": 100, "particles": 128, "sampling": 1.5, "correspondence": 2.5,
+          "total": 4.0, "max_update": 0.01}
+finished = {"stage": "finished", "iteration": 200, "early_stop": False}
+
+
+class OptimizeProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='optimize_progress_test')
+        binDir = os.path.join(self.dir, 'bin')
+        os.makedirs(binDir)
+        stub = os.path.join(binDir, 'ShapeWorksRun')
+        with open(stub, 'w') as f:
+            f.write(stubShapeWorksRun.format(python=sys.executable))
+        os.chmod(stub, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = binDir + os.pathsep + self.path
+        self.progressFile = os.path.join(self.dir, 'progress.jsonl')
+        self.go = os.path.join(self.dir, 'go')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.dir)
+
+    def iterate(self, steps, **parameters):
+        parameterFile = os.path.join(self.dir, 'parameters.json')
+        with open(parameterFile, 'w') as f:
+            json.dump(dict(parameters, progress=self.progressFile, go=self.go, steps=steps), f)
+        return iterateShapeWorksOptimize(parameterFile, self.progressFile, pollInterval=0.02)
+
+    def release(self, step):
+        with open(self.go + str(step), 'w') as f:
+            f.write('')
+
+    def testPartialLineIsKeptUntilComplete(self):
+        second = json.dumps(dict(record, iteration=200))
+        steps = [json.dumps(record) + '\n' + second[:20], second[20:] + '\n', json.dumps(finished) + '\n']
+        records = self.iterate(steps)
+        self.assertEqual(next(records), record)
+        # the reader sees the first half of the second record until the
+        # optimizer writes the rest
+        time.sleep(0.1)
+        self.release(1)
+        self.assertEqual(next(records), dict(record, iteration=200))
+        self.release(2)
+        self.assertEqual(list(records), [finished])
+
+    def testNonFiniteValuesAreNull(self):
+        # what ShapeWorksRunApp::WriteProgress writes for NaN and infinity
+        line = ('{"stage": "initialization", "iteration": 0, "particles": 1, "sampling": null, '
+                '"correspondence": 0, "total": null, "max_update": null}\n')
+        records = list(self.iterate([line]))
+        self.assertEqual(len(records), 1)
+        self.assertIsNone(records[0]['total'])
+        self.assertIsNone(records[0]['max_update'])
+        self.assertEqual(records[0]['correspondence'], 0)
+        # and the progress callback prints them
+        printProgress(records[0])
+
+    def testExitBeforeProgressFile(self):
+        # a stale progress file of an earlier run isn't read
+        with open(self.progressFile, 'w') as f:
+            f.write(json.dumps(record) + '\n')
+        self.assertEqual(list(self.iterate([])), [])
+        self.assertFalse(os.path.exists(self.progressFile))
+
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            list(self.iterate([], returncode=4))
+        self.assertEqual(context.exception.returncode, 4)
+
+    def testFailureAfterRecords(self):
+        records = []
+        with self.assertRaises(subprocess.CalledProcessError):
+            for r in self.iterate([json.dumps(record) + '\n'], returncode=2):
+                records.append(r)
+        self.assertEqual(records, [record])
+
+    def testClosingStopsOptimizer(self):
+        start = time.time()
+        records = self.iterate([json.dumps(record) + '\n'], sleep=60)
+        self.assertEqual(next(records), record)
+        records.close()
+        self.assertLess(time.time() - start, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
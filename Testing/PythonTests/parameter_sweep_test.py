@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of runParameterSweep and expandParameterGrid of OptimizeUtils, with a
+stub ShapeWorksRun on the path
+"""
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from OptimizeUtils import *
+
+# writes the particles of every input and the energy files, and fails when
+# relative_weighting is 99
+stubShapeWorksRun = '''#!{python}
+import os, re, sys
+text = open(sys.argv[1]).read()
+def tag(name):
+    match = re.search('<' + name + r'>\\s*(.*?)\\s*</' + name + '>', text, flags=re.DOTALL)
+    return match.group(1).split() if match else []
+if tag('relative_weighting') == ['99']:
+    sys.exit(5)
+outDir = tag('output_dir')[0]
+weight = float(tag('relative_weighting')[0])
+for i, inname in enumerate(tag('inputs')):
+    name = os.path.join(outDir, os.path.basename(inname).replace('.nrrd', ''))
+    for suffix in ('_local.particles', '_world.particles'):
+        with open(name + suffix, 'w') as f:
+            for p in range(int(tag('number_of_particles')[0])):
+                f.write('%f %f %f\\n' % (i * weight, p, i * p))
+for energy, value in (('sampling', 1.0), ('correspondence', 2.0), ('total', 3.0)):
+    with open(os.path.join(outDir, 'opt_' + energy + 'Energy.txt'), 'w') as f:
+        f.write('100\\n' + str(value * weight) + '\\n')
+'''
+
+parameterDictionary = {
+    "number_of_particles" : 4,
+    "use_normals": 0,
+    "normal_weight": 10.0,
+    "checkpointing_interval" : 100,
+    "keep_checkpoints" : 0,
+    "iterations_per_split" : 100,
+    "optimization_iterations" : 1000,
+    "starting_regularization" : 100,
+    "ending_regularization" : 0.1,
+    "recompute_regularization_interval" : 2,
+    "domains_per_shape" : 1,
+    "relative_weighting" : 10,
+    "initial_relative_weighting" : 0.01,
+    "procrustes_interval" : 0,
+    "procrustes_scaling" : 0,
+    "save_init_splits" : 0,
+    "debug_projection" : 0,
+    "verbosity" : 0
+}
+
+
+class ParameterSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='parameter_sweep_test')
+        binDir = os.path.join(self.dir, 'bin')
+        os.makedirs(binDir)
+        stub = os.path.join(binDir, 'ShapeWorksRun')
+        with open(stub, 'w') as f:
+            f.write(stubShapeWorksRun.format(python=sys.executable))
+        os.chmod(stub, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = binDir + os.pathsep + self.path
+
+        self.dtFiles = []
+        for name in ['a', 'b', 'c']:
+            dtFile = os.path.join(self.dir, 'groomed', name + '.nrrd')
+            os.makedirs(os.path.dirname(dtFile), exist_ok=True)
+            with open(dtFile, 'w') as f:
+                f.write(name)
+            self.dtFiles.append(dtFile)
+        self.sweepDir = os.path.join(self.dir, 'sweep')
+        os.makedirs(self.sweepDir)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.dir)
+
+    def testExpandParameterGrid(self):
+        grid = expandParameterGrid(parameterDictionary, {'relative_weighting': [1, 10], 'number_of_particles': [4, 8, 16]})
+        self.assertEqual([(d['relative_weighting'], d['number_of_particles']) for d in grid],
+                         [(1, 4), (1, 8), (1, 16), (10, 4), (10, 8), (10, 16)])
+        self.assertTrue(all(d['verbosity'] == 0 for d in grid))
+        # the dictionary itself is left alone
+        self.assertEqual(parameterDictionary['relative_weighting'], 10)
+        self.assertEqual(expandParameterGrid(parameterDictionary, {}), [parameterDictionary])
+
+    def testSweep(self):
+        dictionaries = expandParameterGrid(parameterDictionary, {'relative_weighting': [1, 99, 10], 'number_of_particles': [4, 8]})
+        results = runParameterSweep(self.sweepDir, self.dtFiles, dictionaries, jobs=2)
+
+        self.assertEqual([row['index'] for row in results], list(range(6)))
+        self.assertEqual([row['status'] for row in results], ['done', 'done', 'failed (5)', 'failed (5)', 'done', 'done'])
+        # each job has its own directory
+        self.assertEqual(len(set(row['output_dir'] for row in results)), 6)
+        for row in results:
+            self.assertTrue(os.path.isfile(row['output_dir'] + 'correspondence_' + str(row['number_of_particles']) + '.xml'))
+            if row['status'] == 'done':
+                self.assertTrue(os.path.isfile(row['output_dir'] + str(row['number_of_particles']) + '/a_world.particles'))
+                self.assertEqual(row['total_energy'], 3.0 * row['relative_weighting'])
+                self.assertIsNotNone(row['compactness'])
+            else:
+                self.assertIsNone(row['total_energy'])
+                self.assertIsNone(row['compactness'])
+        # only the swept parameters get a column
+        self.assertEqual(list(results[0].keys())[:3], ['index', 'number_of_particles', 'relative_weighting'])
+        self.assertNotIn('verbosity', results[0])
+
+        with open(os.path.join(self.sweepDir, 'sweep_results.csv')) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row['status'] for row in rows], [row['status'] for row in results])
+        self.assertEqual([row['relative_weighting'] for row in rows], ['1', '1', '99', '99', '10', '10'])
+        self.assertEqual(rows[0]['total_energy'], '3.0')
+
+    def testBadParameterDictionaries(self):
+        # no use_normals, no number_of_particles, not a dictionary, and an
+        # output directory that can't be created
+        dictionaries = [dict(parameterDictionary), dict(parameterDictionary), dict(parameterDictionary),
+                        None, dict(parameterDictionary, relative_weighting=1)]
+        del dictionaries[1]['use_normals']
+        del dictionaries[2]['number_of_particles']
+        with open(os.path.join(self.sweepDir, 'sweep_4'), 'w') as f:
+            f.write('')
+        resultsFile = os.path.join(self.dir, 'results.csv')
+        results = runParameterSweep(self.sweepDir, self.dtFiles, dictionaries, jobs=2, resultsFile=resultsFile)
+
+        statuses = [row['status'] for row in results]
+        self.assertEqual(statuses[0], 'done')
+        self.assertTrue(statuses[1].startswith("failed (KeyError: 'use_normals'"))
+        self.assertTrue(statuses[2].startswith("failed (KeyError: 'number_of_particles'"))
+        self.assertTrue(statuses[3].startswith('failed (TypeError'))
+        self.assertTrue(statuses[4].startswith('failed (FileExistsError'))
+        self.assertEqual(results[3]['relative_weighting'], None)
+        self.assertEqual(results[4]['relative_weighting'], 1)
+        with open(resultsFile) as f:
+            self.assertEqual(len(list(csv.DictReader(f))), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the binary particle files of CommonUtils (particle_format float32
+and float64 of ShapeWorksRun)
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+
+
+class ParticleFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='particle_format_test')
+        self.filename = os.path.join(self.dir, 'shape.particles')
+        self.particles = np.array([[1.0, -2.5, 3.25], [0.1, 1e5, -7.123456789], [42.0, 0.0, -1.0 / 3]])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testFloat32RoundTrip(self):
+        writeParticleArray(self.filename, self.particles, 'float32')
+        particles = readParticleArray(self.filename)
+        self.assertEqual(particles.dtype, np.float32)
+        np.testing.assert_array_equal(particles, self.particles.astype(np.float32))
+
+    def testFloat64RoundTrip(self):
+        writeParticleArray(self.filename, self.particles, 'float64')
+        particles = readParticleArray(self.filename)
+        self.assertEqual(particles.dtype, np.float64)
+        np.testing.assert_array_equal(particles, self.particles)
+
+    def testEmpty(self):
+        for dtype in ('float32', 'float64'):
+            writeParticleArray(self.filename, np.zeros((0, 3)), dtype)
+            particles = readParticleArray(self.filename)
+            self.assertEqual(particles.shape, (0, 3))
+            self.assertEqual(particles.dtype, np.dtype(dtype))
+
+    def testHeader(self):
+        '''
+            The layout read by Utils::readBinaryParticles: magic, then version,
+            dimension, bytes per value and a reserved word, then the count
+        '''
+        writeParticleArray(self.filename, self.particles, 'float64')
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        self.assertEqual(data[:8], b'SWPARTS\0')
+        self.assertEqual(struct.unpack('<4IQ', data[8:32]), (1, 3, 8, 0, 3))
+        self.assertEqual(len(data), 32 + self.particles.size * 8)
+
+    def testText(self):
+        np.savetxt(self.filename, self.particles)
+        np.testing.assert_allclose(readParticleArray(self.filename), self.particles)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of how the Pipeline and the ArtifactStore of CommonUtils resume from
+their state files
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+from GroomUtils import addGroomNodes
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='pipeline_test')
+        self.stateFile = os.path.join(self.dir, 'pipeline_state.json')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def writeStep(self, name, inputFile):
+        '''
+            A step writing the content of inputFile to a file named after it
+        '''
+        self.calls.append(name)
+        outname = os.path.join(self.dir, name + '.txt')
+        with open(inputFile) as f, open(outname, 'w') as out:
+            out.write(f.read())
+        return [outname]
+
+    def runSteps(self, inputFile, resume):
+        pipeline = Pipeline(self.stateFile, resume=resume)
+        first = pipeline.step("first", self.writeStep, "first", inputFile)
+        return pipeline.step("second", self.writeStep, "second", first[0])
+
+    def writeInput(self, data):
+        inputFile = os.path.join(self.dir, 'input.txt')
+        with open(inputFile, 'w') as f:
+            f.write(data)
+        return inputFile
+
+    def testResumeSkipsCompletedSteps(self):
+        inputFile = self.writeInput('a')
+        self.runSteps(inputFile, resume=False)
+        self.calls = []
+        result = self.runSteps(inputFile, resume=True)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(result, [os.path.join(self.dir, 'second.txt')])
+
+    def testChangedInputRerunsStep(self):
+        inputFile = self.writeInput('a')
+        self.runSteps(inputFile, resume=False)
+        self.calls = []
+        inputFile = self.writeInput('bb')
+        self.runSteps(inputFile, resume=True)
+        self.assertEqual(self.calls, ["first", "second"])
+        with open(os.path.join(self.dir, 'second.txt')) as f:
+            self.assertEqual(f.read(), 'bb')
+
+    def testMissingOutputRerunsStep(self):
+        inputFile = self.writeInput('a')
+        self.runSteps(inputFile, resume=False)
+        self.calls = []
+        os.remove(os.path.join(self.dir, 'second.txt'))
+        self.runSteps(inputFile, resume=True)
+        self.assertEqual(self.calls, ["second"])
+
+    def testRegeneratedInputOfLaterStep(self):
+        '''
+            A step outside the pipeline rewriting the input of a completed
+            step, as grooming without the pipeline would
+        '''
+        inputFile = self.writeInput('a')
+        self.runSteps(inputFile, resume=False)
+        self.calls = []
+        pipeline = Pipeline(self.stateFile, resume=True)
+        first = self.writeStep("first", self.writeInput('ccc'))
+        pipeline.step("first", lambda: first)
+        pipeline.step("second", self.writeStep, "second", first[0])
+        self.assertEqual(self.calls, ["first", "second"])
+
+    def testChangedInputFileRerunsNode(self):
+        '''
+            A node without dependencies only notices a changed input file
+            through its inputs
+        '''
+        inputFile = self.writeInput('a')
+        def runNodes(resume):
+            pipeline = Pipeline(self.stateFile, resume=resume)
+            pipeline.addNode("first", lambda: self.writeStep("first", inputFile), inputs=[inputFile])
+            pipeline.run()
+        runNodes(False)
+        self.calls = []
+        runNodes(True)
+        self.assertEqual(self.calls, [])
+        self.writeInput('bb')
+        runNodes(True)
+        self.assertEqual(self.calls, ["first"])
+
+    def testGroomNodesDeclareInputs(self):
+        segs = [self.writeInput('a'), os.path.join(self.dir, 'b.nrrd')]
+        imgs = [os.path.join(self.dir, 'a_img.nrrd'), os.path.join(self.dir, 'b_img.nrrd')]
+        pipeline = Pipeline(self.stateFile)
+        addGroomNodes(pipeline, self.dir + '/', segs)
+        self.assertEqual(pipeline.nodes["resample/b.nrrd"][2], [segs[1]])
+        pipeline = Pipeline(self.stateFile)
+        addGroomNodes(pipeline, self.dir + '/', segs, imgs)
+        self.assertEqual(pipeline.nodes["resample/b.nrrd"][2], [segs[1], imgs[1]])
+
+
+class ArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='artifact_store_test')
+        self.stateFile = os.path.join(self.dir, 'groom_artifacts.json')
+        self.products = []
+        for name in ['a', 'b']:
+            product = os.path.join(self.dir, name + '.DT.nrrd')
+            with open(product, 'w') as f:
+                f.write(name)
+            self.products.append(product)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testResumeLoadsRegistrations(self):
+        artifacts = ArtifactStore(self.stateFile)
+        artifacts.add('DT', os.path.join(self.dir, 'a.nrrd'), self.products[0])
+        artifacts.add('DT', os.path.join(self.dir, 'b.nrrd'), self.products[1])
+        resumed = ArtifactStore(self.stateFile, resume=True)
+        self.assertEqual(resumed.get('DT', os.path.join(self.dir, 'a.nrrd')), self.products[0])
+        self.assertEqual(resumed.getAll(os.path.join(self.dir, 'b.nrrd')), [('DT', self.products[1])])
+        self.assertIsNone(ArtifactStore(self.stateFile).get('DT', os.path.join(self.dir, 'a.nrrd')))
+
+    def testMissingProductIsDropped(self):
+        artifacts = ArtifactStore(self.stateFile)
+        artifacts.add('DT', os.path.join(self.dir, 'a.nrrd'), self.products[0])
+        artifacts.add('DT', os.path.join(self.dir, 'b.nrrd'), self.products[1])
+        os.remove(self.products[0])
+        resumed = ArtifactStore(self.stateFile, resume=True)
+        self.assertIsNone(resumed.get('DT', os.path.join(self.dir, 'a.nrrd')))
+        self.assertEqual(resumed.get('DT', os.path.join(self.dir, 'b.nrrd')), self.products[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
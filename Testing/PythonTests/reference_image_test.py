@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that the streaming FindReferenceImage of GroomUtils chooses the same
+reference as the dense in-memory computation it replaced
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+import GroomUtils
+
+
+def writeRawNrrd(filename, array):
+    types = {np.dtype(np.uint8): 'uchar', np.dtype(np.float32): 'float'}
+    header = ("NRRD0004\ntype: " + types[array.dtype] + "\ndimension: 3\nsizes: " +
+              " ".join(str(d) for d in reversed(array.shape)) + "\nencoding: raw\nendian: little\n\n")
+    with open(filename, 'wb') as f:
+        f.write(header.encode())
+        f.write(array.astype(array.dtype.newbyteorder('<')).tobytes())
+
+
+def denseReference(arrays):
+    '''
+        The original FindReferenceImage: every segmentation zero padded to
+        the largest size in memory, and the one closest to their mean
+    '''
+    refDim = np.max([a.shape for a in arrays], axis=0)
+    padded = np.asarray([np.pad(a, [(0, refDim[i] - a.shape[i]) for i in range(3)], mode='constant', constant_values=0)
+                         for a in arrays], dtype=np.float64)
+    mean = np.sum(padded, axis=0) / len(arrays)
+    return int(np.argmin(np.sqrt(np.sum((padded - mean) ** 2, axis=(1, 2, 3)))))
+
+
+class ReferenceImageTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='reference_image_test')
+        self.shapeIndex = GroomUtils.shapeIndex
+        GroomUtils.shapeIndex = None
+
+    def tearDown(self):
+        GroomUtils.shapeIndex = self.shapeIndex
+        shutil.rmtree(self.dir)
+
+    def writeSegmentations(self, seed, count, dtype):
+        rng = np.random.default_rng(seed)
+        files, arrays = [], []
+        for i in range(count):
+            shape = tuple(rng.integers(5, 10, size=3))
+            array = (rng.random(shape) < rng.uniform(0.2, 0.8)).astype(dtype)
+            filename = os.path.join(self.dir, 'seg' + str(seed) + '_' + str(i) + '.nrrd')
+            writeRawNrrd(filename, array)
+            files.append(filename)
+            arrays.append(array)
+        return files, arrays
+
+    def testMatchesDenseComputation(self):
+        for seed in range(5):
+            for dtype in (np.uint8, np.float32):
+                files, arrays = self.writeSegmentations(seed, 7, dtype)
+                expected = denseReference(arrays)
+                self.assertEqual(GroomUtils.findMedianImage(files), expected)
+                self.assertEqual(GroomUtils.findMedianImage(files, workers=3), expected)
+                self.assertEqual(GroomUtils.FindReferenceImage(files), files[expected])
+
+    def testDistances(self):
+        files, arrays = self.writeSegmentations(42, 5, np.uint8)
+        refDim = np.max([a.shape for a in arrays], axis=0)
+        padded = [np.pad(a, [(0, refDim[i] - a.shape[i]) for i in range(3)], mode='constant').astype(np.float64)
+                  for a in arrays]
+        mean = np.sum(padded, axis=0) / len(padded)
+        expected = [np.sqrt(np.sum((p - mean) ** 2)) for p in padded]
+        streamedMean = GroomUtils.sumSegmentations(files) / len(files)
+        np.testing.assert_allclose(streamedMean, mean)
+        np.testing.assert_allclose(GroomUtils.distancesToMean(files, streamedMean), expected, rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
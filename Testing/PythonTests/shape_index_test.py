@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the ShapeIndex of CommonUtils and of the groom steps that query it:
+the extent files of computeExtents, which must match those written by
+FindLargestBoundingBox --image, and the thumbnail ranking of
+FindReferenceImage
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+import GroomUtils
+
+
+def writeRawNrrd(filename, array, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0)):
+    types = {np.dtype(np.uint8): 'uchar', np.dtype(np.float32): 'float'}
+    header = ("NRRD0004\ntype: " + types[array.dtype] + "\ndimension: 3\nspace: left-posterior-superior\nsizes: " +
+              " ".join(str(d) for d in reversed(array.shape)) + "\nspace directions: " +
+              " ".join("(" + ",".join(str(spacing[i] if j == i else 0.0) for j in range(3)) + ")" for i in range(3)) +
+              "\nspace origin: (" + ",".join(str(x) for x in origin) + ")\nencoding: raw\nendian: little\n\n")
+    with open(filename, 'wb') as f:
+        f.write(header.encode())
+        f.write(array.astype(array.dtype.newbyteorder('<')).tobytes())
+
+
+def toolExtent(array):
+    '''
+        The extent file FindLargestBoundingBox --image writes for array:
+        the size, the smallest and the largest index of the voxels equal
+        to 1 (1e6 and 0 when there are none), in ITK (x, y, z) order, and
+        their count
+    '''
+    size = list(reversed(array.shape))
+    smallestIndex, largestIndex, volume = [1000000] * 3, [0] * 3, 0
+    for index in np.argwhere(array == 1):
+        index = list(reversed(index.tolist()))
+        smallestIndex = [min(a, b) for a, b in zip(smallestIndex, index)]
+        largestIndex = [max(a, b) for a, b in zip(largestIndex, index)]
+        volume += 1
+    return "%d %d %d\n%d %d %d\n%d %d %d\n%d\n" % tuple(size + smallestIndex + largestIndex + [volume])
+
+
+class ShapeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='shape_index_test')
+        self.shapeIndex = GroomUtils.shapeIndex
+        GroomUtils.setShapeIndex(os.path.join(self.dir, 'shape_index.sqlite'))
+        # the extents must come from the index rather than FindLargestBoundingBox
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.path.join(self.dir, 'bin')
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        GroomUtils.shapeIndex = self.shapeIndex
+        shutil.rmtree(self.dir)
+
+    def writeSegmentation(self, name, array, **kwargs):
+        filename = os.path.join(self.dir, name + '.nrrd')
+        writeRawNrrd(filename, array, **kwargs)
+        return filename
+
+    def testEntry(self):
+        # (z, y, x) of 3 x 4 x 5 voxels
+        array = np.zeros((3, 4, 5), dtype=np.uint8)
+        array[1, 2, 3] = 1
+        array[2, 1, 1] = 1
+        # not counted, as for the tools
+        array[0, 0, 4] = 2
+        filename = self.writeSegmentation('seg', array, spacing=(2.0, 1.0, 0.5), origin=(10.0, 20.0, 30.0))
+        GroomUtils.indexSegmentations('groomed', [filename])
+
+        entry = GroomUtils.shapeIndex.get(filename)
+        self.assertEqual(entry['dims'], [5, 4, 3])
+        self.assertEqual(entry['spacing'], [2.0, 1.0, 0.5])
+        self.assertEqual(entry['origin'], [10.0, 20.0, 30.0])
+        self.assertEqual(entry['foreground'], 2)
+        self.assertEqual(entry['smallestIndex'], [1, 1, 1])
+        self.assertEqual(entry['largestIndex'], [3, 2, 2])
+        np.testing.assert_allclose(entry['com'], [10.0 + 2.0 * 2.0, 20.0 + 1.5 * 1.0, 30.0 + 1.5 * 0.5])
+        self.assertEqual(entry['thumbnail'].shape, (1, 1, 2))
+
+        self.assertEqual([e['file'] for e in GroomUtils.shapeIndex.query('groomed')], [os.path.normpath(filename)])
+        self.assertEqual(GroomUtils.shapeIndex.query('aligned'), [])
+
+        # a modified file has no entry until it is indexed again
+        os.utime(filename, (os.path.getmtime(filename) + 10,) * 2)
+        self.assertIsNone(GroomUtils.shapeIndex.get(filename))
+
+    def testEmptyMask(self):
+        filename = self.writeSegmentation('empty', np.zeros((2, 3, 4), dtype=np.float32))
+        GroomUtils.indexSegmentations('groomed', [filename])
+        entry = GroomUtils.shapeIndex.get(filename)
+        self.assertEqual(entry['foreground'], 0)
+        self.assertIsNone(entry['com'])
+        self.assertEqual(entry['smallestIndex'], [1000000] * 3)
+        self.assertEqual(entry['largestIndex'], [0] * 3)
+
+    def testExtentFilesMatchTool(self):
+        rng = np.random.default_rng(3)
+        arrays = {'empty': np.zeros((4, 5, 6), dtype=np.uint8),
+                  'random': (rng.random((5, 6, 7)) < 0.1).astype(np.uint8) * rng.integers(1, 3, size=(5, 6, 7)).astype(np.uint8),
+                  'float': (rng.random((6, 4, 5)) < 0.2).astype(np.float32),
+                  'single': np.zeros((3, 3, 3), dtype=np.uint8)}
+        arrays['single'][0, 1, 2] = 1
+        files = [self.writeSegmentation(name, array) for name, array in arrays.items()]
+        GroomUtils.indexSegmentations('groomed', files)
+
+        extentFiles = GroomUtils.computeExtents(files)
+        self.assertEqual(extentFiles, [f + '.extent.txt' for f in files])
+        for extentFile, array in zip(extentFiles, arrays.values()):
+            with open(extentFile) as f:
+                self.assertEqual(f.read(), toolExtent(array))
+
+    def testThumbnailRanking(self):
+        # boxes aligned on the thumbnail blocks, so that the thumbnails are
+        # exact and the ranking agrees with the full resolution
+        boxes = [(12, 8, 8), (4, 8, 8), (8, 4, 12), (8, 8, 4), (4, 4, 8), (8, 12, 4)]
+        files, arrays = [], []
+        for i, box in enumerate(boxes):
+            array = np.zeros((12, 12, 12), dtype=np.uint8)
+            array[:box[0], :box[1], :box[2]] = 1
+            files.append(self.writeSegmentation('box' + str(i), array))
+            arrays.append(array.astype(np.float64))
+        GroomUtils.indexSegmentations('groomed', files)
+
+        mean = np.mean(arrays, axis=0)
+        expected = files[int(np.argmin([np.linalg.norm(a - mean) for a in arrays]))]
+
+        reads = []
+        readSegmentation = GroomUtils.readSegmentation
+        def countingRead(filename):
+            reads.append(filename)
+            return readSegmentation(filename)
+        GroomUtils.readSegmentation = countingRead
+        try:
+            self.assertEqual(GroomUtils.FindReferenceImage(files, candidates=2), expected)
+        finally:
+            GroomUtils.readSegmentation = readSegmentation
+        # only the candidates were read
+        self.assertEqual(len(reads), 2)
+        self.assertIn(expected, reads)
+
+        # a file missing from the index falls back to reading all of them
+        os.utime(files[0], (os.path.getmtime(files[0]) + 10,) * 2)
+        GroomUtils.readSegmentation = countingRead
+        reads[:] = []
+        try:
+            self.assertEqual(GroomUtils.FindReferenceImage(files, candidates=2), expected)
+        finally:
+            GroomUtils.readSegmentation = readSegmentation
+        self.assertEqual(len(reads), 2 * len(files))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of runSubjectCommands of CommonUtils, through applyPadding and a stub
+`shapeworks` that copies its input to its output after the delay written in
+the input, or fails when the input says so
+"""
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+import CommonUtils
+from CommonUtils import *
+from GroomUtils import applyPadding
+
+stubShapeworks = '''#!{python}
+import shutil, sys, time
+args = sys.argv[1:]
+if args == ['--help']:
+    sys.exit(0)
+inname = args[args.index('readimage') + 2]
+outname = args[args.index('writeimage') + 2]
+content = open(inname).read()
+if content == 'fail':
+    sys.exit(3)
+time.sleep(float(content))
+shutil.copyfile(inname, outname)
+'''
+
+
+class FailingCache:
+    '''
+        Cache whose lookups fail for one subject, to fail a job without a
+        SubjectProcessError
+    '''
+    def __init__(self, failing):
+        self.failing = failing
+
+    def getKey(self, inputs, commandList, outputs=()):
+        return inputs[0]
+
+    def fetch(self, key, outputs):
+        if key == self.failing:
+            raise RuntimeError("cache failure")
+        return False
+
+    def store(self, key, outputs):
+        pass
+
+
+class SubjectCommandsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='subject_commands_test')
+        binDir = os.path.join(self.dir, 'bin')
+        os.makedirs(binDir)
+        stub = os.path.join(binDir, 'shapeworks')
+        with open(stub, 'w') as f:
+            f.write(stubShapeworks.format(python=sys.executable))
+        os.chmod(stub, os.stat(stub).st_mode | stat.S_IEXEC)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = binDir + os.pathsep + self.path
+        # the stub has no --manifest, so the jobs go through runSubjectCommands
+        self.manifestSupport = CommonUtils.shapeworksManifestSupport
+        CommonUtils.shapeworksManifestSupport = None
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        CommonUtils.shapeworksManifestSupport = self.manifestSupport
+        shutil.rmtree(self.dir)
+
+    def writeInputs(self, contents):
+        inputDir = os.path.join(self.dir, 'input')
+        os.makedirs(inputDir, exist_ok=True)
+        files = []
+        for i, content in enumerate(contents):
+            inname = os.path.join(inputDir, 'subject' + str(i) + '.nrrd')
+            with open(inname, 'w') as f:
+                f.write(content)
+            files.append(inname)
+        return files
+
+    def testOutputsKeepInputOrder(self):
+        # the first subjects take the longest, so they finish last
+        contents = ['0.4', '0.3', '0.2', '0.1', '0', '0']
+        inputs = self.writeInputs(contents)
+        outputs = applyPadding(self.dir, inputs, None, 10, workers=4)
+        self.assertEqual([os.path.basename(f) for f in outputs],
+                         [os.path.basename(f).replace('.nrrd', '.pad.nrrd') for f in inputs])
+        for output, content in zip(outputs, contents):
+            with open(output) as f:
+                self.assertEqual(f.read(), content)
+
+    def testFailingSubjectIsReported(self):
+        for workers in [1, 4]:
+            inputs = self.writeInputs(['0.2', 'fail', '0', 'fail'])
+            with self.assertRaises(SubjectProcessError) as context:
+                applyPadding(self.dir, inputs, None, 10, workers=workers)
+            # the first failure in input order
+            self.assertEqual(context.exception.subject, inputs[1])
+            self.assertEqual(context.exception.returncode, 3)
+            self.assertIn(inputs[1], str(context.exception))
+
+    def testMissingToolIsReported(self):
+        with self.assertRaises(SubjectProcessError) as context:
+            runSubjectCommands([('subject0', [[os.path.join(self.dir, 'missing_tool')]])], workers=2)
+        self.assertEqual(context.exception.subject, 'subject0')
+
+    def testOtherFailureCancelsPendingJobs(self):
+        inputs = self.writeInputs(['0'] + ['0.3'] * 8)
+        outputs = [inname.replace('.nrrd', '.out.nrrd') for inname in inputs]
+        jobs = [(inname, [["shapeworks", "readimage", "--name", inname, "writeimage", "--name", outname]], [inname], [outname])
+                for inname, outname in zip(inputs, outputs)]
+        with self.assertRaises(RuntimeError):
+            runSubjectCommands(jobs, workers=2, cache=FailingCache(inputs[0]))
+        self.assertFalse(os.path.exists(outputs[-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the shapeworks worker pool of CommonUtils, against a stub
+`shapeworks serve` that answers "ok", hangs or exits depending on the
+first argument of the command
+"""
+import os
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Examples', 'Python'))
+from CommonUtils import *
+
+stubServe = '''#!/usr/bin/env python3
+import os, socket, sys, time
+path = sys.argv[sys.argv.index('--socket') + 1]
+if os.path.exists(path):
+    os.unlink(path)
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(path)
+server.listen(1)
+connection, _ = server.accept()
+reader = connection.makefile('rb')
+for line in reader:
+    args = line.rstrip(b'\\n').split(b'\\0')
+    if args[0] == b'hang':
+        time.sleep(60)
+    if args[0] == b'exit':
+        sys.exit(1)
+    connection.sendall(b'ok 0\\n')
+'''
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "shapeworks serve needs unix domain sockets")
+class ShapeworksWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.binDir = tempfile.mkdtemp(prefix='workers_test')
+        stub = os.path.join(self.binDir, 'shapeworks')
+        with open(stub, 'w') as f:
+            f.write(stubServe)
+        os.chmod(stub, os.stat(stub).st_mode | stat.S_IEXEC)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.binDir + os.pathsep + self.path
+        self.workers = ShapeworksWorkers(count=1, timeout=2)
+
+    def tearDown(self):
+        self.workers.close()
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.binDir)
+
+    def testRun(self):
+        self.assertEqual(self.workers.run(['shapeworks', 'readimage'])[0], 0)
+
+    def testExitedWorkerIsRestarted(self):
+        returncode, usage = self.workers.run(['shapeworks', 'exit'])
+        self.assertEqual(returncode, 1)
+        self.assertEqual(usage['message'], "shapeworks worker stopped")
+        self.assertEqual(self.workers.run(['shapeworks', 'readimage'])[0], 0)
+
+    def testHungWorkerTimesOut(self):
+        start = time.time()
+        self.assertEqual(self.workers.run(['shapeworks', 'hang'])[0], 1)
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(self.workers.run(['shapeworks', 'readimage'])[0], 0)
+
+    def testFailedRestartKeepsTheWorker(self):
+        self.workers.run(['shapeworks', 'exit'])
+        os.environ['PATH'] = self.path  # the restart can't find shapeworks
+        self.assertEqual(self.workers.run(['shapeworks', 'readimage'])[0], 1)
+        os.environ['PATH'] = self.binDir + os.pathsep + self.path
+        self.assertEqual(self.workers.run(['shapeworks', 'readimage'])[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
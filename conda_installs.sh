@@ -53,6 +53,7 @@ function install_conda() {
        requests=2.22.0 \
        geotiff=1.5.1 \
        numpy=1.17.4 \
+       pybind11=2.4.3 \
        git-lfs=2.6.1 \
        openblas=0.3.3
   then return 1; fi
@@ -79,6 +80,7 @@ function install_conda() {
   if ! pip install matplotlib==3.1.2; then return 1; fi
   if ! pip install itk==5.0.1; then return 1; fi
   if ! pip install -e Python/DatasetUtilsPackage; then return 1; fi   # install the local GirderConnector code as a package
+  if ! pip install -e Examples/Python; then return 1; fi               # install the groom/optimize/analyze utilities as a package
 
   # install any additional Linux dependencies
   if [ "$(uname)" = "Linux" ]; then